@@ -1,32 +1,130 @@
 __version__ = "0.0.2"
 
+# Functions from the library interface, imported on first use so that the command line tool does not pay for them.
+_API_FUNCTIONS = {
+    "decrypt_many": "libheysops.api",
+    "encrypt_many": "libheysops.api",
+    "get_secret": "libheysops.api",
+}
+
+
+def __getattr__(name: str):
+    if name in _API_FUNCTIONS:
+        import importlib
+
+        return getattr(importlib.import_module(_API_FUNCTIONS[name]), name)
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
+
+# Every action's command name, mapped to the module and class holding its logic and its one line help. Kept here so
+# the command line can list every action while only importing the one that runs.
+_ACTIONS = {
+    "init": (
+        "libheysops.init.init",
+        "Init",
+        "Creates the .heysops.yaml file in the current directory. If `-c` or `--config` is specified, "
+        "it will create the .heysops.yaml at that path. Please be sure that the specified path uses the "
+        "file name .heysops.yaml.",
+    ),
+    "encrypt": (
+        "libheysops.encrypt.encrypt",
+        "Encrypt",
+        "Encrypts all files that were previously encrypted with this tool. Uses the .heysops.yaml file "
+        "in the local directory. If .heysops.yaml is not found in the current directory, it traverses "
+        "upwards until it finds one. If it doesn't find one, it warns and exits.",
+    ),
+    "decrypt": (
+        "libheysops.decrypt.decrypt",
+        "Decrypt",
+        "If no files are specified, it looks for a file named .heysops.yaml in the local directory. "
+        "If .heysops.yaml is not found in the current directory, it traverses upwards until it finds one. "
+        "If it doesn't find one, it warns and exits. Prompts if the decrypted file name already exists.",
+    ),
+    "clean": (
+        "libheysops.clean.clean",
+        "Clean",
+        "Encrypts the decrypted files that changed since they were last encrypted. Then removes all decrypted files.",
+    ),
+    "forget": (
+        "libheysops.forget.forget",
+        "Forget",
+        "Remove a file from the .heysops.yaml. This will leave the file on the system and no "
+        "longer interact with it through other commands.",
+    ),
+    "exec": (
+        "libheysops.exec.exec",
+        "Exec",
+        "Run a command with decrypted dotenv, json and yaml secrets, without writing them to disk. "
+        "Each top level key becomes an environment variable, unless --fd is used.",
+    ),
+    "agent": (
+        "libheysops.agent.agent",
+        "Agent",
+        "Run a local agent that keeps decrypted secrets in memory. While it runs, decrypt, exec and the library "
+        "API get decrypted content from it instead of running sops each time.",
+    ),
+    "watch": (
+        "libheysops.watch.watch",
+        "Watch",
+        "Watch the decrypted files in the configuration and encrypt each one again once it is saved.",
+    ),
+    "status": (
+        "libheysops.status.status",
+        "Status",
+        "Report which secrets are up to date, and which need to be encrypted or decrypted, without running sops.",
+    ),
+}
+
 
 class Action:
     """An interface class, allowing us to easily extend heysops and add new plugins."""
 
+    @staticmethod
+    def get_action_names() -> list:
+        """Provides the argparse sub-parser command name of every action, without importing any of them.
+
+        Returns:
+            list: The command names, in the order they are listed in the help.
+        """
+        return list(_ACTIONS)
+
+    @staticmethod
+    def get_action_help(action_name: str) -> str:
+        """Provides the one line help of an action, without importing it.
+
+        Args:
+            action_name: The argparse sub-parser command name.
+
+        Returns:
+            str: The help text.
+        """
+        return _ACTIONS[action_name][2]
+
+    @staticmethod
+    def get_action(action_name: str) -> type:
+        """Imports the class containing the logic for a single action.
+
+        Args:
+            action_name: The argparse sub-parser command name.
+
+        Returns:
+            type: The class that holds the logic for that command.
+        """
+        import importlib
+
+        module_name, class_name = _ACTIONS[action_name][:2]
+        return getattr(importlib.import_module(module_name), class_name)
+
     @staticmethod
     def get_actions() -> dict:
         """Provides a dictionary mapping action command names from argparse to the classes containing
-        the logic for the action
+        the logic for the action. Imports every action; prefer get_action when only one is needed.
 
         Returns:
             dict: Keys match the argparse sub-parser command name, and the corresponding values are the classes that
               hold the logic for that command.
         """
-        # Prevent circular imports
-        from .encrypt.encrypt import Encrypt
-        from .decrypt.decrypt import Decrypt
-        from .forget.forget import Forget
-        from .init.init import Init
-        from .clean.clean import Clean
-
-        return {
-            "init": Init,
-            "encrypt": Encrypt,
-            "decrypt": Decrypt,
-            "clean": Clean,
-            "forget": Forget,
-        }
+        return {action_name: Action.get_action(action_name) for action_name in _ACTIONS}
 
     @staticmethod
     def init(**kwargs) -> None:
@@ -38,17 +136,31 @@ class Action:
 
     @staticmethod
     def encrypt(**kwargs):
-        """Instantiates the Encrypt class and invokes start() method, passing kwargs to each"""
+        """Instantiates the Encrypt class and invokes start() method, passing kwargs to each, or runs it for every
+        configuration found with `--recursive`"""
         from .encrypt.encrypt import Encrypt
 
+        if kwargs.get("recursive"):
+            from .recursive import run_recursive
+
+            run_recursive(Encrypt, **kwargs)
+            return None
+
         encrypt = Encrypt(**kwargs)
         encrypt.start(**kwargs)
 
     @staticmethod
     def decrypt(**kwargs):
-        """Instantiates the Decrypt class and invokes start() method, passing kwargs to each"""
+        """Instantiates the Decrypt class and invokes start() method, passing kwargs to each, or runs it for every
+        configuration found with `--recursive`"""
         from .decrypt.decrypt import Decrypt
 
+        if kwargs.get("recursive"):
+            from .recursive import run_recursive
+
+            run_recursive(Decrypt, **kwargs)
+            return None
+
         decrypt = Decrypt(**kwargs)
         decrypt.start(**kwargs)
 
@@ -62,8 +174,56 @@ class Action:
 
     @staticmethod
     def clean(**kwargs):
-        """Instantiates the Clean class and invokes start() method, passing kwargs to each"""
+        """Instantiates the Clean class and invokes start() method, passing kwargs to each, or runs it for every
+        configuration found with `--recursive`"""
         from .clean.clean import Clean
 
+        if kwargs.get("recursive"):
+            from .recursive import run_recursive
+
+            run_recursive(Clean, **kwargs)
+            return None
+
         clean = Clean(**kwargs)
         clean.start(**kwargs)
+
+    @staticmethod
+    def exec(**kwargs):
+        """Instantiates the Exec class and invokes start() method, passing kwargs to each, then exits with the exit
+        code of the command it ran"""
+        from .exec.exec import Exec
+
+        exec_action = Exec(**kwargs)
+        exec_action.start(**kwargs)
+        raise SystemExit(exec_action.returncode)
+
+    @staticmethod
+    def agent(**kwargs):
+        """Instantiates the Agent class and invokes start() method, passing kwargs to each"""
+        from .agent.agent import Agent
+
+        agent = Agent(**kwargs)
+        agent.start(**kwargs)
+
+    @staticmethod
+    def watch(**kwargs):
+        """Instantiates the Watch class and invokes start() method, passing kwargs to each"""
+        from .watch.watch import Watch
+
+        watch = Watch(**kwargs)
+        watch.start(**kwargs)
+
+    @staticmethod
+    def status(**kwargs):
+        """Instantiates the Status class and invokes start() method, passing kwargs to each, or runs it for every
+        configuration found with `--recursive`, then exits with its return code"""
+        from .status.status import Status
+
+        if kwargs.get("recursive"):
+            from .recursive import run_recursive
+
+            raise SystemExit(run_recursive(Status, **kwargs))
+
+        status = Status(**kwargs)
+        status.start(**kwargs)
+        raise SystemExit(status.returncode)
@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import threading
+from typing import Tuple, Union
+
+from libheysops import Action
+from libheysops.agent.client import get_socket_path, send_request
+from libheysops.decrypt.decrypt import Decrypt
+from libheysops.engine import run_sync
+from libheysops.secret_cache import SecretCache
+from libheysops.state import StateStore
+
+logger = logging.getLogger()
+
+
+class Agent(Decrypt):
+    """A long-running process that decrypts files on behalf of other heysops commands, and keeps the decrypted
+    content in memory.
+
+    The agent listens on a Unix socket only accessible by the current user. Decrypted content is served from memory
+    until it expires or the encrypted file's content changes, so repeated commands skip both starting sops and the
+    key service round trip. The decrypted content is never written to disk by the agent.
+
+    Keyword Args:
+        ttl: The number of seconds decrypted content is kept for.
+        max_entries: The number of decrypted files to keep in memory.
+    """
+
+    def __init__(self, **kwargs):
+        # The agent serves the files of any configuration, so it does not load one
+        self.setup_options(**kwargs)
+        self.config_path = None
+        self.config = {}
+        self.state = StateStore()
+        self.sops, self.sops_version = run_sync(
+            self._probe_sops_async(sops_executable=os.environ.get("SOPS_PATH"))
+        )
+        self.cache = SecretCache(
+            ttl=kwargs.get("ttl") or 300, max_entries=kwargs.get("max_entries") or 128
+        )
+        self._stopped = None
+
+    def run(self, **kwargs) -> None:
+        """Entry point for this action's operation
+
+        Serves requests until stopped with `heysops agent --stop`, SIGINT or SIGTERM.
+
+        Args:
+            **kwargs: The keyword arguments from the command line.
+
+        Keyword Args:
+            stop: Stop the running agent instead of starting one.
+
+        Raises:
+            FileExistsError: If another agent is already listening on the socket.
+
+        Returns:
+            None.
+        """
+        if kwargs.get("stop"):
+            if run_sync(send_request({"op": "stop"}, timeout=self.timeout)) is None:
+                logger.warning("No heysops agent is running.")
+            return None
+
+        run_sync(self.serve(get_socket_path()))
+
+    async def serve(
+        self, socket_path: str, ready: Union[threading.Event, None] = None
+    ) -> None:
+        """Listen on the socket until a stop request or signal is received.
+
+        Args:
+            socket_path: The path of the Unix socket to create.
+            ready: Set once the socket accepts connections.
+
+        Raises:
+            FileExistsError: If another agent is already listening on the socket.
+
+        Returns:
+            None
+        """
+        if os.path.exists(socket_path):
+            if await send_request({"op": "ping"}, socket_path=socket_path) is not None:
+                raise FileExistsError(
+                    "A heysops agent is already listening on {}.".format(socket_path)
+                )
+            # Left behind by an agent that did not exit cleanly
+            os.remove(socket_path)
+
+        self._stopped = asyncio.Event()
+        # The socket must never be accessible by other users, not even between its creation and the chmod
+        old_umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(
+                self.handle_connection, path=socket_path
+            )
+        finally:
+            os.umask(old_umask)
+        os.chmod(socket_path, 0o600)
+
+        loop = asyncio.get_running_loop()
+        for signal_number in [signal.SIGINT, signal.SIGTERM]:
+            try:
+                loop.add_signal_handler(signal_number, self._stopped.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Only the main thread can handle signals
+                pass
+
+        logger.info("heysops agent listening on {}".format(socket_path))
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await self._stopped.wait()
+        finally:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            logger.info("heysops agent stopped")
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answer a single request.
+
+        Args:
+            reader: The client's request stream.
+            writer: The stream to send the response to.
+
+        Returns:
+            None
+        """
+        try:
+            request = json.loads((await reader.readline()).decode("utf-8"))
+            data = b""
+            if request.get("op") == "decrypt":
+                data = await self.decrypt_request(request)
+            elif request.get("op") == "stop":
+                self._stopped.set()
+            elif request.get("op") != "ping":
+                raise ValueError("Unknown request {}".format(request.get("op")))
+            response = {"ok": True, "size": len(data)}
+        except (OSError, ValueError, AttributeError) as e:
+            data = b""
+            response = {"ok": False, "error": str(e)}
+
+        try:
+            writer.write(json.dumps(response).encode("utf-8") + b"\n")
+            writer.write(data)
+            await writer.drain()
+        except ConnectionError as e:
+            logger.debug("heysops agent client went away: {}".format(e))
+        finally:
+            writer.close()
+
+    async def decrypt_request(self, request: dict) -> bytes:
+        """Get the decrypted content of a file, from memory if it is still current.
+
+        Args:
+            request: The decrypt request, with the absolute "path" of the encrypted file and optional "input_type"
+              and "output_type".
+
+        Raises:
+            ValueError: If the path is not absolute.
+            OSError: If the file could not be decrypted.
+
+        Returns:
+            bytes: The decrypted content.
+        """
+        file_path = request.get("path")
+        if not isinstance(file_path, str) or not os.path.isabs(file_path):
+            raise ValueError("The path to decrypt must be absolute.")
+        input_type, output_type = request.get("input_type"), request.get("output_type")
+
+        # The cache blocks while hashing or decrypting, so it runs on a worker thread
+        return await asyncio.get_running_loop().run_in_executor(
+            None,
+            self.cache.get,
+            (file_path, input_type, output_type),
+            lambda: self.load_secret(file_path, input_type, output_type),
+        )
+
+    def load_secret(
+        self,
+        file_path: str,
+        input_type: Union[str, None] = None,
+        output_type: Union[str, None] = None,
+    ) -> Tuple[bytes, str, dict]:
+        """Decrypt a file with sops, for the cache.
+
+        Args:
+            file_path: The absolute path of the encrypted file.
+            input_type: The --input-type to pass to sops.
+            output_type: The --output-type to pass to sops.
+
+        Raises:
+            FileNotFoundError: If the encrypted file does not exist.
+            OSError: If sops failed or did not finish within the timeout.
+
+        Returns:
+            tuple: The decrypted content, the encrypted file path, and its snapshot taken before decrypting.
+        """
+        snapshot = StateStore.snapshot(file_path)
+        if snapshot is None:
+            raise FileNotFoundError("{} does not exist.".format(file_path))
+
+        sops_args = [self.sops]
+        if input_type:
+            sops_args += ["--input-type", input_type]
+        if output_type:
+            sops_args += ["--output-type", output_type]
+        sops_args += ["-d", file_path]
+        sops_run = run_sync(self.run_sops_checked(sops_args))
+        logger.info("Decrypted {} into memory".format(file_path))
+        return sops_run.stdout, file_path, snapshot
+
+    @staticmethod
+    def argparse_sub_parser(sub_parser) -> argparse.Action:
+        """CLI Argument definitions
+
+        Args:
+            sub_parser: The sub-command parser object from the main argparse instance.
+
+        Returns:
+            argparse.Action: The defined action object.
+        """
+        cli_agent = sub_parser.add_parser("agent", help=Action.get_action_help("agent"))
+        cli_agent.add_argument(
+            "--ttl",
+            help="The number of seconds to keep decrypted content in memory.",
+            type=float,
+            default=300,
+        )
+        cli_agent.add_argument(
+            "--max-entries",
+            help="The number of decrypted files to keep in memory.",
+            type=int,
+            default=128,
+        )
+        cli_agent.add_argument(
+            "--stop", help="Stop the running agent.", action="store_true"
+        )
+        return cli_agent
@@ -0,0 +1,159 @@
+"""Client side of the heysops agent protocol.
+
+Requests and response headers are single lines of JSON. A successful decrypt response header is followed by the
+number of bytes of decrypted content it announces.
+
+Environment Variables:
+    HEYSOPS_AGENT_SOCK: The path to the agent's Unix socket. Defaults to `agent.sock` within the cache directory.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from typing import IO, Union
+
+from libheysops.cache import get_cache_dir
+
+logger = logging.getLogger()
+
+# The number of bytes of a response copied into the output file at a time
+CHUNK_SIZE = 64 * 1024
+
+
+def get_socket_path() -> str:
+    """Get the path of the agent's Unix socket.
+
+    Returns:
+        str: The path, whether or not an agent is listening on it.
+    """
+    return os.environ.get("HEYSOPS_AGENT_SOCK") or os.path.join(
+        get_cache_dir(), "agent.sock"
+    )
+
+
+async def copy_content(
+    reader: asyncio.StreamReader, stdout: IO[bytes], size: int
+) -> None:
+    """Copy the content of a response into a file, without holding more than a chunk of it in memory.
+
+    Args:
+        reader: The response stream, positioned after the response header.
+        stdout: The open file to write the content to.
+        size: The number of bytes announced by the response header.
+
+    Raises:
+        asyncio.IncompleteReadError: If the agent closed the connection before sending all of the content.
+
+    Returns:
+        None
+    """
+    loop = asyncio.get_running_loop()
+    remaining = size
+    while remaining:
+        chunk = await reader.read(min(remaining, CHUNK_SIZE))
+        if not chunk:
+            raise asyncio.IncompleteReadError(b"", remaining)
+        # Writing to disk blocks, so it runs on a worker thread
+        await loop.run_in_executor(None, stdout.write, chunk)
+        remaining -= len(chunk)
+
+
+async def send_request(
+    request: dict,
+    timeout: Union[float, None] = None,
+    socket_path: Union[str, None] = None,
+    stdout: Union[IO[bytes], None] = None,
+) -> Union[bytes, None]:
+    """Send a request to the agent, if one is running.
+
+    Args:
+        request: The request, with an "op" of "ping", "decrypt" or "stop".
+        timeout: The number of seconds to wait for the response. None waits forever.
+        socket_path: The agent's socket. Defaults to get_socket_path().
+        stdout: An open file to copy the content sent after the response header into, a chunk at a time. If None,
+          the content is returned.
+
+    Raises:
+        OSError: If the agent could not complete the request, or did not respond within the timeout.
+
+    Returns:
+        bytes: The content sent after the response header, which is empty for requests other than decrypt or when
+          it was copied into stdout. None if no agent is listening, so that the caller can do the work itself.
+    """
+    socket_path = socket_path or get_socket_path()
+    if os.name == "nt" or not os.path.exists(socket_path):
+        return None
+
+    try:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+    except OSError as e:
+        logger.debug("heysops agent at {} is not available: {}".format(socket_path, e))
+        return None
+
+    start_position = stdout.tell() if stdout is not None else None
+    try:
+        writer.write(json.dumps(request).encode("utf-8") + b"\n")
+        await writer.drain()
+        header = json.loads(
+            (await asyncio.wait_for(reader.readline(), timeout)).decode("utf-8")
+        )
+        if not header.get("ok"):
+            raise OSError(header.get("error", "The heysops agent failed"))
+        if stdout is None:
+            return await asyncio.wait_for(
+                reader.readexactly(header.get("size", 0)), timeout
+            )
+        await asyncio.wait_for(
+            copy_content(reader, stdout, header.get("size", 0)), timeout
+        )
+        return b""
+    except asyncio.TimeoutError:
+        raise OSError(
+            "The heysops agent did not respond within {} seconds.".format(timeout)
+        )
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+        # A broken or outdated agent should not stop the caller from decrypting
+        logger.warning("Ignoring the heysops agent at {}: {}".format(socket_path, e))
+        if stdout is not None:
+            # The caller decrypts the file itself, into the same file
+            stdout.seek(start_position)
+            stdout.truncate()
+        return None
+    finally:
+        writer.close()
+
+
+async def decrypt_with_agent(
+    file_path: str,
+    input_type: Union[str, None] = None,
+    output_type: Union[str, None] = None,
+    timeout: Union[float, None] = None,
+    stdout: Union[IO[bytes], None] = None,
+) -> Union[bytes, None]:
+    """Decrypt a file through the agent, if one is running.
+
+    Args:
+        file_path: The absolute path of the sops encrypted file.
+        input_type: The --input-type to pass to sops. If None, sops will pick.
+        output_type: The --output-type to pass to sops. If None, sops will pick.
+        timeout: The number of seconds to wait for the agent. None waits forever.
+        stdout: An open file to write the decrypted content to. If None, the content is returned.
+
+    Raises:
+        OSError: If the agent could not decrypt the file.
+
+    Returns:
+        bytes: The decrypted content, empty if it was written to stdout, or None if no agent is listening. When None,
+          stdout is left as it was.
+    """
+    return await send_request(
+        {
+            "op": "decrypt",
+            "path": os.path.abspath(file_path),
+            "input_type": input_type,
+            "output_type": output_type,
+        },
+        timeout=timeout,
+        stdout=stdout,
+    )
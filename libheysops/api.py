@@ -0,0 +1,162 @@
+"""Library interface, for callers that use heysops from within their own process.
+
+decrypt_many and encrypt_many are coroutines, for callers that run heysops within their own event loop. get_secret
+serves decrypted secrets from an in-memory cache, for long-running services.
+
+Examples:
+    >>> import asyncio
+    >>> import libheysops
+    >>> asyncio.run(libheysops.decrypt_many(config="path/to/.heysops.yaml", jobs=8))
+    >>> libheysops.get_secret("config/db.json")["password"]
+"""
+
+import copy
+import json
+import os
+from typing import Dict, List, Tuple, Union
+
+from libheysops.base import BaseAction
+from libheysops.engine import run_sync
+from libheysops.secret_cache import SecretCache
+from libheysops.state import StateStore
+
+# Shared by every thread of the process. Adjust its ttl and max_entries, or clear() it, as needed.
+secret_cache = SecretCache()
+
+
+async def decrypt_many(
+    files: Union[List[str], None] = None,
+    config: Union[str, None] = None,
+    force: bool = False,
+    jobs: int = 1,
+    timeout: Union[float, None] = None,
+) -> Dict[str, Union[OSError, None]]:
+    """Decrypt files tracked by a heysops configuration file.
+
+    Args:
+        files: The encrypted or decrypted file paths to decrypt. If None, all files in the configuration are decrypted.
+        config: The path to a heysops configuration file. If None, it is searched for from the current directory.
+        force: Whether existing decrypted files may be overwritten.
+        jobs: The number of sops invocations to run concurrently.
+        timeout: The number of seconds to wait for each sops invocation. None waits forever.
+
+    Returns:
+        dict: Maps each requested file to None if it was decrypted, or to the OSError describing why it was not.
+    """
+    from libheysops.decrypt.decrypt import Decrypt
+
+    sops, sops_version = await BaseAction._probe_sops_async(os.environ.get("SOPS_PATH"))
+    decrypt = Decrypt(
+        config=config,
+        force=force,
+        timeout=timeout,
+        sops=sops,
+        sops_version=sops_version,
+    )
+    try:
+        results = await decrypt.decrypt_files(encrypted_file_paths=files, jobs=jobs)
+    finally:
+        decrypt.flush_config()
+        decrypt.state.save()
+    return {file_path: error for file_path, _, error in results}
+
+
+async def encrypt_many(
+    files: Union[List[str], None] = None,
+    config: Union[str, None] = None,
+    input_type: Union[str, None] = None,
+    jobs: int = 1,
+    timeout: Union[float, None] = None,
+) -> Dict[str, Union[OSError, None]]:
+    """Encrypt files and record them in a heysops configuration file.
+
+    Args:
+        files: The decrypted file paths to encrypt. If None, all files in the configuration are encrypted.
+        config: The path to a heysops configuration file. If None, it is searched for from the current directory.
+        input_type: The --input-type to pass to sops. If None, the type stored in the configuration is used.
+        jobs: The number of sops invocations to run concurrently.
+        timeout: The number of seconds to wait for each sops invocation. None waits forever.
+
+    Returns:
+        dict: Maps each file that is still present to None if it was encrypted, or to the OSError describing why
+          it was not.
+    """
+    from libheysops.encrypt.encrypt import Encrypt
+
+    sops, sops_version = await BaseAction._probe_sops_async(os.environ.get("SOPS_PATH"))
+    encrypt = Encrypt(
+        config=config,
+        timeout=timeout,
+        sops=sops,
+        sops_version=sops_version,
+    )
+    try:
+        results = await encrypt.encrypt_files(
+            decrypted_file_paths=files, input_type=input_type, jobs=jobs
+        )
+    finally:
+        encrypt.flush_config()
+        encrypt.state.save()
+    return {file_path: error for file_path, _, error in results}
+
+
+def get_secret(
+    file_path: str, config: Union[str, None] = None, raw: bool = False
+) -> Union[bytes, dict, list]:
+    """Decrypt a tracked secret into memory, serving repeated reads from the process wide secret_cache.
+
+    The cached value is used until it expires, is evicted, or the encrypted file changes. This function may be called
+    from several threads at once; concurrent reads of the same missing secret run sops once.
+
+    Args:
+        file_path: The encrypted or decrypted path of the secret, as listed in the configuration.
+        config: The path to a heysops configuration file. If None, it is searched for from the current directory.
+        raw: Whether to return the decrypted bytes of a dotenv, json or yaml secret rather than parsing it.
+
+    Raises:
+        ValueError: If the secret is not tracked by the configuration.
+        OSError: If the secret could not be decrypted.
+
+    Returns:
+        The parsed content of dotenv, json and yaml secrets, unless raw is set, and the decrypted bytes otherwise.
+    """
+    config_path = os.path.abspath(BaseAction.find_config(config_file_path=config))
+    value = secret_cache.get(
+        (config_path, file_path, raw),
+        lambda: _load_secret(config_path, file_path, raw),
+    )
+    # Callers may modify what they are given, without changing what the next caller gets
+    return value if isinstance(value, bytes) else copy.deepcopy(value)
+
+
+def _load_secret(
+    config_path: str, file_path: str, raw: bool
+) -> Tuple[Union[bytes, dict, list], str, Union[dict, None]]:
+    from libheysops.decrypt.decrypt import Decrypt
+
+    decrypt = Decrypt(config=config_path)
+    config_entry = decrypt.find_file_in_config(file_path=file_path)
+    if not config_entry:
+        raise ValueError("{} not found in configuration.".format(file_path))
+
+    encrypted_path = decrypt.get_absolute_path(config_entry["encrypted_path"])
+    snapshot = StateStore.snapshot(encrypted_path)
+    secret_format = decrypt.get_secret_format(config_entry)
+    if raw or not secret_format:
+        data = run_sync(
+            decrypt.decrypt_to_memory_async(
+                config_entry["encrypted_path"],
+                input_type=secret_format,
+                output_type=secret_format or config_entry.get("type"),
+            )
+        )
+        return data, encrypted_path, snapshot
+
+    data = run_sync(
+        decrypt.decrypt_to_memory_async(
+            config_entry["encrypted_path"],
+            input_type=secret_format,
+            output_type="json",
+        )
+    )
+    return json.loads(data.decode("utf-8")), encrypted_path, snapshot
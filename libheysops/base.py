@@ -1,9 +1,45 @@
 import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import logging
 import os
-import subprocess
-from typing import Union, List
-
-from ruamel.yaml import YAML
+import stat
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Tuple,
+    Union,
+)
+
+from libheysops import stats
+from libheysops.cache import load_compiled_file, save_compiled_file
+from libheysops.engine import DEFAULT_RETRIES, probe_sops, run_sync
+from libheysops.fileio import (
+    DURABILITY_BATCH,
+    DURABILITY_LEVELS,
+    DURABILITY_STRICT,
+    StagedOutputs,
+    atomic_output,
+    write_file_atomic,
+)
+from libheysops.secrets_table import SecretsTable
+from libheysops.state import (
+    CIPHERTEXT,
+    PLAINTEXT,
+    RACY_WINDOW_NS,
+    StateStore,
+    file_signature,
+)
+
+logger = logging.getLogger()
 
 CONFIG_TEMPLATE = """---
 project:
@@ -20,6 +56,10 @@ secrets:
 
 """
 
+# Files found by BaseAction.find_file_in_parents, keyed by the absolute directory the search started from and the
+# names searched for
+_found_in_parents = {}  # type: Dict[Tuple[str, Tuple[str, ...]], str]
+
 
 class SopsNotFoundError(Exception):
     def __init__(self, path: Union[str, None] = None):
@@ -46,31 +86,103 @@ class BaseAction:
         force: Boolean value for whether overwriting operations should be allowed.
         config_path: The path to a heysops configuration file to load
         config: The loaded heysops configuration file data
-        sops: The path to the sops executable
+        sops: The path to the sops executable. None for actions whose uses_sops is False.
+        sops_version: The version of the sops executable
+        uses_sops: Whether the action runs sops. If False, the sops executable is not looked up.
+        timeout: The number of seconds to wait for each sops invocation. None waits forever.
+        retries: The number of times to retry a sops invocation that timed out or failed transiently.
+        hedge: Whether to start a duplicate of a sops invocation that is slower than 95% of those before it.
+        pool: A semaphore shared with the actions of other configurations, bounding their combined sops
+          invocations. None when the action runs on its own.
+        durability: How the files written are flushed to disk: "none", "batch" or "strict".
+        staged_outputs: The output files of the batch in progress, moved into place once batch_outputs exits. None
+          outside of a batch, or when durability is "strict".
+        state: The recorded plaintext and ciphertext of each secret, as of the last encrypt or decrypt.
 
     Environment Variables:
         SOPS_PATH: The path to the sops executable to us. Defaults to the system path.
+        HEYSOPS_DURABILITY: The durability to use when none is given. Defaults to "batch".
 
     Keyword Args:
         force: Boolean value for whether overwriting operations should be allowed.
         config: The path to a heysops configuration file to load
-
+        timeout: The number of seconds to wait for each sops invocation.
+        retries: The number of times to retry a sops invocation that timed out or failed transiently.
+        hedge: Whether to start a duplicate of a sops invocation that is slower than 95% of those before it.
+        sops: The path to an already verified sops executable, skipping the lookup.
+        sops_version: The version of the sops executable given as sops.
+        pool: A semaphore shared with the actions of other configurations, used in place of jobs.
+        durability: How the files written are flushed to disk: "none", "batch" or "strict".
 
     """
 
     config_filename_1 = ".heysops.yaml"
     config_filename_2 = ".heysops.yml"
+    # Actions that never run sops set this to False, to skip finding and probing the sops executable
+    uses_sops = True
+    force = False
+    timeout = None
+    retries = DEFAULT_RETRIES
+    hedge = False
+    sops_version = None
+    pool = None
+    durability = DURABILITY_BATCH
+    staged_outputs = None
+    # The (config, secrets list, SecretsTable) the secrets property was built from
+    _secrets = None
+    _config_modified = False
 
     def __init__(self, **kwargs):
-        # Setup common CLI arguments
-        self.force = kwargs.get("force", False)
+        self.setup_options(**kwargs)
 
         # Load configuration
-        self.config_path = self.find_config(config_file_path=kwargs.get("config"))
-        self.config = self.parse_config(config_file=self.config_path)
+        with stats.measure(stats.CONFIG_DISCOVERY):
+            self.config_path = self.find_config(config_file_path=kwargs.get("config"))
+        with stats.measure(stats.CONFIG_PARSE):
+            self.config = self.parse_config(config_file=self.config_path)
+        self.state = StateStore.for_config(self.config_path)
 
         # Get sops executable
-        self.sops = self._get_sops(sops_executable=os.environ.get("SOPS_PATH"))
+        if not self.uses_sops:
+            self.sops = None
+        elif kwargs.get("sops"):
+            self.sops = kwargs["sops"]
+            self.sops_version = kwargs.get("sops_version")
+        else:
+            with stats.measure(stats.SOPS_PROBE):
+                self.sops, self.sops_version = run_sync(
+                    self._probe_sops_async(sops_executable=os.environ.get("SOPS_PATH"))
+                )
+
+    def setup_options(self, **kwargs) -> None:
+        """Set the common CLI arguments, including for actions such as the agent that do not load a configuration.
+
+        Args:
+            **kwargs: The keyword arguments from the command line.
+
+        Raises:
+            ValueError: If the durability is unknown.
+
+        Returns:
+            None
+        """
+        self.force = kwargs.get("force", False)
+        self.timeout = kwargs.get("timeout")
+        if kwargs.get("retries") is not None:
+            self.retries = kwargs["retries"]
+        self.hedge = kwargs.get("hedge", False)
+        self.pool = kwargs.get("pool")
+        self.durability = (
+            kwargs.get("durability")
+            or os.environ.get("HEYSOPS_DURABILITY")
+            or DURABILITY_BATCH
+        )
+        if self.durability not in DURABILITY_LEVELS:
+            raise ValueError(
+                "Unknown durability {}. Expected one of: {}".format(
+                    self.durability, ", ".join(DURABILITY_LEVELS)
+                )
+            )
 
     @staticmethod
     def argparse_sub_parser(sub_parser) -> argparse.Action:
@@ -81,36 +193,227 @@ class BaseAction:
         """Required method to execute the action."""
         raise NotImplementedError
 
+    async def run_async(self, **kwargs) -> Any:
+        """Required method for actions supporting `--recursive`. Does the work of run within a running event loop,
+        without reporting it.
+
+        Returns:
+            The results of the run, as given to report.
+        """
+        raise NotImplementedError
+
+    def report(self, results: Any, **kwargs) -> None:
+        """Required method for actions supporting `--recursive`. Logs the results returned by run_async.
+
+        Raises:
+            OSError: If any file could not be processed.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def report_recursive(
+        cls,
+        results: List[Tuple[str, Union["BaseAction", None], Any, Union[OSError, None]]],
+        **kwargs
+    ) -> int:
+        """Report the results of running the action for several configurations, grouped by configuration.
+
+        A configuration that failed, or could not be loaded, does not prevent the others from being reported.
+
+        Args:
+            results: One (configuration path, action, results of run_async, error) tuple per configuration.
+            **kwargs: The keyword arguments from the command line.
+
+        Raises:
+            OSError: Once every configuration is reported, if any configuration could not be loaded or any of its
+              files could not be processed.
+
+        Returns:
+            int: The exit code of the command.
+        """
+        failed_configs = []
+        for config_path, action, action_results, error in results:
+            logger.info("{}:".format(config_path))
+            try:
+                if error is not None:
+                    raise error
+                action.report(action_results, **kwargs)
+            except OSError as e:
+                logger.error("{}: {}".format(config_path, e))
+                failed_configs.append(config_path)
+
+        cls.raise_failed_configs(failed_configs, len(results))
+        return 0
+
+    @staticmethod
+    def raise_failed_configs(failed_configs: List[str], total: int) -> None:
+        """Raise an error naming the configurations that failed, if any did.
+
+        Args:
+            failed_configs: The paths of the configurations that failed.
+            total: The number of configurations run.
+
+        Raises:
+            OSError: If failed_configs is not empty.
+
+        Returns:
+            None
+        """
+        if failed_configs:
+            raise OSError(
+                "Failed in {} of {} configurations: {}".format(
+                    len(failed_configs), total, ", ".join(failed_configs)
+                )
+            )
+
     def start(self, **kwargs) -> None:
-        """Calls the run function, implemented by child classes."""
-        self.run(**kwargs)
-        self.flush_config()
+        """Calls the run function, implemented by child classes.
+
+        The configuration and state are flushed even if the run fails part way, so that updates made for the files
+        that were processed successfully are not lost.
+        """
+        try:
+            self.run(**kwargs)
+        finally:
+            self.flush_config()
+            self.state.save()
 
     @staticmethod
     def parse_config(config_file: str) -> dict:
         """Parse the configuration file.
 
+        The parsed configuration is cached, keyed by the file's path, size and modification time, so the YAML is only
+        parsed again once the file changes. A file modified close to the moment it was cached is compared by digest
+        instead, as it may change again without its modification time changing.
+
         Args:
             config_file: Path to the configuration file
 
         Returns:
             dict: The loaded yaml file
         """
-        yaml = YAML(typ="safe")
+        cache_name = BaseAction._get_config_cache_name(config_file)
+        recorded_ns = time.time_ns()
+        signature = file_signature(config_file)
+        cached = load_compiled_file(cache_name)
+        if (
+            signature is None
+            or not isinstance(cached, dict)
+            or cached.get("signature") != signature
+        ):
+            cached = None
+
+        if (
+            cached is not None
+            and signature["mtime_ns"] < cached.get("recorded_ns", 0) - RACY_WINDOW_NS
+        ):
+            return cached["config"]
+
         with open(config_file, "r") as open_config:
+            config_text = open_config.read()
+        stats.count(
+            stats.CONFIG_PARSE, bytes_read=signature["size"] if signature else 0
+        )
+
+        digest = BaseAction._get_config_digest(config_text)
+        if cached is not None and cached.get("digest") == digest:
+            config = cached["config"]
+        else:
+            # Imported here, as loading ruamel.yaml is a large part of the start up time of commands that never
+            # parse it
+            from ruamel.yaml import YAML
+
+            yaml = YAML(typ="safe")
             # noinspection PyyamlLoad
-            return yaml.load(open_config)
+            config = yaml.load(config_text)
+
+        BaseAction._save_config_cache(
+            config_file, config, digest, signature, recorded_ns
+        )
+        return config
+
+    @staticmethod
+    def _get_config_cache_name(config_file: str) -> str:
+        return os.path.join(
+            "config",
+            hashlib.sha256(os.path.realpath(config_file).encode("utf-8")).hexdigest()
+            + ".marshal",
+        )
+
+    @staticmethod
+    def _get_config_digest(config_text: str) -> str:
+        return hashlib.blake2b(config_text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _save_config_cache(
+        config_file: str,
+        config: dict,
+        digest: str,
+        signature: Union[dict, None],
+        recorded_ns: int,
+    ) -> None:
+        if signature is None:
+            return None
+        save_compiled_file(
+            BaseAction._get_config_cache_name(config_file),
+            {
+                "signature": signature,
+                "recorded_ns": recorded_ns,
+                "digest": digest,
+                "config": config,
+            },
+        )
+
+    def mark_config_modified(self) -> None:
+        """Flag that self.config was changed outside of the secrets table, so that it is written on the next flush.
+
+        Returns:
+            None
+        """
+        self._config_modified = True
 
+    @stats.measure(stats.CONFIG_FLUSH)
     def flush_config(self) -> None:
-        """Write the configuration data in memory to the configuration file. Overwrites the entire file.
+        """Write the configuration data in memory to the configuration file, if it was modified since it was loaded
+        or last flushed. Overwrites the entire file.
+
+        The file is replaced atomically, by writing to a temporary file and renaming it over the configuration file.
+        The parsed configuration cache is refreshed to match, so the next command does not parse the file again.
 
         Returns:
             None
         """
+        secrets = self.secrets
+        if not secrets.modified and not self._config_modified:
+            return None
+
+        if secrets.modified:
+            self.config["secrets"] = secrets.to_list()
+            self._secrets = (self.config, self.config["secrets"], secrets)
+
+        from ruamel.yaml import YAML
+
         yaml = YAML(typ="safe")
-        with open(self.config_path, "w") as open_config:
-            # noinspection PyyamlLoad
-            yaml.dump(self.config, open_config)
+        config_data = io.StringIO()
+        # noinspection PyyamlLoad
+        yaml.dump(self.config, config_data)
+        config_bytes = config_data.getvalue().encode("utf-8")
+        recorded_ns = time.time_ns()
+        write_file_atomic(
+            os.path.realpath(self.config_path), config_bytes, self.durability
+        )
+        stats.count(stats.CONFIG_FLUSH, bytes_written=len(config_bytes))
+
+        self._save_config_cache(
+            self.config_path,
+            self.config,
+            self._get_config_digest(config_data.getvalue()),
+            file_signature(self.config_path),
+            recorded_ns,
+        )
+
+        secrets.modified = False
+        self._config_modified = False
 
     @classmethod
     def find_config(cls, config_file_path: Union[str, None] = None) -> str:
@@ -137,19 +440,9 @@ class BaseAction:
             return config_file_path
 
         # Check current then parent directories
-        folder_to_check = os.curdir
-        found = False
-        while not found:
-            for filename in [cls.config_filename_1, cls.config_filename_2]:
-                found = cls._check_folder_for_file(folder_to_check, filename)
-                if found:
-                    return os.path.join(folder_to_check, filename)
-
-            if not os.path.split(folder_to_check)[1]:
-                break  # We are at the root of the drive and didn't find it
-
-            # Set new folder to call
-            folder_to_check = os.path.abspath(os.path.join(folder_to_check, ".."))
+        found = cls.find_file_in_parents([cls.config_filename_1, cls.config_filename_2])
+        if found:
+            return found
 
         raise FileNotFoundError(
             "A configuration file .heysops.yaml or .heysops.yml was not found in this or any parent directories "
@@ -169,6 +462,38 @@ class BaseAction:
         Returns:
             str: Location of the sops binary
         """
+        return run_sync(BaseAction._get_sops_async(sops_executable=sops_executable))
+
+    @staticmethod
+    async def _get_sops_async(sops_executable: Union[str, None] = None) -> str:
+        """Find the sops executable on the path, without blocking the running event loop.
+
+        Args:
+            sops_executable: A path to the sops binary. If not found, checks for the binary on the path.
+
+        Raises:
+             SopsNotFoundError: if it isn't located
+
+        Returns:
+            str: Location of the sops binary
+        """
+        return (await BaseAction._probe_sops_async(sops_executable=sops_executable))[0]
+
+    @staticmethod
+    async def _probe_sops_async(
+        sops_executable: Union[str, None] = None,
+    ) -> Tuple[str, str]:
+        """Find the sops executable and its version. The version is cached until the binary changes.
+
+        Args:
+            sops_executable: A path to the sops binary. If not found, checks for the binary on the path.
+
+        Raises:
+             SopsNotFoundError: if it isn't located
+
+        Returns:
+            tuple: Location of the sops binary, and its version
+        """
         if (
             sops_executable is not None
             and os.path.exists(sops_executable)
@@ -179,14 +504,69 @@ class BaseAction:
             sops = "sops"
 
         try:
-            sops_run = subprocess.run(
-                [sops, "-v"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-            )
-            sops_run.check_returncode()
+            version = await probe_sops(sops)
         except Exception:
             raise SopsNotFoundError(path=sops)
 
-        return sops
+        return sops, version
+
+    @classmethod
+    def find_file_in_parents(
+        cls, filenames: List[str], start_folder: Union[str, None] = None
+    ) -> Union[str, None]:
+        """Search the start directory, then each parent directory, for the first of the filenames that exists.
+
+        Each directory is checked with one stat call per filename, rather than listing its content. The result is
+        remembered for the rest of the process, and only searched for again if the file found is removed.
+
+        Args:
+            filenames: The names to search for, in order of preference within a directory.
+            start_folder: The directory to start from. Defaults to the current directory.
+
+        Returns:
+            str: The path to the file found, joined to start_folder if it is in the start directory and absolute
+              otherwise. None if no directory up to the root holds any of the filenames.
+        """
+        start_folder = start_folder or os.curdir
+        memo_key = (os.path.abspath(start_folder), tuple(filenames))
+        found = _found_in_parents.get(memo_key)
+        if found and os.path.isfile(found):
+            return found
+
+        folder_to_check = start_folder
+        while True:
+            found = cls._find_file_in_folder(folder_to_check, filenames)
+            if found:
+                _found_in_parents[memo_key] = found
+                return found
+
+            if not os.path.split(folder_to_check)[1]:
+                return None  # We are at the root of the drive and didn't find it
+
+            # Set new folder to call
+            folder_to_check = os.path.abspath(os.path.join(folder_to_check, ".."))
+
+    @staticmethod
+    def _find_file_in_folder(
+        folder_path: str, filenames: List[str]
+    ) -> Union[str, None]:
+        """Find the first of the filenames that exists as a file within the folder, with one stat call per name.
+
+        Args:
+            folder_path: The directory to search in
+            filenames: The names to search for
+
+        Returns:
+            str: The folder_path joined with the name found, or None if none of them exist.
+        """
+        for filename in filenames:
+            file_path = os.path.join(folder_path, filename)
+            try:
+                if stat.S_ISREG(os.stat(file_path).st_mode):
+                    return file_path
+            except OSError:
+                continue
+        return None
 
     @staticmethod
     def _check_folder_for_file(folder_path, filename) -> bool:
@@ -202,10 +582,74 @@ class BaseAction:
         Raises:
             NotADirectoryError: if the folder_path is not found or is a file.
         """
-        if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
+        if BaseAction._find_file_in_folder(folder_path, [filename]):
+            return True
+        if not os.path.isdir(folder_path):
             raise NotADirectoryError(folder_path)
+        return False
+
+    @contextlib.contextmanager
+    def output_file(
+        self,
+        file_path: str,
+        phase: Union[str, None] = None,
+        on_commit: Union[Callable[[], None], None] = None,
+    ) -> Iterator[BinaryIO]:
+        """Open a temporary file to write the content of an output file to.
 
-        return filename in os.listdir(folder_path)
+        Within batch_outputs, the file is moved into place with the rest of the batch. Otherwise it replaces file_path
+        as soon as the block exits. Either way, file_path is left unchanged if the block raises.
+
+        Args:
+            file_path: The path of the file to write.
+            phase: The libheysops.stats phase to record the bytes written and the time taken to move the file into
+              place under.
+            on_commit: Called once the file is in place, such as to record its state.
+
+        Yields:
+            BinaryIO: The open temporary file. Its descriptor may be handed to a subprocess to write to directly.
+        """
+        if self.staged_outputs is not None:
+            with self.staged_outputs.open(file_path, phase, on_commit) as open_file:
+                yield open_file
+            return
+
+        with atomic_output(file_path, phase, self.durability) as open_file:
+            yield open_file
+        if on_commit is not None:
+            on_commit()
+
+    @contextlib.asynccontextmanager
+    async def batch_outputs(self) -> AsyncIterator[Dict[str, OSError]]:
+        """Stage the output files written within the block, and move them into place together once it exits.
+
+        Files are not staged when durability is "strict", as each is then flushed and moved into place on its own. If
+        the block raises, or is cancelled, the staged files are removed and their destinations left as they were.
+
+        Yields:
+            dict: Empty within the block. Once it exits, maps the absolute path of each file that could not be moved
+              into place to the error preventing it.
+        """
+        commit_errors = {}  # type: Dict[str, OSError]
+        if self.durability == DURABILITY_STRICT:
+            yield commit_errors
+            return
+
+        staged_outputs = self.staged_outputs = StagedOutputs(self.durability)
+        try:
+            yield commit_errors
+        except BaseException:
+            staged_outputs.discard()
+            raise
+        finally:
+            self.staged_outputs = None
+        if len(staged_outputs):
+            # Flushing and renaming is blocking file system work, kept off the running event loop
+            commit_errors.update(
+                await asyncio.get_running_loop().run_in_executor(
+                    None, staged_outputs.commit
+                )
+            )
 
     def get_absolute_path(self, relative_path: str) -> str:
         """Render an absolute path using the path to the configuration file and the relative path supplied.
@@ -220,10 +664,24 @@ class BaseAction:
             os.path.abspath(os.path.split(self.config_path)[0]), relative_path
         )
 
-    def add_file_to_config(self, file_entry: dict) -> None:
-        """Adds a new file to the self.config object's secret array. Flushes data to the configuration file.
+    @property
+    def secrets(self) -> SecretsTable:
+        """The indexed secrets of the loaded configuration. Rebuilt if self.config, or its secrets list, is replaced.
+
+        Changes made through this table are written back to self.config when the configuration is flushed.
 
-        Checks for the existence of the file within the configuration before modifying
+        Returns:
+            SecretsTable: The indexed secrets.
+        """
+        source = (self.config, self.config.get("secrets"))
+        cached = self._secrets
+        if cached is None or cached[0] is not source[0] or cached[1] is not source[1]:
+            self._secrets = source + (SecretsTable(source[1]),)
+        return self._secrets[2]
+
+    def add_file_to_config(self, file_entry: dict) -> None:
+        """Adds a new file to the secrets of the configuration. If an entry with the same decrypted or encrypted path
+        exists, it is replaced instead.
 
         Args:
             file_entry: Dictionary to add to the secrets key, if it isn't found already.
@@ -231,31 +689,10 @@ class BaseAction:
         Returns:
             None
         """
-        updated_secrets = []
-        file_entry_found = False
-        secrets = self.config.get("secrets")
-        if not secrets:
-            secrets = [{}]
-        for entry in secrets:
-            if not file_entry_found and (
-                file_entry["decrypted_path"] == entry.get("decrypted_path")
-                or file_entry["encrypted_path"] == entry.get("encrypted_path")
-            ):
-                # Update existing record, based on the decrypted path
-                updated_secrets.append(file_entry)
-                file_entry_found = True
-            elif entry:
-                # Keep existing records in the list
-                updated_secrets.append(entry)
-
-        if not file_entry_found:
-            # If we didn't find a record to update, we add a new entry
-            updated_secrets.append(file_entry)
-
-        self.config["secrets"] = updated_secrets
+        self.secrets.upsert(file_entry)
 
     def delete_file_from_config(self, file_to_remove: str) -> None:
-        """Removes a file from the self.config object's secret array. Flushes data to the configuration file.
+        """Removes a file from the secrets of the configuration.
 
         Args:
             file_to_remove: Either the encrypted or decrypted file path to search for within the config
@@ -263,22 +700,7 @@ class BaseAction:
         Returns:
             None
         """
-        updated_secrets = []
-        secrets = self.config.get("secrets")
-        if not secrets:
-            return None  # If there are no secrets, there is nothing to remove
-        for entry in secrets:
-            if file_to_remove in [
-                entry.get("decrypted_path"),
-                entry.get("encrypted_path"),
-            ]:
-                # Skip this entry
-                continue
-            elif entry:
-                # Keep existing records in the list
-                updated_secrets.append(entry)
-
-        self.config["secrets"] = updated_secrets
+        self.secrets.delete(file_to_remove)
 
     def get_all_decrypted_file_paths_from_config(self) -> List[str]:
         """Gets all decrypted file paths from the configuration file.
@@ -286,21 +708,38 @@ class BaseAction:
         Returns:
             list: Collection of all decrypted file paths within the heysops configuration file's secrets
         """
-        secrets = self.config.get("secrets")
-        if not secrets:
-            return []
-        return [x.get("decrypted_path") for x in secrets]
+        return self.secrets.decrypted_paths()
 
     def get_all_encrypted_file_paths_from_config(self) -> List[str]:
-        """Gets all decrypted file paths from the configuration file.
+        """Gets all encrypted file paths from the configuration file.
 
         Returns:
-            list: Collection of all decrypted file paths within the heysops configuration file's secrets
+            list: Collection of all encrypted file paths within the heysops configuration file's secrets
+        """
+        return self.secrets.encrypted_paths()
+
+    def is_secret_current(self, config_entry: dict) -> bool:
+        """Check whether the plaintext and encrypted files of a secret are both unchanged since heysops last
+        encrypted or decrypted it.
+
+        Args:
+            config_entry: The secrets entry from the configuration.
+
+        Returns:
+            bool: True if both files exist and match the recorded state.
         """
-        secrets = self.config.get("secrets")
-        if not secrets:
-            return []
-        return [x.get("encrypted_path") for x in secrets]
+        if not config_entry:
+            return False
+
+        return self.state.is_current(
+            config_entry["decrypted_path"],
+            CIPHERTEXT,
+            self.get_absolute_path(config_entry["encrypted_path"]),
+        ) and self.state.is_current(
+            config_entry["decrypted_path"],
+            PLAINTEXT,
+            self.get_absolute_path(config_entry["decrypted_path"]),
+        )
 
     def find_file_in_config(self, file_path: str) -> dict:
         """Finds a specific file from within the configuration. Searches both decrypted and encrypted file names.
@@ -311,13 +750,4 @@ class BaseAction:
         Returns:
             dict: Returns details about the file if found. Otherwise returns an empty dictionary.
         """
-        secrets = self.config.get("secrets")
-        if not secrets:
-            secrets = [{}]
-        for entry in secrets:
-            if file_path in [
-                entry.get("decrypted_path"),
-                entry.get("encrypted_path"),
-            ]:
-                return entry
-        return {}
+        return self.secrets.get(file_path)
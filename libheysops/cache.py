@@ -0,0 +1,129 @@
+"""Location of the per-user cache directory, where heysops keeps data that can be rebuilt at any time.
+
+Environment Variables:
+    HEYSOPS_CACHE_DIR: The directory to use. Defaults to `$XDG_CACHE_HOME/heysops` or `~/.cache/heysops`.
+"""
+
+import json
+import logging
+import marshal
+import os
+from typing import Any
+
+from libheysops.fileio import write_file_atomic
+
+logger = logging.getLogger()
+
+
+def get_cache_dir(*sub_folders: str) -> str:
+    """Get the path to the cache directory, or a folder within it, creating it if needed.
+
+    The directory is only accessible by the current user, as some of its content is derived from secrets.
+
+    Args:
+        sub_folders: Names of nested folders within the cache directory.
+
+    Returns:
+        str: The absolute path to the folder.
+    """
+    cache_dir = os.environ.get("HEYSOPS_CACHE_DIR")
+    if not cache_dir:
+        cache_dir = os.path.join(
+            os.environ.get("XDG_CACHE_HOME")
+            or os.path.join(os.path.expanduser("~"), ".cache"),
+            "heysops",
+        )
+    cache_dir = os.path.abspath(cache_dir)
+    # makedirs only applies the mode to the last folder it creates, so the cache directory is created on its own, and
+    # tightened if an earlier version created it as a parent of a sub folder
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    if os.name != "nt" and os.stat(cache_dir).st_mode & 0o077:
+        try:
+            os.chmod(cache_dir, 0o700)
+        except OSError as e:
+            logger.warning(
+                "Unable to restrict access to the cache directory {}: {}".format(
+                    cache_dir, e
+                )
+            )
+    if not sub_folders:
+        return cache_dir
+
+    cache_dir = os.path.join(cache_dir, *sub_folders)
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    return cache_dir
+
+
+def load_cache_file(name: str) -> dict:
+    """Load a JSON document from the cache directory.
+
+    Args:
+        name: The file name within the cache directory.
+
+    Returns:
+        dict: The loaded document. Empty if the file does not exist or cannot be read.
+    """
+    try:
+        with open(os.path.join(get_cache_dir(), name), "r") as open_cache:
+            data = json.load(open_cache)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_cache_file(name: str, data: dict) -> None:
+    """Replace a JSON document in the cache directory.
+
+    Failing to write is not an error, as the cache only saves work.
+
+    Args:
+        name: The file name within the cache directory.
+        data: The document to save.
+
+    Returns:
+        None
+    """
+    try:
+        write_file_atomic(
+            os.path.join(get_cache_dir(), name),
+            json.dumps(data, sort_keys=True).encode("utf-8"),
+        )
+    except OSError as e:
+        logger.debug("Unable to write cache file {}: {}".format(name, e))
+
+
+def load_compiled_file(name: str) -> Any:
+    """Load a value saved by save_compiled_file from the cache directory.
+
+    Args:
+        name: The file name within the cache directory, which may include sub folders.
+
+    Returns:
+        The loaded value. None if the file does not exist or cannot be read.
+    """
+    try:
+        with open(os.path.join(get_cache_dir(), name), "rb") as open_cache:
+            return marshal.load(open_cache)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def save_compiled_file(name: str, data: Any) -> None:
+    """Replace a value in the cache directory, in Python's marshal format, which loads much faster than JSON or YAML.
+
+    Only built in types such as dictionaries, lists, strings and numbers can be saved. Failing to write, or a value
+    that cannot be saved, is not an error, as the cache only saves work.
+
+    Args:
+        name: The file name within the cache directory, which may include sub folders.
+        data: The value to save.
+
+    Returns:
+        None
+    """
+    try:
+        cache_path = os.path.join(get_cache_dir(), name)
+        os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+        write_file_atomic(cache_path, marshal.dumps(data))
+    except (OSError, ValueError) as e:
+        logger.debug("Unable to write cache file {}: {}".format(name, e))
@@ -1,41 +1,146 @@
 import argparse
+import asyncio
 import logging
 import os
+from typing import List
 
-from libheysops.base import BaseAction
 from libheysops import Action
+from libheysops.encrypt.encrypt import Encrypt
+from libheysops.engine import gather_bounded, run_sync
+from libheysops.recursive import add_recursive_argument
+from libheysops.state import PLAINTEXT
 
 logger = logging.getLogger()
 
+# Removing a file is a single system call, so far more of them can run at once than sops invocations
+REMOVE_JOBS = 32
 
-class Clean(BaseAction):
+
+class Clean(Encrypt):
     def __init__(self, **kwargs):
         super(Clean, self).__init__(**kwargs)
 
     def run(self, **kwargs) -> None:
         """Entry point for this action's operation
 
-        First encrypts all files tracked by heysops. Then deletes the decrypted file
-        associated with each encrypted file.
+        First encrypts the decrypted files tracked by heysops that changed since they were last encrypted. Then
+        deletes the decrypted file associated with each encrypted file.
+
+        The configuration, state and sops executable of this action are reused for encrypting, so the configuration
+        is read and written once.
 
         Args:
             **kwargs: The keyword arguments from the command line.
 
         Keyword Args:
-            No kwargs are accepted for this action
+            jobs: The number of sops invocations to run concurrently.
+
+        Raises:
+            OSError: Once all other files are processed, if any file could not be encrypted or removed. A file that
+              could not be encrypted is not removed.
 
         Returns:
             None.
         """
-        # encrypt all files in the configuration file
-        Action.encrypt(FILE="-")
+        self.report(run_sync(self.run_async(**kwargs)))
+
+    async def run_async(self, **kwargs) -> List[str]:
+        """Clean the files of the configuration, within a running event loop.
+
+        Args:
+            **kwargs: The keyword arguments from the command line, as for run.
+
+        Returns:
+            list: The results of clean_files.
+        """
+        return await self.clean_files(jobs=kwargs.get("jobs") or 1)
+
+    def report(self, failed_files: List[str], **kwargs) -> None:
+        """Report the files that could not be cleaned. Each error was already logged by clean_files.
+
+        Args:
+            failed_files: The results of clean_files.
+
+        Raises:
+            OSError: If any file could not be encrypted or removed.
+
+        Returns:
+            None
+        """
+        if failed_files:
+            raise OSError(
+                "Unable to clean {} files: {}".format(
+                    len(failed_files), ", ".join(failed_files)
+                )
+            )
+
+    async def clean_files(self, jobs: int = 1) -> List[str]:
+        """Encrypt the changed decrypted files, then remove every decrypted file that is safely encrypted.
+
+        Decrypted files that are already gone are left in the configuration.
+
+        Args:
+            jobs: The number of sops invocations to run concurrently.
+
+        Returns:
+            list: The decrypted file paths that could not be encrypted or removed.
+        """
+        present = [
+            decrypted_file_path
+            for decrypted_file_path in self.get_all_decrypted_file_paths_from_config()
+            if os.path.exists(self.get_absolute_path(decrypted_file_path))
+        ]
+
+        failed_files = []
+        encrypted_files = []
+        # An empty list would make encrypt_files encrypt every file in the configuration
+        encrypted = (
+            await self.encrypt_files(decrypted_file_paths=present, jobs=jobs)
+            if present
+            else []
+        )
+        for decrypted_file_path, _, error in encrypted:
+            if error is None:
+                encrypted_files.append(decrypted_file_path)
+            else:
+                logger.error(str(error))
+                failed_files.append(decrypted_file_path)
 
-        # remove all decrypted files
-        decrypted_file_paths = self.get_all_decrypted_file_paths_from_config()
-        for decrypted_file in decrypted_file_paths:
-            abs_file = self.get_absolute_path(decrypted_file)
-            os.remove(abs_file)
-            logger.info("Removed {}".format(decrypted_file))
+        loop = asyncio.get_running_loop()
+        removed = await gather_bounded(
+            lambda decrypted_file_path: loop.run_in_executor(
+                None, self.remove_decrypted_file, decrypted_file_path
+            ),
+            encrypted_files,
+            jobs=REMOVE_JOBS,
+        )
+        for decrypted_file_path, _, error in removed:
+            if error is not None:
+                logger.error(str(error))
+                failed_files.append(decrypted_file_path)
+        return failed_files
+
+    def remove_decrypted_file(self, decrypted_file_path: str) -> None:
+        """Remove a decrypted file, unless it changed since it was encrypted.
+
+        Args:
+            decrypted_file_path: The decrypted file path, from the configuration.
+
+        Raises:
+            OSError: If the file changed since it was encrypted, or could not be removed.
+
+        Returns:
+            None
+        """
+        abs_file = self.get_absolute_path(decrypted_file_path)
+        if not self.state.is_current(decrypted_file_path, PLAINTEXT, abs_file):
+            raise OSError(
+                "{} changed while it was being encrypted. It was not removed.".format(
+                    decrypted_file_path
+                )
+            )
+        os.remove(abs_file)
+        logger.info("Removed {}".format(decrypted_file_path))
 
     @staticmethod
     def argparse_sub_parser(sub_parser) -> argparse.Action:
@@ -47,7 +152,16 @@ class Clean(BaseAction):
         Returns:
             argparse.Action: The defined action object.
         """
-        return sub_parser.add_parser(
+        cli_clean = sub_parser.add_parser(
             "clean",
-            help="Runs encrypt on all files in the configuration. Then removes all decrypted files.",
+            help=Action.get_action_help("clean"),
+        )
+        cli_clean.add_argument(
+            "-j",
+            "--jobs",
+            help="The number of files to encrypt concurrently.",
+            type=int,
+            default=1,
         )
+        add_recursive_argument(cli_clean)
+        return cli_clean
@@ -1,13 +1,23 @@
 import argparse
+import asyncio
 import logging
 import os
 import subprocess
-from typing import Union
+import sys
+from typing import IO, List, Tuple, Union
 
+from libheysops import Action, stats
+from libheysops.agent.client import decrypt_with_agent
 from libheysops.base import BaseAction
+from libheysops.engine import gather_bounded, run_sops, run_sync
+from libheysops.recursive import add_recursive_argument
+from libheysops.state import CIPHERTEXT, PLAINTEXT
 
 logger = logging.getLogger()
 
+# The structured formats sops can convert between, keyed by the extension of the decrypted file
+SECRET_FORMATS = {".env": "dotenv", ".json": "json", ".yaml": "yaml", ".yml": "yaml"}
+
 
 class Decrypt(BaseAction):
     def __init__(self, **kwargs):
@@ -26,24 +36,140 @@ class Decrypt(BaseAction):
            FILE: A list of files to decrypt, or a dash (`-`) character to indicate
              that all files known to heysops (via the configuration file) should
              be decrypted.
+           jobs: The number of sops invocations to run concurrently
+
+        Raises:
+            OSError: Once all files are processed, if any of them could not be decrypted.
 
         Returns:
             None.
         """
-        encrypted_file_paths = kwargs.get("FILE")
+        self.report(run_sync(self.run_async(**kwargs)))
+
+    async def run_async(self, **kwargs) -> List[Tuple[str, bool, Union[OSError, None]]]:
+        """Decrypt the files requested at the command line, within a running event loop.
+
+        Args:
+            **kwargs: The keyword arguments from the command line, as for run.
+
+        Returns:
+            list: The results of decrypt_files.
+        """
+        return await self.decrypt_files(
+            encrypted_file_paths=kwargs.get("FILE"), jobs=kwargs.get("jobs") or 1
+        )
+
+    def report(
+        self, results: List[Tuple[str, bool, Union[OSError, None]]], **kwargs
+    ) -> None:
+        """Log the outcome of every file, in the order they were requested, then print a summary to stderr.
+
+        Args:
+            results: The results of decrypt_files.
+
+        Raises:
+            OSError: If any of the files could not be decrypted.
+
+        Returns:
+            None
+        """
+        failed_files = []
+        for encrypted_file_path, decrypted, error in results:
+            if error is None and decrypted:
+                logger.info("Decrypted {}".format(encrypted_file_path))
+            elif error is None:
+                logger.info("Up to date {}".format(encrypted_file_path))
+            else:
+                logger.error(
+                    "Failed to decrypt {}: {}".format(encrypted_file_path, error)
+                )
+                failed_files.append(encrypted_file_path)
+
+        if failed_files:
+            raise OSError(
+                "Unable to decrypt {} of {} files: {}".format(
+                    len(failed_files), len(results), ", ".join(failed_files)
+                )
+            )
+        # Written to stderr rather than logged, so the summary is shown without --verbose
+        sys.stderr.write(
+            "Decrypted {} of {} files. The others were up to date.\n".format(
+                len([x for x in results if x[1]]), len(results)
+            )
+        )
+
+    async def decrypt_files(
+        self, encrypted_file_paths: Union[List[str], str, None] = None, jobs: int = 1
+    ) -> List[Tuple[str, bool, Union[OSError, None]]]:
+        """Decrypt several files concurrently.
+
+        Tracked files whose encrypted and decrypted files are both unchanged since heysops last encrypted or
+        decrypted them are left alone, without running sops.
+
+        Args:
+            encrypted_file_paths: The files to decrypt. A dash (`-`) or None decrypts every file in the configuration.
+            jobs: The number of sops invocations to run concurrently
 
+        Returns:
+            list: One (encrypted file path, decrypted, error) tuple per file, in the order requested. decrypted is
+              False for files that were already up to date. error is None unless the file could not be decrypted.
+        """
         if not encrypted_file_paths or encrypted_file_paths in ["-", ["-"]]:
             encrypted_file_paths = self.get_all_encrypted_file_paths_from_config()
 
-        for encrypted_file_path in encrypted_file_paths:
-            config_entry = self.find_file_in_config(file_path=encrypted_file_path)
-            # Decrypt the file
-            self.decrypt_file(
-                file_entry=config_entry.get("encrypted_path"),
-                output_type=config_entry.get("type"),
-                output_filename=config_entry.get("decrypted_path"),
+        config_entries = [
+            (
+                encrypted_file_path,
+                self.find_file_in_config(file_path=encrypted_file_path),
+            )
+            for encrypted_file_path in encrypted_file_paths
+        ]
+
+        # Checking may hash both files of a secret, so it runs in worker threads to keep the event loop free
+        loop = asyncio.get_running_loop()
+        current = await asyncio.gather(
+            *(
+                loop.run_in_executor(None, self.is_secret_current, config_entry)
+                for _, config_entry in config_entries
+            )
+        )
+        unchanged_files = set()
+        for (encrypted_file_path, _), is_current in zip(config_entries, current):
+            if is_current:
+                logger.info(
+                    "{} has not changed since it was last decrypted. Skipping.".format(
+                        encrypted_file_path
+                    )
+                )
+                unchanged_files.add(encrypted_file_path)
+
+        # The decrypted files are moved into place together once every file is decrypted
+        async with self.batch_outputs() as commit_errors:
+            decrypted = await gather_bounded(
+                lambda item: self.decrypt_file_async(
+                    file_entry=item[1].get("encrypted_path", item[0]),
+                    output_type=item[1].get("type"),
+                    output_filename=item[1].get("decrypted_path"),
+                ),
+                [x for x in config_entries if x[0] not in unchanged_files],
+                jobs=jobs,
+                semaphore=self.pool,
             )
 
+        errors = {}
+        for (encrypted_file_path, _), abs_output_filename, error in decrypted:
+            if error is None and abs_output_filename:
+                error = commit_errors.get(abs_output_filename)
+            errors[encrypted_file_path] = error
+        return [
+            (
+                encrypted_file_path,
+                encrypted_file_path not in unchanged_files,
+                errors.get(encrypted_file_path),
+            )
+            for encrypted_file_path, _ in config_entries
+        ]
+
     def decrypt_file(
         self,
         file_entry: str,
@@ -60,6 +186,31 @@ class Decrypt(BaseAction):
         Returns:
             None
         """
+        run_sync(
+            self.decrypt_file_async(
+                file_entry=file_entry,
+                output_type=output_type,
+                output_filename=output_filename,
+            )
+        )
+
+    async def decrypt_file_async(
+        self,
+        file_entry: str,
+        output_type: Union[str, None] = None,
+        output_filename: Union[str, None] = None,
+    ) -> str:
+        """Perform the decryption operation on a single file, on the running event loop.
+
+        Args:
+            file_entry: The name and path of the sops encrypted file to decrypt.
+            output_type: The output format that sops should use during decryption. If none, sops will pick.
+            output_filename: The name and path of the file to write the sops decrypted content to.
+
+        Returns:
+            str: The absolute path of the decrypted file. Within batch_outputs, the file is only
+              there once the batch is committed.
+        """
         search_entry = self.find_file_in_config(file_entry)
 
         if not output_filename:
@@ -85,10 +236,115 @@ class Decrypt(BaseAction):
             sops_args += ["--output-type", output_type]
         sops_args += ["-d", abs_file_entry]
 
+        # Capture the encrypted file before sops reads it, so changes made while decrypting are picked up next time
+        ciphertext = await asyncio.get_running_loop().run_in_executor(
+            None, self.state.snapshot, abs_file_entry
+        )
+
+        def record_state():
+            self.state.record(output_filename, CIPHERTEXT, ciphertext)
+            self.state.record(
+                output_filename, PLAINTEXT, self.state.snapshot(abs_output_filename)
+            )
+
+        # sops writes straight into a temporary file next to the output, which only replaces the output on success
+        with self.output_file(
+            abs_output_filename, stats.OUTPUT_WRITE, on_commit=record_state
+        ) as open_out_file:
+            # A running agent streams the decrypted content into the same temporary file
+            data = await decrypt_with_agent(
+                abs_file_entry,
+                output_type=output_type,
+                timeout=self.timeout,
+                stdout=open_out_file,
+            )
+            if data is None:
+                await self.run_sops_checked(sops_args, stdout=open_out_file)
+
+        logger.info(
+            "Decrypted file {} at {} as format {}".format(
+                file_entry, output_filename, output_type
+            )
+        )
+        return abs_output_filename
+
+    @staticmethod
+    def get_secret_format(config_entry: dict) -> Union[str, None]:
+        """Determine the format of a secret, from its stored type or the extension of its decrypted file.
+
+        Args:
+            config_entry: The secrets entry from the configuration.
+
+        Returns:
+            str: "dotenv", "json" or "yaml", or None if the secret is in another format, such as binary.
+        """
+        if config_entry.get("type") in SECRET_FORMATS.values():
+            return config_entry["type"]
+        if config_entry.get("type"):
+            return None
+
+        filename = os.path.basename(config_entry.get("decrypted_path", ""))
+        if filename == ".env":
+            return "dotenv"
+        return SECRET_FORMATS.get(os.path.splitext(filename)[1].lower())
+
+    async def decrypt_to_memory_async(
+        self,
+        file_entry: str,
+        input_type: Union[str, None] = None,
+        output_type: Union[str, None] = None,
+    ) -> bytes:
+        """Decrypt a single file without writing the decrypted content anywhere. Uses the heysops agent when one is
+        running.
+
+        Args:
+            file_entry: The name and path of the sops encrypted file to decrypt.
+            input_type: The format of the encrypted file. If none, sops will pick.
+            output_type: The output format that sops should use during decryption. If none, sops will pick.
+
+        Raises:
+            OSError: If sops failed or did not finish within the timeout.
+
+        Returns:
+            bytes: The decrypted content.
+        """
+        abs_file_entry = self.get_absolute_path(file_entry)
+        data = await decrypt_with_agent(
+            abs_file_entry, input_type, output_type, timeout=self.timeout
+        )
+        if data is not None:
+            return data
+
+        sops_args = [self.sops]
+        if input_type:
+            sops_args += ["--input-type", input_type]
+        if output_type:
+            sops_args += ["--output-type", output_type]
+        sops_args += ["-d", abs_file_entry]
+        return (await self.run_sops_checked(sops_args)).stdout
+
+    async def run_sops_checked(
+        self, sops_args: List[str], stdout: Union[IO, None] = None
+    ) -> subprocess.CompletedProcess:
+        """Run a sops decryption, turning its failures into an OSError.
+
+        Args:
+            sops_args: The sops executable followed by its arguments.
+            stdout: An open file for sops to write the decrypted content to. If None, the content is captured.
+
+        Raises:
+            OSError: If sops failed or did not finish within the timeout.
+
+        Returns:
+            subprocess.CompletedProcess: The completed sops process.
+        """
         try:
-            logger.debug("Running `{}`".format(" ".join(sops_args)))
-            sops_run = subprocess.run(
-                sops_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            sops_run = await run_sops(
+                sops_args,
+                timeout=self.timeout,
+                stdout=stdout,
+                retries=self.retries,
+                hedge=self.hedge,
             )
             sops_run.check_returncode()
         except subprocess.CalledProcessError as e:
@@ -97,18 +353,16 @@ class Decrypt(BaseAction):
             )
             logger.exception(message, exc_info=e)
             raise OSError(message)
+        except subprocess.TimeoutExpired as e:
+            message = "Unable to decrypt file. sops command {} did not finish within {} seconds.".format(
+                sops_args, e.timeout
+            )
+            logger.error(message)
+            raise OSError(message)
 
         if len(sops_run.stderr):
             logger.debug(b"sops stderr: " + sops_run.stderr)
-
-        with open(abs_output_filename, "wb") as open_out_file:
-            open_out_file.write(sops_run.stdout)
-
-        logger.info(
-            "Decrypted file {} at {} as format {}".format(
-                file_entry, output_filename, output_type
-            )
-        )
+        return sops_run
 
     @staticmethod
     def argparse_sub_parser(sub_parser) -> argparse.Action:
@@ -123,9 +377,7 @@ class Decrypt(BaseAction):
         # Decrypt sub_parser
         cli_decrypt = sub_parser.add_parser(
             "decrypt",
-            help="If no files are specified, it looks for a file named .heysops.yaml in the local directory. "
-            "If .heysops.yaml is not found in the current directory, it traverses upwards until it finds one. "
-            "If it doesn't find one, it warns and exits. Prompts if the decrypted file name already exists.",
+            help=Action.get_action_help("decrypt"),
         )
         cli_decrypt.add_argument(
             "FILE",
@@ -134,4 +386,13 @@ class Decrypt(BaseAction):
             nargs="*",
             default="-",
         )
+        cli_decrypt.add_argument(
+            "-j",
+            "--jobs",
+            help="The number of files to decrypt concurrently. A file that fails to decrypt does not stop the "
+            "others.",
+            type=int,
+            default=1,
+        )
+        add_recursive_argument(cli_decrypt)
         return cli_decrypt
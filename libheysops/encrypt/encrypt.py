@@ -1,15 +1,28 @@
 import argparse
+import asyncio
 import logging
 import os
 import subprocess
-from typing import Dict, Union
+from typing import Dict, List, Tuple, Union
 
+from libheysops import Action, stats
 from libheysops.base import BaseAction
+from libheysops.engine import gather_bounded, run_sops, run_sync
+from libheysops.fileio import write_file_atomic
+from libheysops.recursive import add_recursive_argument
+from libheysops.state import CIPHERTEXT, PLAINTEXT
 
 logger = logging.getLogger()
 
 
+GITIGNORE_BLOCK_START = "# BEGIN heysops managed entries"
+GITIGNORE_BLOCK_END = "# END heysops managed entries"
+
+
 class Encrypt(BaseAction):
+    # Queued (decrypted path, prior decrypted path) .gitignore changes, written by flush_gitignore
+    _gitignore_changes = None
+
     def __init__(self, **kwargs):
         super(Encrypt, self).__init__(**kwargs)
 
@@ -28,30 +41,195 @@ class Encrypt(BaseAction):
               be decrypted.
             type: The type value to pass along to sops
             output: The file name to use when writing the encrypted file
+            jobs: The number of sops invocations to run concurrently
+
+        Raises:
+            OSError: Once all files are processed, if any of them could not be encrypted.
 
         Returns:
             None.
         """
-        decrypted_file_paths = kwargs.get("FILE")
+        self.report(run_sync(self.run_async(**kwargs)))
+
+    async def run_async(
+        self, **kwargs
+    ) -> List[Tuple[str, Dict[str, str], Union[OSError, None]]]:
+        """Encrypt the files requested at the command line, within a running event loop.
+
+        Args:
+            **kwargs: The keyword arguments from the command line, as for run.
+
+        Returns:
+            list: The results of encrypt_files.
+        """
+        return await self.encrypt_files(
+            decrypted_file_paths=kwargs.get("FILE"),
+            input_type=kwargs.get("type"),
+            output_filename=kwargs.get("output"),
+            jobs=kwargs.get("jobs") or 1,
+        )
+
+    def report(
+        self, results: List[Tuple[str, Dict[str, str], Union[OSError, None]]], **kwargs
+    ) -> None:
+        """Log the files that could not be encrypted.
+
+        Args:
+            results: The results of encrypt_files.
+
+        Raises:
+            OSError: If any of the files could not be encrypted.
+
+        Returns:
+            None
+        """
+        failed_files = []
+        for decrypted_file_path, _, error in results:
+            if error is not None:
+                logger.error(str(error))
+                failed_files.append(decrypted_file_path)
+
+        if failed_files:
+            raise OSError(
+                "Unable to encrypt {} of {} files: {}".format(
+                    len(failed_files), len(results), ", ".join(failed_files)
+                )
+            )
+
+    async def encrypt_files(
+        self,
+        decrypted_file_paths: Union[List[str], str, None] = None,
+        input_type: Union[str, None] = None,
+        output_filename: Union[str, None] = None,
+        jobs: int = 1,
+    ) -> List[Tuple[str, Dict[str, str], Union[OSError, None]]]:
+        """Encrypt several files concurrently, then update the configuration and .gitignore for each of them.
 
+        Args:
+            decrypted_file_paths: The files to encrypt. A dash (`-`) or None encrypts every file in the configuration.
+            input_type: The type value to pass along to sops
+            output_filename: The file name to use when writing the encrypted file
+            jobs: The number of sops invocations to run concurrently
+
+        Returns:
+            list: One (decrypted file path, secrets entry, error) tuple per file that is still present, in the order
+              requested. error is None when the file was encrypted. The secrets entry is empty for files skipped
+              because they have not changed since they were last encrypted.
+        """
         if not decrypted_file_paths or decrypted_file_paths in ["-", ["-"]]:
             decrypted_file_paths = self.get_all_decrypted_file_paths_from_config()
 
+        # Resolve everything that reads or changes the configuration before any sops process starts
+        prior_configs = {}
+        files_to_encrypt = []
         for decrypted_file_path in decrypted_file_paths:
-            prior_config = self.find_file_in_config(file_path=decrypted_file_path)
-            # Encrypt the file
-            encrypted_information = self.encrypt_file(
-                file_entry=decrypted_file_path,
-                input_type=kwargs.get("type"),
-                output_filename=kwargs.get("output"),
+            if not os.path.exists(self.get_absolute_path(decrypted_file_path)):
+                logger.warning(
+                    "File {} no longer present. Removing from configuration.".format(
+                        decrypted_file_path
+                    )
+                )
+                self.delete_file_from_config(file_to_remove=decrypted_file_path)
+                continue
+            prior_configs[decrypted_file_path] = self.find_file_in_config(
+                file_path=decrypted_file_path
+            )
+            files_to_encrypt.append(decrypted_file_path)
+
+        unchanged_files = set()
+        if not self.force:
+            # Checking may hash both files of a secret, so it runs in worker threads to keep the event loop free
+            loop = asyncio.get_running_loop()
+            current = await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        None,
+                        self.is_encryption_current,
+                        prior_configs[decrypted_file_path],
+                        input_type,
+                        output_filename,
+                    )
+                    for decrypted_file_path in files_to_encrypt
+                )
+            )
+            for decrypted_file_path, is_current in zip(files_to_encrypt, current):
+                if is_current:
+                    logger.info(
+                        "{} has not changed since it was last encrypted. Skipping.".format(
+                            decrypted_file_path
+                        )
+                    )
+                    unchanged_files.add(decrypted_file_path)
+
+        # The encrypted files are moved into place together once every file is encrypted
+        async with self.batch_outputs() as commit_errors:
+            encrypted = await gather_bounded(
+                lambda file_path: self.encrypt_file_async(
+                    file_entry=file_path,
+                    input_type=input_type,
+                    output_filename=output_filename,
+                ),
+                [x for x in files_to_encrypt if x not in unchanged_files],
+                jobs=jobs,
+                semaphore=self.pool,
             )
 
-            if encrypted_information:
+        encrypted_by_path = {}
+        for decrypted_file_path, encrypted_information, error in encrypted:
+            if error is None and encrypted_information:
+                error = commit_errors.get(
+                    self.get_absolute_path(encrypted_information["encrypted_path"])
+                )
+                if error is not None:
+                    encrypted_information = None
+            encrypted_by_path[decrypted_file_path] = (encrypted_information, error)
+        results = [
+            (decrypted_file_path,)
+            + encrypted_by_path.get(decrypted_file_path, ({}, None))
+            for decrypted_file_path in files_to_encrypt
+        ]
+
+        # Apply configuration and .gitignore updates in the order the files were requested
+        for decrypted_file_path, encrypted_information, error in results:
+            if error is None and encrypted_information:
                 self.add_file_to_config(encrypted_information)
                 self.add_file_to_gitignore(
                     encrypted_information,
-                    prior_decrypted_file=prior_config.get("decrypted_path"),
+                    prior_decrypted_file=prior_configs[decrypted_file_path].get(
+                        "decrypted_path"
+                    ),
                 )
+        self.flush_gitignore()
+
+        return results
+
+    def is_encryption_current(
+        self,
+        config_entry: dict,
+        input_type: Union[str, None] = None,
+        output_filename: Union[str, None] = None,
+    ) -> bool:
+        """Check whether encrypting a tracked file again would produce the same result as its last encryption.
+
+        That is the case when neither the plaintext nor the encrypted file changed since the last time heysops
+        encrypted or decrypted it, and the type and output file name are not being changed.
+
+        Args:
+            config_entry: The secrets entry for the file from the configuration. Empty for untracked files.
+            input_type: The type value requested for this encryption.
+            output_filename: The output file name requested for this encryption.
+
+        Returns:
+            bool: True if the file does not need to be encrypted.
+        """
+        if (
+            not config_entry
+            or input_type not in [None, config_entry.get("type")]
+            or output_filename not in [None, config_entry.get("encrypted_path")]
+        ):
+            return False
+
+        return self.is_secret_current(config_entry)
 
     def encrypt_file(
         self,
@@ -61,6 +239,30 @@ class Encrypt(BaseAction):
     ) -> Dict[str, str]:
         """Performs the encryption operation on a single file.
 
+        Args:
+            file_entry: The name and path of the file to encrypt with sops.
+            input_type: The output format that sops should use during encryption. If none, sops will pick.
+            output_filename: The name and path of the file to write the sops encrypted content to.
+
+        Returns:
+            dict: Key value pairs that mimic the data structure for a single secrets entry in the heysops config.
+        """
+        return run_sync(
+            self.encrypt_file_async(
+                file_entry=file_entry,
+                input_type=input_type,
+                output_filename=output_filename,
+            )
+        )
+
+    async def encrypt_file_async(
+        self,
+        file_entry: str,
+        input_type: Union[str, None] = None,
+        output_filename: Union[str, None] = None,
+    ) -> Dict[str, str]:
+        """Performs the encryption operation on a single file, on the running event loop.
+
         Args:
             file_entry: The name and path of the file to encrypt with sops.
             input_type: The output format that sops should use during encryption. If none, sops will pick.
@@ -86,31 +288,56 @@ class Encrypt(BaseAction):
         sops_args += ["-e", abs_file_entry]
 
         if not os.path.exists(abs_file_entry):
-            logger.warning("File {} no longer present. Removing from configuration.")
-            self.delete_file_from_config(file_to_remove=abs_file_entry)
+            logger.warning(
+                "File {} no longer present. Removing from configuration.".format(
+                    file_entry
+                )
+            )
+            self.delete_file_from_config(file_to_remove=file_entry)
             return {}
 
-        try:
-            logger.debug("Running `{}`".format(" ".join(sops_args)))
-            sops_run = subprocess.run(
-                sops_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            sops_run.check_returncode()
-        except subprocess.CalledProcessError as e:
-            message = "Unable to encrypt file. sops command {}. sops error message: {}".format(
-                sops_args, e.stderr.decode()
+        abs_output_filename = self.get_absolute_path(output_filename)
+
+        # Capture the plaintext before sops reads it, so changes made while encrypting are picked up next time
+        plaintext = await asyncio.get_running_loop().run_in_executor(
+            None, self.state.snapshot, abs_file_entry
+        )
+
+        def record_state():
+            self.state.record(file_entry, PLAINTEXT, plaintext)
+            self.state.record(
+                file_entry, CIPHERTEXT, self.state.snapshot(abs_output_filename)
             )
-            logger.exception(message, exc_info=e)
-            raise OSError(message)
+
+        # sops writes straight into a temporary file next to the output, which only replaces the output on success
+        with self.output_file(
+            abs_output_filename, stats.OUTPUT_WRITE, on_commit=record_state
+        ) as open_out_file:
+            try:
+                sops_run = await run_sops(
+                    sops_args,
+                    timeout=self.timeout,
+                    stdout=open_out_file,
+                    retries=self.retries,
+                    hedge=self.hedge,
+                )
+                sops_run.check_returncode()
+            except subprocess.CalledProcessError as e:
+                message = "Unable to encrypt file. sops command {}. sops error message: {}".format(
+                    sops_args, e.stderr.decode()
+                )
+                logger.exception(message, exc_info=e)
+                raise OSError(message)
+            except subprocess.TimeoutExpired as e:
+                message = "Unable to encrypt file. sops command {} did not finish within {} seconds.".format(
+                    sops_args, e.timeout
+                )
+                logger.error(message)
+                raise OSError(message)
 
         if len(sops_run.stderr):
             logger.debug(b"sops stderr: " + sops_run.stderr)
 
-        abs_output_filename = self.get_absolute_path(output_filename)
-
-        with open(abs_output_filename, "wb") as open_out_file:
-            open_out_file.write(sops_run.stdout)
-
         logger.info(
             "Encrypted file {} at {} as format {}".format(
                 file_entry, output_filename, input_type
@@ -126,8 +353,8 @@ class Encrypt(BaseAction):
     def add_file_to_gitignore(
         self, file_entry: dict, prior_decrypted_file: Union[str, None] = None
     ) -> None:
-        """Adds the file to .gitignore if it isn't already present. Tries to preserve existing order and structure of
-        the file.
+        """Queues the file to be added to .gitignore if it isn't already present. The change is written by
+        flush_gitignore, along with those for every other file in the run.
 
         Args:
             file_entry: The dictionary object returned by Encrypt.encrypt_file containing keys for
@@ -138,8 +365,8 @@ class Encrypt(BaseAction):
         Returns:
             None
         """
-        gitignore_path = self.config.get("project", {}).get("gitignore_path")
         if not self.config.get("project", {}).get("gitignore_path"):
+            config_folder = os.path.dirname(os.path.abspath(self.config_path))
             try:
                 gitignore_path = self.find_gitignore_file()
             except FileNotFoundError:
@@ -148,36 +375,105 @@ class Encrypt(BaseAction):
                         self.config_path
                     )
                 )
-                gitignore_path = os.path.join(
-                    os.path.split(self.config_path)[0], ".gitignore"
-                )
+                gitignore_path = os.path.join(config_folder, ".gitignore")
 
-            # Update the config to use this path
+            # Update the config to use this path, relative to the config like the paths of its secrets
             if "project" not in self.config:
                 self.config["project"] = {}
-            self.config["project"]["gitignore_path"] = gitignore_path
-            self.flush_config()
-
-        with open(gitignore_path, "r") as open_gitignore:
-            new_gitignore_lines = []
-            found_file = False
-            for raw_line in open_gitignore:
-                line = raw_line.strip()
-                if line != prior_decrypted_file:
-                    # Remove any lines that match the prior file name
-                    new_gitignore_lines.append(line + os.linesep)
-                if line == file_entry.get("decrypted_path"):
-                    found_file = True
-
-        if not found_file:
-            # Add new decrypted path to gitignore
-            new_gitignore_lines.append(file_entry["decrypted_path"] + os.linesep)
-
-        with open(gitignore_path, "w") as open_gitignore:
-            open_gitignore.writelines(new_gitignore_lines)
+            self.config["project"]["gitignore_path"] = os.path.relpath(
+                gitignore_path, config_folder
+            )
+            self.mark_config_modified()
+
+        if self._gitignore_changes is None:
+            self._gitignore_changes = []
+        self._gitignore_changes.append(
+            (file_entry["decrypted_path"], prior_decrypted_file)
+        )
+
+    @stats.measure(stats.GITIGNORE_UPDATE)
+    def flush_gitignore(self) -> None:
+        """Apply every change queued by add_file_to_gitignore, reading and writing the .gitignore file once.
+
+        heysops keeps its entries in a block delimited by marker comments, appending new entries to the end of the
+        block and only removing prior entries from within it. Everything outside the block is left untouched, and a
+        file already ignored by a line outside the block is not added again.
+
+        Entries outside the block, such as those added by earlier versions of heysops, are never rewritten or
+        removed, even once their file is renamed.
+
+        The gitignore_path of the configuration, and the decrypted paths queued, are relative to the configuration
+        file. Entries are written relative to the folder of the .gitignore file, which may be a parent of it.
+
+        Returns:
+            None
+        """
+        if not self._gitignore_changes:
+            return None
+        gitignore_path = os.path.normpath(
+            self.get_absolute_path(self.config["project"]["gitignore_path"])
+        )
+        gitignore_folder = os.path.dirname(gitignore_path)
+
+        def get_entry(decrypted_path: str) -> str:
+            return os.path.relpath(
+                self.get_absolute_path(decrypted_path), gitignore_folder
+            ).replace(os.sep, "/")
+
+        try:
+            with open(gitignore_path, "r") as open_gitignore:
+                gitignore_text = open_gitignore.read()
+        except FileNotFoundError:
+            gitignore_text = ""
+        stats.count(stats.GITIGNORE_UPDATE, bytes_read=len(gitignore_text))
+        lines = gitignore_text.splitlines()
+
+        if (
+            GITIGNORE_BLOCK_START in lines
+            and GITIGNORE_BLOCK_END in lines[lines.index(GITIGNORE_BLOCK_START) :]
+        ):
+            block_start = lines.index(GITIGNORE_BLOCK_START)
+            block_end = lines.index(GITIGNORE_BLOCK_END, block_start)
+            before, block, after = (
+                lines[:block_start],
+                lines[block_start + 1 : block_end],
+                lines[block_end + 1 :],
+            )
+            has_block = True
+        else:
+            before, block, after = lines, [], []
+            has_block = False
+
+        outside_entries = set(x.strip() for x in before + after)
+        # A dictionary keeps the block ordered, while adding and removing entries in constant time
+        block_entries = dict.fromkeys(x.strip() for x in block if x.strip())
+        for decrypted_path, prior_decrypted_file in self._gitignore_changes:
+            decrypted_path = get_entry(decrypted_path)
+            if prior_decrypted_file:
+                prior_decrypted_file = get_entry(prior_decrypted_file)
+            if prior_decrypted_file and prior_decrypted_file != decrypted_path:
+                block_entries.pop(prior_decrypted_file, None)
+            if decrypted_path not in outside_entries:
+                block_entries[decrypted_path] = None
+        self._gitignore_changes = []
+
+        # Keep an existing block, even once empty, so the markers stay where the user may have moved them
+        new_lines = before
+        if block_entries or has_block:
+            new_lines = (
+                before
+                + [GITIGNORE_BLOCK_START]
+                + list(block_entries)
+                + [GITIGNORE_BLOCK_END]
+                + after
+            )
+        if new_lines != lines:
+            gitignore_data = "".join(x + "\n" for x in new_lines).encode("utf-8")
+            write_file_atomic(gitignore_path, gitignore_data)
+            stats.count(stats.GITIGNORE_UPDATE, bytes_written=len(gitignore_data))
 
     def find_gitignore_file(self) -> str:
-        """Search for a .gitignore file.
+        """Search the folder of the configuration file, then each of its parents, for a .gitignore file.
 
         Raises:
             FileNotFoundError: If a .gitignore file is not identified
@@ -186,19 +482,12 @@ class Encrypt(BaseAction):
             str: Path to a discovered .gitignore file.
         """
         # Find the gitignore file
-        folder_to_check = os.curdir
-        filename = ".gitignore"
-        found = False
-        while not found:
-            found = self._check_folder_for_file(folder_to_check, filename)
-            if found:
-                return os.path.join(folder_to_check, filename)
-
-            if not os.path.split(folder_to_check)[1]:
-                break  # We are at the root of the drive and didn't find it
-
-            # Set new folder to call
-            folder_to_check = os.path.abspath(os.path.join(folder_to_check, ".."))
+        found = self.find_file_in_parents(
+            [".gitignore"],
+            start_folder=os.path.dirname(os.path.abspath(self.config_path)),
+        )
+        if found:
+            return found
 
         raise FileNotFoundError("Could not find a .gitignore file.")
 
@@ -215,9 +504,7 @@ class Encrypt(BaseAction):
         # Encrypt sub_parser
         cli_encrypt = sub_parser.add_parser(
             "encrypt",
-            help="Encrypts all files that were previously encrypted with this tool. Uses the .heysops.yaml file "
-            "in the local directory. If .heysops.yaml is not found in the current directory, it traverses "
-            "upwards until it finds one. If it doesn't find one, it warns and exits.",
+            help=Action.get_action_help("encrypt"),
         )
         cli_encrypt.add_argument(
             "-t",
@@ -233,6 +520,14 @@ class Encrypt(BaseAction):
             help="A custom filename to write the encrypted data to. Saved within your .heysops.yaml configuration "
             "file. Not available if you do not specify a single file name",
         )
+        cli_encrypt.add_argument(
+            "-j",
+            "--jobs",
+            help="The number of files to encrypt concurrently. Configuration and .gitignore updates are applied "
+            "once all files are encrypted.",
+            type=int,
+            default=1,
+        )
         cli_encrypt.add_argument(
             "FILE",
             help="The name of the file to encrypt. If a single dash ('-') or not specified, all files found in "
@@ -240,4 +535,5 @@ class Encrypt(BaseAction):
             nargs="*",
             default="-",
         )
+        add_recursive_argument(cli_encrypt)
         return cli_encrypt
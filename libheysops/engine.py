@@ -0,0 +1,411 @@
+"""The sops execution engine, shared by every action.
+
+All sops invocations are run as asyncio subprocesses, allowing many of them to be in flight at once without a thread
+per call. Synchronous callers use :func:`run_sync` to drive a coroutine to completion.
+
+Calls that time out, or fail in a way that suggests a key service was briefly unreachable or throttling, can be retried
+after a random, exponentially growing delay. Calls can also be hedged: once a call has run for longer than 95% of the
+calls made so far by the process, a duplicate is started and whichever finishes first successfully is used.
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, Awaitable, Callable, Iterable, List, Tuple, Union
+
+from libheysops import stats
+from libheysops.cache import load_cache_file, save_cache_file
+
+logger = logging.getLogger()
+
+SOPS_CACHE_FILE = "sops.json"
+
+# The number of retries of a call that timed out or failed transiently, unless configured otherwise. Retrying is opt-in
+DEFAULT_RETRIES = 0
+# The delay before the first retry is up to RETRY_BASE_DELAY seconds, doubling with each further retry up to
+# RETRY_MAX_DELAY. The actual delay is random within that range, so parallel calls do not retry in lock step.
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 10.0
+
+# sops exit codes for failures that the same call will fail with again, such as unreadable input, a bad configuration
+# or a MAC mismatch
+PERMANENT_EXIT_CODES = frozenset([2, 3, 5, 6, 7, 8, 24, 51, 52, 61, 91, 100, 111, 203])
+# Key service errors reported by sops that are likely to pass
+TRANSIENT_ERRORS = re.compile(
+    r"time ?out|timed out|deadline exceeded|throttl|rate exceeded|too many requests|request ?limit|"
+    r"service ?unavailable|internal ?(server )?error|\b(429|500|502|503|504)\b|connection (reset|refused|closed)|"
+    r"broken pipe|no route to host|temporar(y|ily)|try again|tls handshake|unavailable",
+    re.IGNORECASE,
+)
+# Errors that mean the call can not succeed, even when reported alongside a transient error for another key
+PERMANENT_ERRORS = re.compile(
+    r"access ?denied|unauthori[sz]ed|forbidden|permission denied|invalid|not ?found|no such file|mac mismatch",
+    re.IGNORECASE,
+)
+
+# Hedging starts once this many calls have succeeded, to have a meaningful 95th percentile
+HEDGE_MIN_SAMPLES = 20
+HEDGE_PERCENTILE = 0.95
+# The durations of the most recent successful calls, in seconds
+_latencies = collections.deque(maxlen=1000)  # type: collections.deque
+
+
+async def run_sops(
+    sops_args: List[str],
+    timeout: Union[float, None] = None,
+    stdout: Union[IO, None] = None,
+    retries: int = 0,
+    hedge: bool = False,
+) -> subprocess.CompletedProcess:
+    """Run a sops command and capture its output.
+
+    Args:
+        sops_args: The sops executable followed by its arguments.
+        timeout: The number of seconds to wait for each attempt to exit. None waits forever.
+        stdout: An open file for sops to write its output to directly, so the output is never held in memory. If
+          None, the output is captured. The file is emptied before each retry.
+        retries: The number of times to retry a call that timed out or failed transiently, as decided by
+          is_transient_failure.
+        hedge: Whether to start a duplicate of each attempt that runs for longer than get_hedge_delay.
+
+    Raises:
+        subprocess.TimeoutExpired: If the last attempt did not exit within the timeout. The process is killed.
+
+    Returns:
+        subprocess.CompletedProcess: The exit code, stdout and stderr of the last sops process. stdout is None when it
+          was written to a file.
+    """
+    attempt = 0
+    while True:
+        try:
+            sops_run = await _run_sops_hedged(sops_args, timeout, stdout, hedge)
+        except subprocess.TimeoutExpired as e:
+            if attempt >= retries:
+                raise
+            reason = "did not finish within {} seconds".format(e.timeout)
+        else:
+            if (
+                sops_run.returncode == 0
+                or attempt >= retries
+                or not is_transient_failure(sops_run.returncode, sops_run.stderr)
+            ):
+                return sops_run
+            reason = "failed with exit code {}: {}".format(
+                sops_run.returncode,
+                sops_run.stderr.decode("utf-8", "replace").strip(),
+            )
+
+        attempt += 1
+        delay = get_retry_delay(attempt)
+        logger.warning(
+            "sops {} {}. Retrying in {:.1f} seconds ({} of {}).".format(
+                " ".join(sops_args[1:]), reason, delay, attempt, retries
+            )
+        )
+        if stdout is not None:
+            stdout.seek(0)
+            stdout.truncate()
+        await asyncio.sleep(delay)
+
+
+async def _run_sops_hedged(
+    sops_args: List[str],
+    timeout: Union[float, None],
+    stdout: Union[IO, None],
+    hedge: bool,
+) -> subprocess.CompletedProcess:
+    hedge_delay = get_hedge_delay() if hedge else None
+    primary = asyncio.ensure_future(_run_sops_once(sops_args, timeout, stdout))
+    if hedge_delay is None:
+        return await primary
+
+    done, _ = await asyncio.wait([primary], timeout=hedge_delay)
+    if done:
+        return primary.result()
+
+    logger.debug(
+        "sops {} is slower than {:.3f} seconds. Starting a duplicate.".format(
+            " ".join(sops_args[1:]), hedge_delay
+        )
+    )
+    # The duplicate writes to a file of its own, next to the output so large outputs are not held in memory or written
+    # to a smaller temporary file system, as both processes can not write to the same file
+    duplicate_file = None
+    if stdout is not None:
+        output_name = getattr(stdout, "name", None)
+        duplicate_file = tempfile.TemporaryFile(
+            dir=os.path.dirname(output_name) if isinstance(output_name, str) else None
+        )
+    try:
+        duplicate = asyncio.ensure_future(
+            _run_sops_once(sops_args, timeout, duplicate_file)
+        )
+        pending = {primary, duplicate}
+        winner = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for finished in [x for x in (primary, duplicate) if x in done]:
+                    if (
+                        finished.exception() is None
+                        and finished.result().returncode == 0
+                    ):
+                        winner = finished
+                        break
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+        if winner is None:
+            # Both failed, so report the original call's failure
+            return primary.result()
+
+        if winner is duplicate and duplicate_file is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, _replace_content, stdout, duplicate_file
+            )
+        return winner.result()
+    finally:
+        if duplicate_file is not None:
+            duplicate_file.close()
+
+
+def _replace_content(output_file: IO, source_file: IO) -> None:
+    # Copied in chunks, keeping memory use bounded. The output is rewritten in place rather than renamed over, as its
+    # caller holds it open to record its size and flush it
+    output_file.seek(0)
+    output_file.truncate()
+    source_file.seek(0)
+    shutil.copyfileobj(source_file, output_file)
+    output_file.flush()
+
+
+async def _run_sops_once(
+    sops_args: List[str],
+    timeout: Union[float, None],
+    stdout: Union[IO, None],
+    record: bool = True,
+) -> subprocess.CompletedProcess:
+    logger.debug("Running `{}`".format(" ".join(sops_args)))
+    start = time.perf_counter()
+    output_file = stdout
+    process = await asyncio.create_subprocess_exec(
+        *sops_args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE if stdout is None else stdout,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        if record:
+            _record_sops_call(sops_args, start, None, None, output_file)
+        raise subprocess.TimeoutExpired(sops_args, timeout)
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+
+    if record:
+        _record_sops_call(sops_args, start, process.returncode, stdout, output_file)
+        if process.returncode == 0:
+            _latencies.append(time.perf_counter() - start)
+    return subprocess.CompletedProcess(sops_args, process.returncode, stdout, stderr)
+
+
+def is_transient_failure(returncode: int, stderr: Union[bytes, None]) -> bool:
+    """Decide whether a failed sops call may succeed if it is retried.
+
+    A failure is transient when sops did not exit with one of the PERMANENT_EXIT_CODES, and its error message names a
+    timeout, throttling, or an unavailable key service, without also naming an error that a retry can not fix, such as
+    access being denied.
+
+    Args:
+        returncode: The exit code of the sops process.
+        stderr: The error output of the sops process.
+
+    Returns:
+        bool: Whether to retry the call.
+    """
+    if returncode == 0 or returncode in PERMANENT_EXIT_CODES:
+        return False
+    message = (stderr or b"").decode("utf-8", "replace")
+    return bool(TRANSIENT_ERRORS.search(message)) and not PERMANENT_ERRORS.search(
+        message
+    )
+
+
+def get_retry_delay(attempt: int) -> float:
+    """Get the number of seconds to wait before a retry, with full jitter.
+
+    Args:
+        attempt: The number of the retry, starting at 1.
+
+    Returns:
+        float: A random delay between 0 and RETRY_BASE_DELAY doubled for each earlier retry, at most RETRY_MAX_DELAY.
+    """
+    return random.uniform(
+        0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    )
+
+
+def get_hedge_delay() -> Union[float, None]:
+    """Get how long a call may run before a duplicate of it is started: the 95th percentile of the durations of the
+    recent successful calls of this process.
+
+    Returns:
+        float: The number of seconds, or None until HEDGE_MIN_SAMPLES calls have succeeded.
+    """
+    if len(_latencies) < HEDGE_MIN_SAMPLES:
+        return None
+    latencies = sorted(_latencies)
+    return latencies[min(int(len(latencies) * HEDGE_PERCENTILE), len(latencies) - 1)]
+
+
+def _record_sops_call(
+    sops_args: List[str],
+    start: float,
+    returncode: Union[int, None],
+    stdout: Union[bytes, None],
+    output_file: Union[IO, None],
+) -> None:
+    if not stats.is_enabled():
+        return None
+    seconds = time.perf_counter() - start
+    if stdout is not None:
+        bytes_written = len(stdout)
+    else:
+        # sops wrote through the file's descriptor, which moved its position along
+        try:
+            bytes_written = os.lseek(output_file.fileno(), 0, os.SEEK_CUR)
+        except (AttributeError, OSError, ValueError):
+            bytes_written = 0
+    stats.add_sops_call(
+        sops_args,
+        seconds,
+        returncode,
+        bytes_read=stats.get_file_size(sops_args[-1]),
+        bytes_written=bytes_written,
+    )
+
+
+async def probe_sops(sops: str) -> str:
+    """Check that a sops executable works, and get its version.
+
+    The result is cached per binary, keyed by its resolved path, inode, size and modification time, so `sops -v` only
+    runs again once the binary changes.
+
+    Args:
+        sops: The path to, or name on the system path of, the sops executable.
+
+    Raises:
+        FileNotFoundError: If the executable does not exist.
+        subprocess.CalledProcessError: If the executable did not run successfully.
+
+    Returns:
+        str: The sops version, such as "3.7.1".
+    """
+    resolved = shutil.which(sops)
+    if resolved is None:
+        raise FileNotFoundError(sops)
+    resolved = os.path.realpath(resolved)
+    binary_stat = os.stat(resolved)
+    signature = {
+        "inode": binary_stat.st_ino,
+        "size": binary_stat.st_size,
+        "mtime_ns": binary_stat.st_mtime_ns,
+    }
+
+    probes = load_cache_file(SOPS_CACHE_FILE)
+    cached = probes.get(resolved, {})
+    if cached.get("signature") == signature and cached.get("version"):
+        return cached["version"]
+
+    # Timed by the caller as the sops probe phase, rather than counted with the invocations that process secrets
+    sops_run = await _run_sops_once([sops, "-v"], None, None, record=False)
+    sops_run.check_returncode()
+    output = sops_run.stdout.decode("utf-8", "replace")
+    version_match = re.search(r"\d+\.\d+\.\d+\S*", output)
+    version = version_match.group(0) if version_match else output.strip()
+
+    probes[resolved] = {"signature": signature, "version": version}
+    save_cache_file(SOPS_CACHE_FILE, probes)
+    return version
+
+
+async def gather_bounded(
+    func: Callable[[Any], Awaitable[Any]],
+    items: Iterable[Any],
+    jobs: int = 1,
+    semaphore: Union[asyncio.Semaphore, None] = None,
+) -> List[Tuple[Any, Any, Union[OSError, None]]]:
+    """Await func once per item, with at most `jobs` calls in flight at a time.
+
+    An OSError raised for one item does not prevent the remaining items from being processed; it is returned
+    alongside the item instead. Any other exception, or cancellation, cancels the calls still in flight and is raised
+    once they have stopped.
+
+    Args:
+        func: A coroutine function accepting a single item.
+        items: The items to process.
+        jobs: The maximum number of concurrent calls.
+        semaphore: A semaphore shared with other calls, bounding their combined concurrency instead of jobs.
+
+    Returns:
+        list: One (item, result, error) tuple per item, in the same order as items. error is None on success.
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(jobs or 1, 1))
+
+    async def call(item):
+        async with semaphore:
+            try:
+                return item, await func(item), None
+            except OSError as e:
+                return item, None, e
+
+    tasks = [asyncio.ensure_future(call(item)) for item in items]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        # Stop the calls still in flight before returning, so none of them outlives this call
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def run_sync(coroutine: Awaitable[Any]) -> Any:
+    """Run a coroutine to completion from synchronous code.
+
+    When called from a thread that is already running an event loop, the coroutine runs on a new event loop in a
+    helper thread, as the running loop cannot be re-entered.
+
+    Args:
+        coroutine: The coroutine to run.
+
+    Returns:
+        The value returned by the coroutine.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -0,0 +1,331 @@
+import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+from typing import Dict, List, Tuple, Union
+
+from libheysops import Action
+from libheysops.decrypt.decrypt import Decrypt
+from libheysops.engine import gather_bounded, run_sync
+
+logger = logging.getLogger()
+
+FD_VARIABLE_PREFIX = "HEYSOPS_FD_"
+
+
+class Exec(Decrypt):
+    """Run a command with decrypted secrets, without writing the decrypted content to the file system.
+
+    Secrets are decrypted into memory and handed to the command either as environment variables, one per top level
+    key, or as file descriptors the command can read the whole secret from.
+    """
+
+    returncode = None
+
+    def __init__(self, **kwargs):
+        super(Exec, self).__init__(**kwargs)
+
+    def run(self, **kwargs) -> None:
+        """Entry point for this action's operation
+
+        Decrypts the selected secrets concurrently, then runs the command with them and waits for it to exit. The
+        command's exit code is stored in self.returncode.
+
+        Args:
+            **kwargs: The keyword arguments from the command line.
+
+        Keyword Args:
+            COMMAND: The command to run, followed by its arguments.
+            secret: The decrypted or encrypted paths of the secrets to inject. If None, every dotenv, json and
+              yaml secret in the configuration is injected.
+            fd: Whether to pass each secret as a file descriptor rather than as environment variables.
+            jobs: The number of sops invocations to run concurrently
+
+        Raises:
+            ValueError: If no command was given, or a requested secret is not tracked or not a supported format.
+            OSError: If any of the secrets could not be decrypted. The command is not started.
+
+        Returns:
+            None.
+        """
+        command = list(kwargs.get("COMMAND") or [])
+        if command[:1] == ["--"]:
+            command = command[1:]
+        if not command:
+            raise ValueError(
+                "No command to run was given. Usage: heysops exec -- COMMAND"
+            )
+
+        config_entries = self.select_secrets(kwargs.get("secret"))
+        secrets = run_sync(
+            self.decrypt_secrets(
+                config_entries,
+                keep_format=bool(kwargs.get("fd")),
+                jobs=kwargs.get("jobs") or 1,
+            )
+        )
+
+        if kwargs.get("fd"):
+            self.returncode = self.run_with_fds(command, secrets)
+        else:
+            self.returncode = self.run_with_environment(command, secrets)
+
+    def select_secrets(self, file_paths: Union[List[str], None] = None) -> List[dict]:
+        """Find the configuration entries of the secrets to inject.
+
+        Args:
+            file_paths: The decrypted or encrypted paths of the secrets. If None, every secret in a supported format
+              is selected and the others are skipped.
+
+        Raises:
+            ValueError: If a requested secret is not tracked, or is not in a supported format.
+
+        Returns:
+            list: The configuration entries, in order.
+        """
+        if not file_paths:
+            config_entries = []
+            for config_entry in self.secrets:
+                if self.get_secret_format(config_entry):
+                    config_entries.append(config_entry)
+                else:
+                    logger.debug(
+                        "Skipping {}, which is not a dotenv, json or yaml file.".format(
+                            config_entry.get("decrypted_path")
+                        )
+                    )
+            return config_entries
+
+        config_entries = []
+        for file_path in file_paths:
+            config_entry = self.find_file_in_config(file_path=file_path)
+            if not config_entry:
+                raise ValueError("{} not found in configuration.".format(file_path))
+            if not self.get_secret_format(config_entry):
+                raise ValueError(
+                    "{} is not a dotenv, json or yaml file, and cannot be injected.".format(
+                        file_path
+                    )
+                )
+            config_entries.append(config_entry)
+        return config_entries
+
+    async def decrypt_secrets(
+        self, config_entries: List[dict], keep_format: bool = False, jobs: int = 1
+    ) -> List[Tuple[dict, bytes]]:
+        """Decrypt several secrets concurrently, into memory.
+
+        Args:
+            config_entries: The configuration entries of the secrets to decrypt.
+            keep_format: Whether to decrypt each secret in its own format. Otherwise they are decrypted as json.
+            jobs: The number of sops invocations to run concurrently
+
+        Raises:
+            OSError: Once all secrets are processed, if any of them could not be decrypted.
+
+        Returns:
+            list: One (configuration entry, decrypted content) tuple per secret, in order.
+        """
+        decrypted = await gather_bounded(
+            lambda config_entry: self.decrypt_to_memory_async(
+                file_entry=config_entry["encrypted_path"],
+                input_type=self.get_secret_format(config_entry),
+                output_type=(
+                    self.get_secret_format(config_entry) if keep_format else "json"
+                ),
+            ),
+            config_entries,
+            jobs=jobs,
+        )
+
+        failed_files = []
+        for config_entry, _, error in decrypted:
+            if error is not None:
+                logger.error(str(error))
+                failed_files.append(config_entry["encrypted_path"])
+        if failed_files:
+            raise OSError(
+                "Unable to decrypt {} of {} secrets: {}".format(
+                    len(failed_files), len(decrypted), ", ".join(failed_files)
+                )
+            )
+
+        return [(config_entry, data) for config_entry, data, _ in decrypted]
+
+    @staticmethod
+    def build_environment(secrets: List[Tuple[dict, bytes]]) -> Dict[str, str]:
+        """Convert secrets decrypted as json into environment variables, one per top level key.
+
+        String values are used as is, and any other value is json encoded. When several secrets share a key, the
+        last one in the configuration wins.
+
+        Args:
+            secrets: The (configuration entry, decrypted json) tuples.
+
+        Raises:
+            ValueError: If a secret is not a mapping of keys to values.
+
+        Returns:
+            dict: The environment variables.
+        """
+        environment = {}
+        for config_entry, data in secrets:
+            values = json.loads(data.decode("utf-8"))
+            if not isinstance(values, dict):
+                raise ValueError(
+                    "{} does not hold keys and values, and cannot be injected as environment variables.".format(
+                        config_entry.get("decrypted_path")
+                    )
+                )
+            for key, value in values.items():
+                if key in environment:
+                    logger.debug(
+                        "{} from {} replaces an earlier value.".format(
+                            key, config_entry.get("decrypted_path")
+                        )
+                    )
+                environment[key] = (
+                    value if isinstance(value, str) else json.dumps(value)
+                )
+        return environment
+
+    @staticmethod
+    def get_fd_variable(decrypted_path: str) -> str:
+        """Name the environment variable that holds the file descriptor of a secret.
+
+        Args:
+            decrypted_path: The decrypted path of the secret, such as "config/db.json".
+
+        Returns:
+            str: The variable name, such as "HEYSOPS_FD_CONFIG_DB_JSON".
+        """
+        return FD_VARIABLE_PREFIX + re.sub(r"[^A-Za-z0-9]", "_", decrypted_path).upper()
+
+    def run_with_environment(
+        self, command: List[str], secrets: List[Tuple[dict, bytes]]
+    ) -> int:
+        """Run the command with each secret's keys added to its environment.
+
+        Args:
+            command: The command to run, followed by its arguments.
+            secrets: The (configuration entry, decrypted json) tuples.
+
+        Returns:
+            int: The command's exit code.
+        """
+        environment = dict(os.environ)
+        environment.update(self.build_environment(secrets))
+        logger.info(
+            "Running {} with {} secrets in its environment.".format(
+                command[0], len(secrets)
+            )
+        )
+        return subprocess.run(command, env=environment).returncode
+
+    def run_with_fds(
+        self, command: List[str], secrets: List[Tuple[dict, bytes]]
+    ) -> int:
+        """Run the command with each secret readable from an inherited pipe.
+
+        The number of each pipe's file descriptor is passed in an environment variable named by get_fd_variable, so
+        the command can read the secret from `/dev/fd/$HEYSOPS_FD_...`. The secrets are written by background threads,
+        as a pipe only buffers a limited amount of data until the command reads it.
+
+        Args:
+            command: The command to run, followed by its arguments.
+            secrets: The (configuration entry, decrypted content) tuples.
+
+        Returns:
+            int: The command's exit code.
+        """
+        environment = dict(os.environ)
+        pipes = []
+        try:
+            for config_entry, data in secrets:
+                read_fd, write_fd = os.pipe()
+                pipes.append((read_fd, write_fd, data))
+                environment[self.get_fd_variable(config_entry["decrypted_path"])] = str(
+                    read_fd
+                )
+
+            logger.info(
+                "Running {} with {} secrets as file descriptors.".format(
+                    command[0], len(secrets)
+                )
+            )
+            process = subprocess.Popen(
+                command, env=environment, pass_fds=[x[0] for x in pipes]
+            )
+        except BaseException:
+            for read_fd, write_fd, _ in pipes:
+                os.close(read_fd)
+                os.close(write_fd)
+            raise
+
+        writers = []
+        for read_fd, write_fd, data in pipes:
+            # Only the command reads from the pipe now
+            os.close(read_fd)
+            writer = threading.Thread(
+                target=self._write_pipe, args=(write_fd, data), daemon=True
+            )
+            writer.start()
+            writers.append(writer)
+
+        returncode = process.wait()
+        for writer in writers:
+            writer.join()
+        return returncode
+
+    @staticmethod
+    def _write_pipe(write_fd: int, data: bytes) -> None:
+        try:
+            with os.fdopen(write_fd, "wb") as open_pipe:
+                open_pipe.write(data)
+        except BrokenPipeError:
+            # The command exited, or closed the descriptor, without reading the whole secret
+            pass
+
+    @staticmethod
+    def argparse_sub_parser(sub_parser) -> argparse.Action:
+        """CLI Argument definitions
+
+        Args:
+            sub_parser: The sub-command parser object from the main argparse instance.
+
+        Returns:
+            argparse.Action: The defined action object.
+        """
+        cli_exec = sub_parser.add_parser(
+            "exec",
+            help=Action.get_action_help("exec"),
+        )
+        cli_exec.add_argument(
+            "-s",
+            "--secret",
+            help="The name of the encrypted or decrypted file to inject. May be repeated. If not specified, all "
+            "dotenv, json and yaml files found in .heysops.yaml are injected.",
+            action="append",
+        )
+        cli_exec.add_argument(
+            "--fd",
+            help="Pass each secret, in its own format, as a file descriptor instead of as environment variables. "
+            "The descriptor number is stored in HEYSOPS_FD_<DECRYPTED PATH>, such as HEYSOPS_FD_CONFIG_DB_JSON.",
+            action="store_true",
+        )
+        cli_exec.add_argument(
+            "-j",
+            "--jobs",
+            help="The number of secrets to decrypt concurrently.",
+            type=int,
+            default=1,
+        )
+        cli_exec.add_argument(
+            "COMMAND",
+            help="The command to run and its arguments, after a double dash ('--').",
+            nargs=argparse.REMAINDER,
+        )
+        return cli_exec
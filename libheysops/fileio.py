@@ -0,0 +1,294 @@
+"""Helpers for writing files safely.
+
+Every file is written to a temporary file in its destination folder and renamed into place, so an interrupted write
+never leaves a partial file behind. How much is flushed to disk before and after the rename depends on the durability
+level:
+
+* DURABILITY_NONE: Nothing is flushed. A power loss may lose or empty files written shortly before it.
+* DURABILITY_BATCH: The output files of a run are staged, flushed together once all of them are written, renamed into
+  place together and their folders flushed once each.
+* DURABILITY_STRICT: Each file is flushed before it is renamed into place, and its folder after.
+"""
+
+import contextlib
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Iterator, List, Tuple, Union
+
+from libheysops import stats
+
+logger = logging.getLogger()
+
+DURABILITY_NONE = "none"
+DURABILITY_BATCH = "batch"
+DURABILITY_STRICT = "strict"
+DURABILITY_LEVELS = [DURABILITY_NONE, DURABILITY_BATCH, DURABILITY_STRICT]
+
+# The number of files flushed at once by StagedOutputs.commit. Journaling file systems commit concurrent flushes
+# together, so this costs little more than flushing one file.
+FSYNC_JOBS = 16
+
+# The temporary path, destination path, bytes written, stats phase and commit callback of a staged file
+_StagedFile = Tuple[str, str, int, Union[str, None], Union[Callable[[], None], None]]
+
+
+def fsync_file(file_path: str) -> None:
+    """Flush a file's content to disk.
+
+    Args:
+        file_path: The file to flush.
+
+    Returns:
+        None
+    """
+    file_fd = os.open(file_path, os.O_RDWR)
+    try:
+        os.fsync(file_fd)
+    finally:
+        os.close(file_fd)
+
+
+def fsync_folder(folder: str) -> None:
+    """Flush a folder's entries to disk, so that files renamed into it stay renamed after a power loss.
+
+    Folders cannot be opened on Windows, where renames are flushed with the file system's metadata instead.
+
+    Args:
+        folder: The folder to flush.
+
+    Returns:
+        None
+    """
+    if os.name == "nt":
+        return None
+    folder_fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(folder_fd)
+    finally:
+        os.close(folder_fd)
+
+
+def _create_temp_file(file_path: str) -> Tuple[int, str]:
+    folder, filename = os.path.split(os.path.abspath(file_path))
+    return tempfile.mkstemp(prefix=".{}.".format(filename), suffix=".tmp", dir=folder)
+
+
+def _open_temp_file(temp_fd: int, temp_path: str) -> BinaryIO:
+    # Wraps the descriptor from mkstemp, naming the file object after its path rather than its descriptor, so the
+    # folder it is in can be told from it
+    return open(temp_path, "wb", opener=lambda path, flags: temp_fd)
+
+
+def _replace(temp_path: str, file_path: str) -> None:
+    if os.path.exists(file_path):
+        os.chmod(temp_path, os.stat(file_path).st_mode & 0o7777)
+    os.replace(temp_path, file_path)
+
+
+def _remove_quietly(file_path: str) -> None:
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+@contextlib.contextmanager
+def atomic_output(
+    file_path: str, phase: Union[str, None] = None, durability: str = DURABILITY_NONE
+) -> Iterator[BinaryIO]:
+    """Open a temporary file to write the content of file_path to, replacing file_path once the block exits.
+
+    The temporary file is created in the destination folder, so it can be renamed over file_path. If the block raises,
+    the temporary file is removed and file_path is left unchanged. An existing file keeps its permissions; new files
+    are only readable by the current user.
+
+    Args:
+        file_path: The path of the file to write.
+        phase: The libheysops.stats phase to record the bytes written and the time taken to move the file into
+          place under.
+        durability: DURABILITY_NONE to leave flushing to the operating system. Otherwise the file is flushed before it
+          replaces file_path, and the folder after.
+
+    Yields:
+        BinaryIO: The open temporary file, named after its path. Its descriptor may be handed to a subprocess to
+          write to directly.
+    """
+    temp_fd, temp_path = _create_temp_file(file_path)
+    try:
+        with _open_temp_file(temp_fd, temp_path) as open_temp_file:
+            yield open_temp_file
+            start = time.perf_counter()
+            bytes_written = open_temp_file.tell()
+            if durability != DURABILITY_NONE:
+                open_temp_file.flush()
+                os.fsync(open_temp_file.fileno())
+        _replace(temp_path, file_path)
+        if durability != DURABILITY_NONE:
+            fsync_folder(os.path.dirname(os.path.abspath(file_path)))
+        if phase is not None:
+            stats.add(phase, time.perf_counter() - start, bytes_written=bytes_written)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class StagedOutputs:
+    """Output files that are written to temporary files, then moved into place together by commit.
+
+    Nothing is visible at the destinations until commit is called, so a run that is interrupted leaves every output
+    as it was. Call discard to remove the temporary files instead.
+
+    Args:
+        durability: DURABILITY_BATCH to flush every file before any is moved into place, and each folder once after.
+          DURABILITY_NONE to leave flushing to the operating system.
+    """
+
+    def __init__(self, durability: str = DURABILITY_BATCH):
+        self.durability = durability
+        self._staged = []  # type: List[_StagedFile]
+        self.discarded = False
+
+    def __len__(self) -> int:
+        return len(self._staged)
+
+    @contextlib.contextmanager
+    def open(
+        self,
+        file_path: str,
+        phase: Union[str, None] = None,
+        on_commit: Union[Callable[[], None], None] = None,
+    ) -> Iterator[BinaryIO]:
+        """Open a temporary file to write the content of file_path to, staged to replace file_path on commit.
+
+        If the block raises, the temporary file is removed and nothing is staged. A file staged twice is replaced by
+        the content staged last.
+
+        Raises:
+            OSError: If the batch was discarded before the file was opened or finished.
+
+        Args:
+            file_path: The path of the file to write.
+            phase: The libheysops.stats phase to record the bytes written and the time taken to move the file into
+              place under.
+            on_commit: Called once the file is in place.
+
+        Yields:
+            BinaryIO: The open temporary file, named after its path. Its descriptor may be handed to a subprocess to
+              write to directly.
+        """
+        if self.discarded:
+            raise OSError(
+                "The batch was discarded. {} was not written.".format(file_path)
+            )
+        temp_fd, temp_path = _create_temp_file(file_path)
+        try:
+            with _open_temp_file(temp_fd, temp_path) as open_temp_file:
+                yield open_temp_file
+                bytes_written = open_temp_file.tell()
+        except BaseException:
+            _remove_quietly(temp_path)
+            raise
+        if self.discarded:
+            # Finished after the batch was discarded, such as by a task that ignored its cancellation
+            _remove_quietly(temp_path)
+            raise OSError(
+                "The batch was discarded. {} was not written.".format(file_path)
+            )
+        self._staged.append((temp_path, file_path, bytes_written, phase, on_commit))
+
+    def commit(self) -> Dict[str, OSError]:
+        """Move every staged file into place, in the order they were staged.
+
+        A file that could not be flushed or moved is left as it was, and does not prevent the others from being moved.
+
+        Returns:
+            dict: Maps the path of each file that could not be moved into place to the error preventing it.
+        """
+        staged, self._staged = self._staged, []
+        if not staged:
+            return {}
+        start = time.perf_counter()
+        errors = {}  # type: Dict[str, OSError]
+
+        if self.durability == DURABILITY_BATCH:
+            with ThreadPoolExecutor(
+                max_workers=min(FSYNC_JOBS, len(staged))
+            ) as executor:
+                flushed = list(
+                    executor.map(self._fsync_quietly, [x[0] for x in staged])
+                )
+            for (temp_path, file_path, _, _, _), error in zip(staged, flushed):
+                if error is not None:
+                    errors[file_path] = error
+
+        committed = []
+        for temp_path, file_path, bytes_written, phase, on_commit in staged:
+            if file_path in errors:
+                _remove_quietly(temp_path)
+                continue
+            try:
+                _replace(temp_path, file_path)
+            except OSError as e:
+                errors[file_path] = e
+                _remove_quietly(temp_path)
+                continue
+            committed.append((file_path, bytes_written, phase, on_commit))
+
+        if self.durability == DURABILITY_BATCH:
+            for folder in sorted(
+                set(os.path.dirname(os.path.abspath(x[0])) for x in committed)
+            ):
+                try:
+                    fsync_folder(folder)
+                except OSError as e:
+                    # The files are in place, they may just not stay there after a power loss
+                    logger.warning("Unable to flush folder {}: {}".format(folder, e))
+
+        seconds = (time.perf_counter() - start) / len(staged)
+        for file_path, bytes_written, phase, on_commit in committed:
+            if phase is not None:
+                stats.add(phase, seconds, bytes_written=bytes_written)
+            if on_commit is not None:
+                on_commit()
+        return errors
+
+    def discard(self) -> None:
+        """Remove every staged file, leaving the destinations as they were. Files can not be staged afterwards.
+
+        Returns:
+            None
+        """
+        self.discarded = True
+        staged, self._staged = self._staged, []
+        for temp_path, _, _, _, _ in staged:
+            _remove_quietly(temp_path)
+
+    @staticmethod
+    def _fsync_quietly(file_path: str) -> Union[OSError, None]:
+        try:
+            fsync_file(file_path)
+        except OSError as e:
+            return e
+        return None
+
+
+def write_file_atomic(
+    file_path: str, data: bytes, durability: str = DURABILITY_NONE
+) -> None:
+    """Write data to file_path without ever leaving a partially written file behind.
+
+    Args:
+        file_path: The path of the file to write.
+        data: The content to write.
+        durability: DURABILITY_NONE to leave flushing to the operating system. Otherwise the file and its folder are
+          flushed.
+
+    Returns:
+        None
+    """
+    with atomic_output(file_path, durability=durability) as open_temp_file:
+        open_temp_file.write(data)
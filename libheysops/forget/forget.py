@@ -1,6 +1,7 @@
 import argparse
 import logging
 
+from libheysops import Action
 from libheysops.base import BaseAction
 
 logger = logging.getLogger()
@@ -56,8 +57,7 @@ class Forget(BaseAction):
         """
         cli_forget = sub_parser.add_parser(
             "forget",
-            help="Remove a file from the .heysops.yaml. This will leave the file on the system and no "
-            "longer interact with it through other commands.",
+            help=Action.get_action_help("forget"),
         )
         cli_forget.add_argument(
             "FILE",
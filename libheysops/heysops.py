@@ -1,4 +1,6 @@
 import argparse
+import contextlib
+import io
 import logging
 import sys
 from typing import Union, List
@@ -55,10 +57,122 @@ def setup_logging(
         logging_obj.addHandler(file_handle)
 
 
+def add_global_arguments(
+    cli_args: argparse.ArgumentParser, with_version: bool = True
+) -> None:
+    """Define the arguments that apply to every command.
+
+    Args:
+        cli_args: The main argparse instance.
+        with_version: Whether to define `--version`, which prints the version and exits when parsed.
+
+    Returns:
+        None
+    """
+    cli_args.add_argument(
+        "-c", "--config", help="Path to a .heysops.yaml configuration file."
+    )
+    cli_args.add_argument("-f", "--force", help="Force an action.", action="store_true")
+    cli_args.add_argument("-l", "--log", help="Path to a log file to write to.")
+    cli_args.add_argument(
+        "--timeout",
+        help="Number of seconds to wait for each sops invocation before giving up on it.",
+        type=float,
+    )
+    cli_args.add_argument(
+        "--retries",
+        help="Number of times to retry a sops invocation that timed out or failed with a temporary error, such as a "
+        "throttled or unavailable key service. Errors such as denied access or a bad file are not retried. "
+        "Defaults to 0, which does not retry.",
+        type=int,
+    )
+    cli_args.add_argument(
+        "--hedge",
+        help="Start a second copy of a sops invocation that is slower than 95%% of those before it, and use "
+        "whichever finishes first. Helps large runs that are slowed by a few slow key service requests.",
+        action="store_true",
+    )
+    cli_args.add_argument(
+        "--durability",
+        help="How files written are flushed to disk. none leaves it to the operating system, which is fastest but "
+        "may lose recent writes on a power loss. batch flushes the files of a run together, then moves them into "
+        "place. strict flushes and moves each file as soon as it is written. Defaults to the HEYSOPS_DURABILITY "
+        "environment variable, or batch.",
+        choices=["none", "batch", "strict"],
+    )
+    cli_args.add_argument(
+        "--stats",
+        help="Print the time taken and bytes read and written by each phase of the command, each sops invocation "
+        "and the peak memory use to stderr once the command ends.",
+        action="store_const",
+        const="table",
+    )
+    cli_args.add_argument(
+        "--stats-json",
+        help="Like --stats, but print the report as a single line of JSON.",
+        action="store_const",
+        const="json",
+        dest="stats",
+    )
+    cli_args.add_argument(
+        "--profile",
+        help="Profile the command with cProfile and write the pstats file to this path.",
+        metavar="PATH",
+    )
+    cli_args.add_argument(
+        "--profile-sampling",
+        help="With --profile, sample the stacks of every thread instead, and write them in the collapsed format "
+        "read by flamegraph.pl and speedscope.",
+        action="store_true",
+    )
+    cli_args.add_argument(
+        "-v",
+        "--verbose",
+        help="Print informational messages. Call twice to print debug messages.",
+        action="count",
+        default=0,
+    )
+    if with_version:
+        cli_args.add_argument(
+            "-V",
+            "--version",
+            help="Print version information and exit",
+            action="version",
+            version="%(prog)s {}".format(__version__),
+        )
+
+
+def find_command(user_args: List) -> Union[str, None]:
+    """Find the command named in the arguments, without loading any of the actions.
+
+    Args:
+        user_args: A list of arguments supplied at the command line.
+
+    Returns:
+        str: The command name, or None if no known command was given.
+    """
+    cli_args = argparse.ArgumentParser(add_help=False)
+    add_global_arguments(cli_args, with_version=False)
+    cli_args.add_argument("command", nargs="?")
+    cli_args.add_argument("command_args", nargs=argparse.REMAINDER)
+    try:
+        # Leave reporting errors to the full parser
+        with contextlib.redirect_stderr(io.StringIO()):
+            known_args, _ = cli_args.parse_known_args(user_args)
+    except SystemExit:
+        return None
+    if known_args.command in Action.get_action_names():
+        return known_args.command
+    return None
+
+
 def parse_user_args(user_args: Union[List, None] = None) -> argparse.Namespace:
     """Parse user supplied command line arguments using the configuration below and defined within each
     plugin's argparse definition.
 
+    Only the chosen command's action is imported. The other commands are listed with their help text, so that
+    `--help` and `--version` do not pay for importing every action.
+
     Args:
         user_args: A list of arguments supplied at the command line.
 
@@ -75,28 +189,18 @@ def parse_user_args(user_args: Union[List, None] = None) -> argparse.Namespace:
     sub_parser = cli_args.add_subparsers(
         title="command", required=False, dest="command"
     )
-    cli_args.add_argument(
-        "-c", "--config", help="Path to a .heysops.yaml configuration file."
-    )
-    cli_args.add_argument("-f", "--force", help="Force an action.", action="store_true")
-    cli_args.add_argument("-l", "--log", help="Path to a log file to write to.")
-    cli_args.add_argument(
-        "-v",
-        "--verbose",
-        help="Print informational messages. Call twice to print debug messages.",
-        action="count",
-        default=0,
-    )
-    cli_args.add_argument(
-        "-V",
-        "--version",
-        help="Print version information and exit",
-        action="version",
-        version="%(prog)s {}".format(__version__),
-    )
-
-    for action_name, action_class in Action.get_actions().items():
-        new_parser = action_class.argparse_sub_parser(sub_parser=sub_parser)
+    add_global_arguments(cli_args)
+
+    command = find_command(user_args)
+    for action_name in Action.get_action_names():
+        if action_name == command:
+            new_parser = Action.get_action(action_name).argparse_sub_parser(
+                sub_parser=sub_parser
+            )
+        else:
+            new_parser = sub_parser.add_parser(
+                action_name, help=Action.get_action_help(action_name)
+            )
         new_parser.set_defaults(func=getattr(Action, action_name))
 
     return cli_args.parse_args(user_args)
@@ -112,6 +216,10 @@ def main(user_args: Union[List, None] = None) -> None:
         None
     """
     parsed_args = parse_user_args(user_args=user_args)
+    if parsed_args.stats:
+        from libheysops import stats
+
+        stats.enable()
 
     setup_logging(logger, parsed_args.log, parsed_args.verbose)
 
@@ -121,7 +229,21 @@ def main(user_args: Union[List, None] = None) -> None:
 
     # Invoke the command's function, passing all arguments as keyword arguments.
     logger.debug("Calling command {}".format(parsed_args.command))
-    parsed_args.func(**vars(parsed_args))
+    try:
+        if parsed_args.profile:
+            from libheysops.profiling import profile_call
+
+            profile_call(
+                lambda: parsed_args.func(**vars(parsed_args)),
+                parsed_args.profile,
+                sampling=parsed_args.profile_sampling,
+            )
+        else:
+            parsed_args.func(**vars(parsed_args))
+    finally:
+        if parsed_args.stats:
+            # Reported for failed commands too, as those are often the slow ones
+            sys.stderr.write(stats.format_report(stats.get_report(), parsed_args.stats))
 
 
 if __name__ == "__main__":
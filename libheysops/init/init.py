@@ -2,6 +2,7 @@ import logging
 import os
 from typing import Union
 
+from libheysops import Action
 from libheysops.base import BaseAction, CONFIG_TEMPLATE
 
 logger = logging.getLogger()
@@ -73,9 +74,7 @@ class Init(BaseAction):
         # Init sub_parser
         cli_init = sub_parser.add_parser(
             "init",
-            help="Creates the .heysops.yaml file in the current directory. If `-c` or `--config` is specified, "
-            "it will create the .heysops.yaml at that path. Please be sure that the specified path uses the "
-            "file name .heysops.yaml.",
+            help=Action.get_action_help("init"),
         )
         cli_init.add_argument(
             "--folder",
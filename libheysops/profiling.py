@@ -0,0 +1,118 @@
+"""Profiling of a whole command, enabled with the `--profile` option.
+
+By default the command runs under cProfile and a pstats file is written, to be read with :mod:`pstats`, snakeviz or
+similar tools. The sampling mode instead records the stack of every thread at a fixed interval, which adds little
+overhead to the command, and writes the stacks in the collapsed format read by flamegraph.pl and speedscope.
+"""
+
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable
+
+logger = logging.getLogger()
+
+SAMPLING_INTERVAL = 0.005
+
+
+class StackSampler:
+    """Samples the stacks of every other thread from a background thread.
+
+    Args:
+        interval: The number of seconds between samples.
+    """
+
+    def __init__(self, interval: float = SAMPLING_INTERVAL):
+        self.interval = interval
+        self.samples = collections.Counter()  # type: collections.Counter
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="heysops-profiler", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        "{}:{}:{}".format(
+                            os.path.basename(code.co_filename),
+                            code.co_name,
+                            code.co_firstlineno,
+                        )
+                    )
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, output_path: str) -> None:
+        """Write the sampled stacks in the collapsed format, one stack and its sample count per line.
+
+        Args:
+            output_path: The path of the file to write.
+
+        Returns:
+            None
+        """
+        with open(output_path, "w") as open_output:
+            for stack, count in self.samples.most_common():
+                open_output.write("{} {}\n".format(stack, count))
+
+
+def profile_call(
+    func: Callable[[], Any], output_path: str, sampling: bool = False
+) -> Any:
+    """Call a function while profiling it, writing the profile once it returns or raises.
+
+    Args:
+        func: The function to call, without arguments.
+        output_path: The path of the profile to write.
+        sampling: Write sampled stacks in the collapsed format instead of a cProfile pstats file.
+
+    Returns:
+        The value returned by func.
+    """
+    if sampling:
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            return func()
+        finally:
+            sampler.stop()
+            sampler.write(output_path)
+            logger.info(
+                "Wrote {} stack samples to {}".format(
+                    sum(sampler.samples.values()), output_path
+                )
+            )
+
+    # Imported here, as most commands are not profiled
+    import cProfile
+
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        return func()
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output_path)
+        logger.info(
+            "Wrote the profile of a {:.3f} second run to {}".format(
+                time.perf_counter() - start, output_path
+            )
+        )
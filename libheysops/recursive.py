@@ -0,0 +1,195 @@
+"""Running an action for every configuration under a folder, enabled with the `--recursive` option.
+
+Every configuration is loaded up front and sops is probed once. The files of all configurations then share one pool
+of `--jobs` sops invocations, rather than running one configuration after another, and the results are reported
+grouped by configuration once all of them are done.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Tuple, Type, Union
+
+from libheysops import stats
+from libheysops.base import BaseAction
+from libheysops.engine import gather_bounded, run_sync
+
+logger = logging.getLogger()
+
+# Folders that are not searched for configurations, as they hold version control data, dependencies or caches
+PRUNED_FOLDERS = frozenset(
+    [
+        ".git",
+        ".hg",
+        ".svn",
+        ".tox",
+        ".nox",
+        ".venv",
+        "venv",
+        ".mypy_cache",
+        ".pytest_cache",
+        ".terraform",
+        "__pycache__",
+        "node_modules",
+        "bower_components",
+    ]
+)
+
+
+def find_configs(root: str) -> List[str]:
+    """Find every configuration file within a folder and its sub folders.
+
+    Each folder is listed once with os.scandir. Folders named in PRUNED_FOLDERS and symbolic links to folders are not
+    entered. A folder holding both a .heysops.yaml and a .heysops.yml contributes the .heysops.yaml only.
+
+    Args:
+        root: The folder to search.
+
+    Returns:
+        list: The paths to the configuration files found, joined to root, sorted by path.
+    """
+    config_names = [BaseAction.config_filename_1, BaseAction.config_filename_2]
+    config_paths = []
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        found = {}
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name in config_names:
+                        if entry.is_file():
+                            found[entry.name] = entry.path
+                    elif entry.name not in PRUNED_FOLDERS and entry.is_dir(
+                        follow_symlinks=False
+                    ):
+                        folders.append(entry.path)
+        except OSError as e:
+            logger.debug("Unable to search {}: {}".format(folder, e))
+            continue
+
+        for config_name in config_names:
+            if config_name in found:
+                config_paths.append(found[config_name])
+                break
+    return sorted(config_paths)
+
+
+def run_recursive(action_class: Type[BaseAction], **kwargs) -> int:
+    """Run an action for every configuration under a folder, then report the results grouped by configuration.
+
+    Args:
+        action_class: The action to run. It must implement run_async and report.
+        **kwargs: The keyword arguments from the command line.
+
+    Keyword Args:
+        recursive: The folder to search for configurations.
+        jobs: The number of sops invocations to run concurrently, across all configurations.
+
+    Raises:
+        FileNotFoundError: If no configuration is found.
+        ValueError: If files were named at the command line, as they cannot be matched to a configuration.
+        OSError: Once all configurations are processed, if any file of any configuration could not be processed.
+
+    Returns:
+        int: The exit code of the command.
+    """
+    if kwargs.get("FILE") not in [None, "-", [], ["-"]] or kwargs.get("output"):
+        raise ValueError("Files cannot be named when using --recursive.")
+
+    root = kwargs.get("recursive") or os.curdir
+    with stats.measure(stats.CONFIG_DISCOVERY):
+        config_paths = find_configs(root)
+    if not config_paths:
+        raise FileNotFoundError(
+            "No .heysops.yaml or .heysops.yml configuration file was found within {}.".format(
+                root
+            )
+        )
+    logger.info("Found {} configuration files in {}".format(len(config_paths), root))
+
+    results = run_sync(run_configs(action_class, config_paths, **kwargs))
+    return action_class.report_recursive(results, **kwargs)
+
+
+async def run_configs(
+    action_class: Type[BaseAction], config_paths: List[str], **kwargs
+) -> List[Tuple[str, Union[BaseAction, None], Any, Union[OSError, None]]]:
+    """Run an action for several configurations at once, sharing one sops executable and one pool of jobs.
+
+    Each configuration is loaded within its own task, so one that can not be read or parsed fails alone. The
+    configuration and state of each are saved once its files are processed, even if that failed.
+
+    Args:
+        action_class: The action to run. It must implement run_async.
+        config_paths: The configuration files to run the action for.
+        **kwargs: The keyword arguments from the command line.
+
+    Keyword Args:
+        jobs: The number of sops invocations to run concurrently, across all configurations.
+
+    Raises:
+        SopsNotFoundError: If the action runs sops and it could not be found.
+
+    Returns:
+        list: One (configuration path, action, results of run_async, error) tuple per configuration, in the order of
+          config_paths. action is None if the configuration could not be loaded.
+    """
+    action_kwargs = {
+        key: value
+        for key, value in kwargs.items()
+        if key not in ["config", "sops", "sops_version", "pool"]
+    }
+    if action_class.uses_sops:
+        with stats.measure(stats.SOPS_PROBE):
+            sops, sops_version = await BaseAction._probe_sops_async(
+                sops_executable=os.environ.get("SOPS_PATH")
+            )
+        action_kwargs.update(sops=sops, sops_version=sops_version)
+    # Created within the running event loop, which it is bound to on older versions of Python
+    action_kwargs["pool"] = asyncio.Semaphore(max(kwargs.get("jobs") or 1, 1))
+
+    actions = {}  # type: Dict[str, BaseAction]
+
+    async def run_config(config_path: str) -> Any:
+        try:
+            action = action_class(config=config_path, **action_kwargs)
+        except Exception as e:
+            # Such as a configuration that is unreadable, or not valid YAML
+            raise OSError(
+                "Unable to load configuration {}: {}".format(config_path, e)
+            ) from e
+        actions[config_path] = action
+        try:
+            return await action.run_async(**kwargs)
+        finally:
+            action.flush_config()
+            action.state.save()
+
+    # The pool bounds the sops invocations, so every configuration can be in progress at once
+    results = await gather_bounded(run_config, config_paths, jobs=len(config_paths))
+    return [
+        (config_path, actions.get(config_path), action_results, error)
+        for config_path, action_results, error in results
+    ]
+
+
+def add_recursive_argument(cli_parser: argparse.ArgumentParser) -> None:
+    """Define the `--recursive` option of an action.
+
+    Args:
+        cli_parser: The action's sub-command parser.
+
+    Returns:
+        None
+    """
+    cli_parser.add_argument(
+        "-r",
+        "--recursive",
+        help="Run for every .heysops.yaml within ROOT and its sub folders, or the current directory, instead of the "
+        "nearest one. Version control, dependency and cache folders such as .git and node_modules are skipped.",
+        nargs="?",
+        const=os.curdir,
+        metavar="ROOT",
+    )
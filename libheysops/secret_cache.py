@@ -0,0 +1,113 @@
+"""A thread-safe, in-memory cache of decrypted secrets, for long-running processes that read the same secrets often.
+
+Entries expire after a time to live, the least recently used entry is evicted once the cache is full, and an entry is
+dropped as soon as the content of the encrypted file it was decrypted from changes. Touching the file without changing
+its content does not drop the entry.
+"""
+
+import collections
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Tuple, Union
+
+from libheysops.state import check_snapshot
+
+
+class SecretCache:
+    """Decrypted secrets, keyed by whatever identifies a request for them.
+
+    Concurrent requests for the same missing key wait for a single load, rather than each running sops.
+
+    Args:
+        ttl: The number of seconds an entry is served for after it was loaded. None keeps entries until evicted.
+        max_entries: The number of entries to keep before evicting the least recently used one.
+    """
+
+    def __init__(self, ttl: Union[float, None] = 300.0, max_entries: int = 128):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Each key maps to (value, encrypted file path, its snapshot when loaded, monotonic expiry time or None)
+        self._entries = collections.OrderedDict()  # type: collections.OrderedDict
+        self._loading = {}  # type: Dict[Hashable, threading.Lock]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+
+        # Checked without holding the lock, as the encrypted file may need to be hashed
+        value, file_path, snapshot, expires_at = entry
+        current, fresh_snapshot = False, None
+        if expires_at is None or time.monotonic() < expires_at:
+            current, fresh_snapshot = check_snapshot(file_path, snapshot)
+
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                # Replaced or dropped by another thread meanwhile
+                return False, None
+            if not current:
+                del self._entries[key]
+                return False, None
+            if fresh_snapshot is not None:
+                self._entries[key] = (value, file_path, fresh_snapshot, expires_at)
+            self._entries.move_to_end(key)
+        return True, value
+
+    def get(
+        self,
+        key: Hashable,
+        load: Callable[[], Tuple[Any, str, Union[dict, None]]],
+    ) -> Any:
+        """Get a cached value, loading and caching it if it is missing, expired or its encrypted file changed.
+
+        Args:
+            key: Identifies the value.
+            load: Called without arguments on a miss. Returns the value, the path of the encrypted file it was
+              decrypted from, and the libheysops.state.StateStore.snapshot of that file taken before it was read.
+
+        Returns:
+            The value.
+        """
+        found, value = self._lookup(key)
+        if found:
+            return value
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have loaded the value while this one waited
+            found, value = self._lookup(key)
+            if found:
+                return value
+
+            try:
+                value, file_path, snapshot = load()
+                with self._lock:
+                    self._entries[key] = (
+                        value,
+                        file_path,
+                        snapshot,
+                        None if self.ttl is None else time.monotonic() + self.ttl,
+                    )
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > max(self.max_entries, 0):
+                        self._entries.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return value
+
+    def clear(self) -> None:
+        """Drop every entry.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.clear()
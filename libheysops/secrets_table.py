@@ -0,0 +1,143 @@
+"""An indexed, in-memory form of the secrets list from a heysops configuration file."""
+
+import bisect
+from typing import Dict, Iterator, List, Union
+
+
+class SecretsTable:
+    """The secrets entries of a configuration file, indexed by both their decrypted and encrypted paths.
+
+    Looking up, adding, replacing and removing an entry take constant time, no matter how many secrets are tracked.
+    The entries keep the order they were loaded or added in, so the table serializes back to the same list.
+
+    Args:
+        entries: The "secrets" list from the configuration file.
+
+    Attributes:
+        modified: Whether entries were added, replaced or removed since the table was loaded.
+    """
+
+    def __init__(self, entries: Union[List[dict], None] = None):
+        self._entries = {}  # type: Dict[int, dict]
+        self._by_decrypted_path = {}  # type: Dict[str, List[int]]
+        self._by_encrypted_path = {}  # type: Dict[str, List[int]]
+        self._next_id = 0
+        self.modified = False
+
+        for entry in entries or []:
+            if entry:
+                self._insert(entry)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(list(self._entries.values()))
+
+    def _index(self, entry_id: int) -> None:
+        entry = self._entries[entry_id]
+        for index, path in [
+            (self._by_decrypted_path, entry.get("decrypted_path")),
+            (self._by_encrypted_path, entry.get("encrypted_path")),
+        ]:
+            bisect.insort(index.setdefault(path, []), entry_id)
+
+    def _unindex(self, entry_id: int) -> None:
+        entry = self._entries[entry_id]
+        for index, path in [
+            (self._by_decrypted_path, entry.get("decrypted_path")),
+            (self._by_encrypted_path, entry.get("encrypted_path")),
+        ]:
+            entry_ids = index[path]
+            entry_ids.remove(entry_id)
+            if not entry_ids:
+                del index[path]
+
+    def _insert(self, entry: dict) -> None:
+        self._entries[self._next_id] = entry
+        self._index(self._next_id)
+        self._next_id += 1
+
+    def _first_id(self, decrypted_path: str, encrypted_path: str) -> Union[int, None]:
+        # Each index lists entry ids in ascending order, so its first id is the earliest entry with that path
+        candidates = [
+            self._by_decrypted_path.get(decrypted_path, [None])[0],
+            self._by_encrypted_path.get(encrypted_path, [None])[0],
+        ]
+        candidates = [x for x in candidates if x is not None]
+        return min(candidates) if candidates else None
+
+    def get(self, file_path: str) -> dict:
+        """Find the first entry whose decrypted or encrypted path matches.
+
+        Args:
+            file_path: The decrypted or encrypted path to search for.
+
+        Returns:
+            dict: The entry, or an empty dictionary if it was not found.
+        """
+        entry_id = self._first_id(file_path, file_path)
+        return {} if entry_id is None else self._entries[entry_id]
+
+    def upsert(self, file_entry: dict) -> None:
+        """Replace the first entry with the same decrypted or encrypted path, keeping its position, or add the entry
+        to the end of the table.
+
+        Args:
+            file_entry: The entry to add.
+
+        Returns:
+            None
+        """
+        entry_id = self._first_id(
+            file_entry.get("decrypted_path"), file_entry.get("encrypted_path")
+        )
+        if entry_id is None:
+            self._insert(file_entry)
+        else:
+            self._unindex(entry_id)
+            self._entries[entry_id] = file_entry
+            self._index(entry_id)
+        self.modified = True
+
+    def delete(self, file_path: str) -> None:
+        """Remove every entry whose decrypted or encrypted path matches.
+
+        Args:
+            file_path: The decrypted or encrypted path to remove.
+
+        Returns:
+            None
+        """
+        entry_ids = set(self._by_decrypted_path.get(file_path, [])) | set(
+            self._by_encrypted_path.get(file_path, [])
+        )
+        for entry_id in entry_ids:
+            self._unindex(entry_id)
+            del self._entries[entry_id]
+        if entry_ids:
+            self.modified = True
+
+    def decrypted_paths(self) -> List[str]:
+        """Gets the decrypted path of every entry.
+
+        Returns:
+            list: The decrypted paths, in order.
+        """
+        return [x.get("decrypted_path") for x in self._entries.values()]
+
+    def encrypted_paths(self) -> List[str]:
+        """Gets the encrypted path of every entry.
+
+        Returns:
+            list: The encrypted paths, in order.
+        """
+        return [x.get("encrypted_path") for x in self._entries.values()]
+
+    def to_list(self) -> List[dict]:
+        """Gets the entries in the shape of the configuration file's "secrets" list.
+
+        Returns:
+            list: The entries, in order.
+        """
+        return list(self._entries.values())
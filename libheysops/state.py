@@ -0,0 +1,236 @@
+"""A local record of the plaintext and ciphertext of each secret, as of the last time heysops synchronized them.
+
+This lets heysops skip sops invocations that would not change anything. Each file is recorded with its size,
+modification time and a digest of its content. A file whose size and modification time still match is considered
+unchanged without reading it; otherwise it is hashed.
+
+Digests are keyed with a random per-user key, so the state files cannot be used to test guesses of a secret's value.
+State files are stored in the cache directory, one per configuration file.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import time
+from typing import Dict, Tuple, Union
+
+from libheysops import stats
+from libheysops.cache import get_cache_dir
+from libheysops.fileio import write_file_atomic
+
+PLAINTEXT = "plaintext"
+CIPHERTEXT = "ciphertext"
+
+# Files at least this large are hashed through a memory map rather than read in chunks
+MMAP_THRESHOLD = 4 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+# A file modified this close to the moment it was recorded may change again without its modification time changing,
+# on file systems with coarse timestamps. Such files are always hashed.
+RACY_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
+_digest_key = None
+
+
+def get_digest_key() -> bytes:
+    """Get the per-user key used for file digests, creating it on first use.
+
+    Returns:
+        bytes: The key.
+    """
+    global _digest_key
+    if _digest_key is None:
+        key_path = os.path.join(get_cache_dir(), "state.key")
+        try:
+            key_fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(key_path, "rb") as open_key:
+                _digest_key = open_key.read()
+        else:
+            _digest_key = os.urandom(32)
+            with os.fdopen(key_fd, "wb") as open_key:
+                open_key.write(_digest_key)
+    return _digest_key
+
+
+def hash_file(file_path: str, key: bytes = b"") -> str:
+    """Compute the digest of a file's content without reading the whole file into memory.
+
+    Args:
+        file_path: The file to hash.
+        key: The key for the digest.
+
+    Returns:
+        str: The hex encoded digest.
+    """
+    digest = hashlib.blake2b(key=key)
+    with open(file_path, "rb") as open_file:
+        if os.fstat(open_file.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(open_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        else:
+            for chunk in iter(lambda: open_file.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_signature(file_path: str) -> Union[Dict[str, int], None]:
+    """Get the size and modification time of a file.
+
+    Args:
+        file_path: The file to check.
+
+    Returns:
+        dict: The "size" and "mtime_ns" of the file, or None if it does not exist.
+    """
+    try:
+        file_stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return {"size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns}
+
+
+def check_snapshot(
+    file_path: str, recorded: Union[dict, None]
+) -> Tuple[bool, Union[dict, None]]:
+    """Check whether a file still holds the content captured by StateStore.snapshot.
+
+    The file is only hashed when its size matches but its modification time does not, or is too close to the moment
+    the snapshot was taken to be trusted.
+
+    Args:
+        file_path: The file to check.
+        recorded: The snapshot taken earlier, or None.
+
+    Returns:
+        tuple: Whether the file is unchanged, and a fresh snapshot of it if one was taken while checking, which can
+          replace the recorded one so the next check can skip hashing.
+    """
+    signature = file_signature(file_path)
+    if not recorded or signature is None or signature["size"] != recorded["size"]:
+        return False, None
+
+    if (
+        signature["mtime_ns"] == recorded["mtime_ns"]
+        and signature["mtime_ns"] < recorded["recorded_ns"] - RACY_WINDOW_NS
+    ):
+        return True, None
+
+    snapshot = StateStore.snapshot(file_path)
+    if snapshot is None or snapshot["digest"] != recorded["digest"]:
+        return False, None
+    return True, snapshot
+
+
+class StateStore:
+    """The recorded plaintext and ciphertext of each secret in one configuration file.
+
+    Args:
+        state_path: The file the records are loaded from and saved to. None keeps the records in memory only.
+        records: The records, keyed by each secret's decrypted_path, then by PLAINTEXT or CIPHERTEXT.
+
+    Attributes:
+        state_path: The file the records are saved to.
+        records: The records, keyed by each secret's decrypted_path, then by PLAINTEXT or CIPHERTEXT.
+        dirty: Whether the records changed since they were loaded or saved.
+    """
+
+    def __init__(
+        self,
+        state_path: Union[str, None] = None,
+        records: Union[Dict[str, Dict[str, dict]], None] = None,
+    ):
+        self.state_path = state_path
+        self.records = records or {}
+        self.dirty = False
+
+    @classmethod
+    def for_config(cls, config_path: str) -> "StateStore":
+        """Load the records kept for a configuration file.
+
+        Args:
+            config_path: The path to the heysops configuration file.
+
+        Returns:
+            StateStore: The loaded records. Empty if none were saved, or they could not be read.
+        """
+        state_name = hashlib.sha256(
+            os.path.abspath(config_path).encode("utf-8")
+        ).hexdigest()
+        state_path = os.path.join(get_cache_dir("state"), state_name + ".json")
+        try:
+            with open(state_path, "r") as open_state:
+                records = json.load(open_state)
+        except (OSError, ValueError):
+            records = {}
+        return cls(state_path, records)
+
+    @staticmethod
+    def snapshot(file_path: str) -> Union[dict, None]:
+        """Capture the current signature and digest of a file, to record once the operation on it succeeds.
+
+        The signature is taken before the content is hashed, so a change made while hashing is detected next time.
+
+        Args:
+            file_path: The file to capture.
+
+        Returns:
+            dict: The file's "size", "mtime_ns", "digest" and the "recorded_ns" time. None if it does not exist.
+        """
+        recorded_ns = time.time_ns()
+        signature = file_signature(file_path)
+        if signature is None:
+            return None
+        signature["digest"] = hash_file(file_path, get_digest_key())
+        signature["recorded_ns"] = recorded_ns
+        return signature
+
+    def record(self, secret: str, side: str, snapshot: Union[dict, None]) -> None:
+        """Record the state of one side of a secret.
+
+        Args:
+            secret: The decrypted_path of the secret.
+            side: PLAINTEXT or CIPHERTEXT.
+            snapshot: The value returned by StateStore.snapshot. None removes the record.
+
+        Returns:
+            None
+        """
+        if snapshot is None:
+            self.records.get(secret, {}).pop(side, None)
+        else:
+            self.records.setdefault(secret, {})[side] = snapshot
+        self.dirty = True
+
+    def is_current(self, secret: str, side: str, file_path: str) -> bool:
+        """Check whether a file still holds the content recorded for one side of a secret.
+
+        Args:
+            secret: The decrypted_path of the secret.
+            side: PLAINTEXT or CIPHERTEXT.
+            file_path: The absolute path to the file holding that side of the secret.
+
+        Returns:
+            bool: True if the file exists and its content matches the record.
+        """
+        recorded = self.records.get(secret, {}).get(side)
+        current, snapshot = check_snapshot(file_path, recorded)
+        if current and snapshot is not None:
+            # The content is unchanged; refresh the signature so the next check can skip hashing
+            self.record(secret, side, snapshot)
+        return current
+
+    @stats.measure(stats.STATE_SAVE)
+    def save(self) -> None:
+        """Write the records to the state file, if they changed.
+
+        Returns:
+            None
+        """
+        if not self.dirty or not self.state_path:
+            return None
+        state_data = json.dumps(self.records, sort_keys=True).encode("utf-8")
+        write_file_atomic(self.state_path, state_data)
+        stats.count(stats.STATE_SAVE, bytes_written=len(state_data))
+        self.dirty = False
@@ -0,0 +1,255 @@
+"""Per-phase timing and I/O counters, reported by the `--stats` option.
+
+Nothing is recorded until :func:`enable` is called, so long-running processes such as the agent do not accumulate
+measurements.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, Iterator, List, Union
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Not available on Windows
+    resource = None
+
+CONFIG_DISCOVERY = "config discovery"
+CONFIG_PARSE = "config parse"
+SOPS_PROBE = "sops probe"
+SOPS = "sops"
+OUTPUT_WRITE = "output write"
+GITIGNORE_UPDATE = "gitignore update"
+CONFIG_FLUSH = "config flush"
+STATE_SAVE = "state save"
+
+_lock = threading.Lock()
+_enabled = False
+_started = 0.0
+# Each phase maps to [calls, seconds, bytes read, bytes written]
+_phases = collections.OrderedDict()  # type: collections.OrderedDict
+_sops_calls = []  # type: List[dict]
+
+
+def enable() -> None:
+    """Start recording, discarding anything recorded before.
+
+    Returns:
+        None
+    """
+    global _enabled, _started
+    with _lock:
+        _phases.clear()
+        del _sops_calls[:]
+        _started = time.perf_counter()
+        _enabled = True
+
+
+def disable() -> None:
+    """Stop recording. What was recorded is kept until recording is enabled again.
+
+    Returns:
+        None
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def add(
+    phase: str, seconds: float = 0.0, bytes_read: int = 0, bytes_written: int = 0
+) -> None:
+    """Add a call to a phase.
+
+    Args:
+        phase: The name of the phase.
+        seconds: The wall time of the call.
+        bytes_read: The number of bytes the call read.
+        bytes_written: The number of bytes the call wrote.
+
+    Returns:
+        None
+    """
+    if not _enabled:
+        return None
+    with _lock:
+        counters = _phases.setdefault(phase, [0, 0.0, 0, 0])
+        counters[0] += 1
+        counters[1] += seconds
+        counters[2] += bytes_read
+        counters[3] += bytes_written
+
+
+def count(phase: str, bytes_read: int = 0, bytes_written: int = 0) -> None:
+    """Add bytes to a phase, without counting a call. For phases measured with :func:`measure`.
+
+    Args:
+        phase: The name of the phase.
+        bytes_read: The number of bytes read.
+        bytes_written: The number of bytes written.
+
+    Returns:
+        None
+    """
+    if not _enabled:
+        return None
+    with _lock:
+        counters = _phases.setdefault(phase, [0, 0.0, 0, 0])
+        counters[2] += bytes_read
+        counters[3] += bytes_written
+
+
+@contextlib.contextmanager
+def measure(phase: str) -> Iterator[None]:
+    """Time a block, or a function when used as a decorator, as one call to a phase.
+
+    Args:
+        phase: The name of the phase.
+
+    Yields:
+        None
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(phase, time.perf_counter() - start)
+
+
+def add_sops_call(
+    sops_args: List[str],
+    seconds: float,
+    returncode: Union[int, None],
+    bytes_read: int = 0,
+    bytes_written: int = 0,
+) -> None:
+    """Record a single sops invocation, and add it to the sops phase.
+
+    Args:
+        sops_args: The sops executable followed by its arguments. The last argument is the file sops read.
+        seconds: The wall time of the invocation.
+        returncode: The exit code of sops, or None if it was killed after a timeout.
+        bytes_read: The size of the file sops read.
+        bytes_written: The number of bytes sops wrote to its standard output.
+
+    Returns:
+        None
+    """
+    if not _enabled:
+        return None
+    add(SOPS, seconds, bytes_read, bytes_written)
+    with _lock:
+        _sops_calls.append(
+            {
+                "file": sops_args[-1],
+                "args": sops_args[1:-1],
+                "seconds": seconds,
+                "returncode": returncode,
+                "bytes_read": bytes_read,
+                "bytes_written": bytes_written,
+            }
+        )
+
+
+def get_file_size(file_path: str) -> int:
+    """Get the size of a file, or 0 if it cannot be read, such as for a command line flag."""
+    try:
+        return os.stat(file_path).st_size
+    except OSError:
+        return 0
+
+
+def get_peak_rss() -> Dict[str, Union[int, None]]:
+    """Get the peak resident set size of this process and of its finished child processes, such as sops.
+
+    Returns:
+        dict: The "heysops" and "sops" peaks in bytes, or None where the platform does not report them.
+    """
+    if resource is None:  # pragma: no cover
+        return {"heysops": None, "sops": None}
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "heysops": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "sops": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def get_report() -> dict:
+    """Gather everything recorded since :func:`enable` was called.
+
+    Returns:
+        dict: The total wall time, the counters of each phase in the order they first ran, every sops invocation
+          and the peak memory use.
+    """
+    with _lock:
+        phases = [
+            {
+                "phase": phase,
+                "calls": calls,
+                "seconds": seconds,
+                "bytes_read": bytes_read,
+                "bytes_written": bytes_written,
+            }
+            for phase, (calls, seconds, bytes_read, bytes_written) in _phases.items()
+        ]
+        sops_calls = [dict(sops_call) for sops_call in _sops_calls]
+    return {
+        "seconds": time.perf_counter() - _started,
+        "phases": phases,
+        "sops_calls": sops_calls,
+        "peak_rss": get_peak_rss(),
+    }
+
+
+def format_report(report: dict, output_format: str = "table") -> str:
+    """Render a report as JSON or as a table.
+
+    Args:
+        report: A report from :func:`get_report`.
+        output_format: "json" or "table".
+
+    Returns:
+        str: The rendered report, ending with a new line.
+    """
+    if output_format == "json":
+        return json.dumps(report, sort_keys=True) + "\n"
+
+    row = "{:<18} {:>6} {:>10} {:>14} {:>14}\n"
+    lines = [row.format("phase", "calls", "seconds", "bytes read", "bytes written")]
+    for phase in report["phases"]:
+        lines.append(
+            row.format(
+                phase["phase"],
+                phase["calls"],
+                "{:.4f}".format(phase["seconds"]),
+                phase["bytes_read"],
+                phase["bytes_written"],
+            )
+        )
+    lines.append(row.format("total", "", "{:.4f}".format(report["seconds"]), "", ""))
+    if report["sops_calls"]:
+        lines.append("\n{:<50} {:>10} {:>6}\n".format("sops file", "seconds", "exit"))
+        for sops_call in report["sops_calls"]:
+            lines.append(
+                "{:<50} {:>10} {:>6}\n".format(
+                    sops_call["file"],
+                    "{:.4f}".format(sops_call["seconds"]),
+                    str(sops_call["returncode"]),
+                )
+            )
+    for name, peak in report["peak_rss"].items():
+        if peak is not None:
+            lines.append("peak rss {:<9} {:>12.1f} MiB\n".format(name, peak / 1024**2))
+    return "".join(lines)
@@ -0,0 +1,249 @@
+import argparse
+import json
+import logging
+import sys
+from typing import Dict, List, Tuple, Union
+
+from libheysops import Action
+from libheysops.base import BaseAction
+from libheysops.engine import run_sync
+from libheysops.recursive import add_recursive_argument
+from libheysops.state import CIPHERTEXT, PLAINTEXT, file_signature
+
+logger = logging.getLogger()
+
+UP_TO_DATE = "up to date"
+PLAINTEXT_MODIFIED = "plaintext modified"
+CIPHERTEXT_NEWER = "ciphertext newer"
+MISSING_PLAINTEXT = "missing plaintext"
+MISSING_CIPHERTEXT = "missing ciphertext"
+# Both files changed since heysops last encrypted or decrypted the secret
+CONFLICT = "conflict"
+
+
+class Status(BaseAction):
+    """Reports which secrets need to be encrypted or decrypted, without running sops.
+
+    Each file is compared with the state heysops recorded when it last encrypted or decrypted the secret. A file whose
+    size and modification time still match its record is not read; other files are hashed.
+    """
+
+    uses_sops = False
+
+    def __init__(self, **kwargs):
+        super(Status, self).__init__(**kwargs)
+        self.returncode = 0
+
+    def run(self, **kwargs) -> None:
+        """Entry point for this action's operation
+
+        Prints the status of every secret in the configuration, or of the files supplied at the command line.
+
+        Args:
+            **kwargs: The keyword arguments from the command line.
+
+        Keyword Args:
+            FILE: A list of decrypted or encrypted files to report on. All secrets if empty.
+            json: Print the statuses as JSON.
+            exit_code: Set returncode to 1 if any secret is not up to date.
+
+        Returns:
+            None.
+        """
+        self.report(run_sync(self.run_async(**kwargs)), **kwargs)
+
+    async def run_async(self, **kwargs) -> List[Dict[str, str]]:
+        """Classify the secrets requested at the command line. Runs nothing concurrently, as no sops call is made.
+
+        Args:
+            **kwargs: The keyword arguments from the command line, as for run.
+
+        Returns:
+            list: The results of get_statuses.
+        """
+        return self.get_statuses(kwargs.get("FILE"))
+
+    def report(self, statuses: List[Dict[str, str]], **kwargs) -> None:
+        """Print the statuses, and set returncode.
+
+        Args:
+            statuses: The results of get_statuses.
+            **kwargs: The keyword arguments from the command line, as for run.
+
+        Returns:
+            None
+        """
+        if kwargs.get("json"):
+            sys.stdout.write(json.dumps(statuses) + "\n")
+        else:
+            for entry in statuses:
+                sys.stdout.write(
+                    "{:<20}{}\n".format(entry["status"], entry["decrypted_path"])
+                )
+        self.returncode = self.get_returncode(statuses, kwargs.get("exit_code"))
+
+    @classmethod
+    def report_recursive(
+        cls,
+        results: List[
+            Tuple[
+                str, Union["Status", None], List[Dict[str, str]], Union[OSError, None]
+            ]
+        ],
+        **kwargs
+    ) -> int:
+        """Print the statuses of several configurations, grouped by configuration.
+
+        As text, each configuration's path is followed by the indented statuses of its secrets. As JSON, an object
+        maps each configuration's path to the list of its statuses. Configurations that could not be loaded are
+        logged and left out.
+
+        Args:
+            results: One (configuration path, action, statuses, error) tuple per configuration.
+            **kwargs: The keyword arguments from the command line.
+
+        Raises:
+            OSError: Once the other configurations are printed, if any configuration could not be loaded.
+
+        Returns:
+            int: The exit code of the command.
+        """
+        reported = {}
+        failed_configs = []
+        for config_path, _, statuses, error in results:
+            if error is not None:
+                logger.error("{}: {}".format(config_path, error))
+                failed_configs.append(config_path)
+            else:
+                reported[config_path] = statuses
+
+        if kwargs.get("json"):
+            sys.stdout.write(json.dumps(reported) + "\n")
+        else:
+            for config_path, statuses in reported.items():
+                sys.stdout.write("{}:\n".format(config_path))
+                for entry in statuses:
+                    sys.stdout.write(
+                        "  {:<20}{}\n".format(entry["status"], entry["decrypted_path"])
+                    )
+
+        cls.raise_failed_configs(failed_configs, len(results))
+        return cls.get_returncode(
+            [entry for statuses in reported.values() for entry in statuses],
+            kwargs.get("exit_code"),
+        )
+
+    @staticmethod
+    def get_returncode(statuses: List[Dict[str, str]], exit_code: bool) -> int:
+        """Get the exit code for a list of statuses.
+
+        Args:
+            statuses: The statuses reported.
+            exit_code: Whether `--exit-code` was given.
+
+        Returns:
+            int: 1 if exit_code is set and any secret is not up to date, 0 otherwise.
+        """
+        if exit_code and any(entry["status"] != UP_TO_DATE for entry in statuses):
+            return 1
+        return 0
+
+    def get_statuses(
+        self, file_paths: Union[List[str], None] = None
+    ) -> List[Dict[str, str]]:
+        """Classify secrets by what would bring their decrypted and encrypted files back in sync.
+
+        Args:
+            file_paths: The decrypted or encrypted files to classify. All secrets if empty.
+
+        Returns:
+            list: The "decrypted_path", "encrypted_path" and "status" of each secret, in configuration order.
+        """
+        if file_paths:
+            config_entries = []
+            for file_path in file_paths:
+                config_entry = self.find_file_in_config(file_path=file_path)
+                if config_entry:
+                    config_entries.append(config_entry)
+                else:
+                    logger.warning("{} not found in configuration.".format(file_path))
+        else:
+            config_entries = self.secrets.to_list()
+
+        return [
+            {
+                "decrypted_path": config_entry["decrypted_path"],
+                "encrypted_path": config_entry["encrypted_path"],
+                "status": self.get_status(config_entry),
+            }
+            for config_entry in config_entries
+        ]
+
+    def get_status(self, config_entry: dict) -> str:
+        """Classify a single secret.
+
+        Args:
+            config_entry: The secrets entry from the configuration.
+
+        Returns:
+            str: UP_TO_DATE, PLAINTEXT_MODIFIED, CIPHERTEXT_NEWER, MISSING_PLAINTEXT, MISSING_CIPHERTEXT or CONFLICT.
+        """
+        decrypted_path = config_entry["decrypted_path"]
+        abs_decrypted = self.get_absolute_path(decrypted_path)
+        abs_encrypted = self.get_absolute_path(config_entry["encrypted_path"])
+        plaintext = file_signature(abs_decrypted)
+        ciphertext = file_signature(abs_encrypted)
+        if ciphertext is None:
+            return MISSING_CIPHERTEXT
+        if plaintext is None:
+            return MISSING_PLAINTEXT
+
+        if not self.state.records.get(decrypted_path):
+            # Never synchronized by heysops on this machine, so the newer file is assumed to be the one that changed
+            if ciphertext["mtime_ns"] > plaintext["mtime_ns"]:
+                return CIPHERTEXT_NEWER
+            return PLAINTEXT_MODIFIED
+
+        plaintext_current = self.state.is_current(
+            decrypted_path, PLAINTEXT, abs_decrypted
+        )
+        ciphertext_current = self.state.is_current(
+            decrypted_path, CIPHERTEXT, abs_encrypted
+        )
+        if plaintext_current and ciphertext_current:
+            return UP_TO_DATE
+        if ciphertext_current:
+            return PLAINTEXT_MODIFIED
+        if plaintext_current:
+            return CIPHERTEXT_NEWER
+        return CONFLICT
+
+    @staticmethod
+    def argparse_sub_parser(sub_parser) -> argparse.Action:
+        """CLI Argument definitions
+
+        Args:
+            sub_parser: The sub-command parser object from the main argparse instance.
+
+        Returns:
+            argparse.Action: The defined action object.
+        """
+        cli_status = sub_parser.add_parser(
+            "status", help=Action.get_action_help("status")
+        )
+        cli_status.add_argument(
+            "--json", help="Print the statuses as JSON.", action="store_true"
+        )
+        cli_status.add_argument(
+            "--exit-code",
+            help="Exit with 1 if any secret is not up to date, such as from a pre-commit hook.",
+            action="store_true",
+        )
+        cli_status.add_argument(
+            "FILE",
+            help="The decrypted or encrypted files to report on. If not specified, all files found in .heysops.yaml "
+            "are reported.",
+            nargs="*",
+        )
+        add_recursive_argument(cli_status)
+        return cli_status
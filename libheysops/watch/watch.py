@@ -0,0 +1,184 @@
+import argparse
+import logging
+import os
+import threading
+from typing import Iterable, Set, Union
+
+from libheysops import Action
+from libheysops.encrypt.encrypt import Encrypt
+from libheysops.engine import run_sync
+from libheysops.watch.watcher import InotifyWatcher, PollingWatcher, get_watcher
+
+logger = logging.getLogger()
+
+# How often a watch waiting for changes checks whether it was asked to stop
+STOP_CHECK_INTERVAL = 0.5
+
+
+class Watch(Encrypt):
+    """Re-encrypts decrypted files as they are saved.
+
+    The configuration is loaded and sops is probed once, for the life of the process. Restart the watch after
+    changing the configuration file to pick up the change.
+    """
+
+    def __init__(self, **kwargs):
+        super(Watch, self).__init__(**kwargs)
+        self._stopped = threading.Event()
+
+    def run(self, **kwargs) -> None:
+        """Entry point for this action's operation
+
+        Encrypts the files changed since they were last encrypted, then waits for decrypted files to change and
+        encrypts them again, until interrupted.
+
+        Args:
+            **kwargs: The keyword arguments from the command line.
+
+        Keyword Args:
+            jobs: The number of sops invocations to run concurrently.
+            debounce: The number of seconds without further writes to wait for before encrypting.
+            poll: Poll for changes even where inotify is available.
+            interval: The number of seconds between polls, when polling.
+
+        Returns:
+            None.
+        """
+        jobs = kwargs.get("jobs") or 1
+        debounce = kwargs.get("debounce")
+        if debounce is None:
+            debounce = 0.3
+
+        decrypted_file_paths = self.get_all_decrypted_file_paths_from_config()
+        watcher = get_watcher(
+            {
+                os.path.normpath(self.get_absolute_path(x)): x
+                for x in decrypted_file_paths
+            },
+            poll=kwargs.get("poll", False),
+            interval=kwargs.get("interval") or 0.5,
+        )
+        logger.info(
+            "Watching {} files {}".format(
+                len(decrypted_file_paths),
+                "with inotify" if isinstance(watcher, InotifyWatcher) else "by polling",
+            )
+        )
+        try:
+            # Catch up on changes made while nothing was watching
+            self.encrypt_changes(decrypted_file_paths, jobs)
+            while not self._stopped.is_set():
+                changed = self.wait_for_changes(watcher, debounce)
+                if changed:
+                    self.encrypt_changes(changed, jobs)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching")
+        finally:
+            watcher.close()
+
+    def stop(self) -> None:
+        """Ask a running watch to return, once it is done with the files it is encrypting.
+
+        Returns:
+            None
+        """
+        self._stopped.set()
+
+    def wait_for_changes(
+        self, watcher: Union[InotifyWatcher, PollingWatcher], debounce: float
+    ) -> Set[str]:
+        """Wait for files to change, then for a pause of debounce seconds in further changes.
+
+        Editors often save a file with several writes, or write a temporary file and rename it. Waiting for the writes
+        to settle encrypts the file once, with its final content.
+
+        Args:
+            watcher: The watcher of the decrypted files.
+            debounce: The number of seconds without further changes to wait for.
+
+        Returns:
+            set: The decrypted file paths that changed. Empty if the watch was stopped.
+        """
+        changed = set()
+        while not changed:
+            if self._stopped.is_set():
+                return set()
+            changed = watcher.read(timeout=STOP_CHECK_INTERVAL)
+
+        while True:
+            more_changed = watcher.read(timeout=debounce)
+            if not more_changed:
+                return changed
+            changed |= more_changed
+
+    def encrypt_changes(self, decrypted_file_paths: Iterable[str], jobs: int) -> None:
+        """Encrypt the files whose plaintext changed since they were last encrypted, and save the configuration and
+        state.
+
+        Files that no longer exist are left in the configuration, as they are often only removed for a moment while
+        being saved, or on purpose by `heysops clean`.
+
+        Args:
+            decrypted_file_paths: The decrypted file paths that may have changed.
+            jobs: The number of sops invocations to run concurrently.
+
+        Returns:
+            None
+        """
+        present = [
+            x
+            for x in sorted(decrypted_file_paths)
+            if os.path.exists(self.get_absolute_path(x))
+        ]
+        if not present:
+            return None
+
+        results = run_sync(self.encrypt_files(decrypted_file_paths=present, jobs=jobs))
+        for decrypted_file_path, encrypted_information, error in results:
+            if error is not None:
+                logger.error(str(error))
+            elif encrypted_information:
+                logger.info(
+                    "Encrypted {} to {}".format(
+                        decrypted_file_path, encrypted_information["encrypted_path"]
+                    )
+                )
+        self.flush_config()
+        self.state.save()
+
+    @staticmethod
+    def argparse_sub_parser(sub_parser) -> argparse.Action:
+        """CLI Argument definitions
+
+        Args:
+            sub_parser: The sub-command parser object from the main argparse instance.
+
+        Returns:
+            argparse.Action: The defined action object.
+        """
+        cli_watch = sub_parser.add_parser("watch", help=Action.get_action_help("watch"))
+        cli_watch.add_argument(
+            "-j",
+            "--jobs",
+            help="The number of files to encrypt concurrently.",
+            type=int,
+            default=1,
+        )
+        cli_watch.add_argument(
+            "--debounce",
+            help="The number of seconds without further writes to wait for before encrypting a changed file.",
+            type=float,
+            default=0.3,
+        )
+        cli_watch.add_argument(
+            "--poll",
+            help="Poll the files for changes, even where inotify is available. Useful on network file systems.",
+            action="store_true",
+        )
+        cli_watch.add_argument(
+            "--interval",
+            help="The number of seconds between polls, when polling.",
+            type=float,
+            default=0.5,
+        )
+        return cli_watch
@@ -0,0 +1,190 @@
+"""Notification of changes to a fixed set of files.
+
+On Linux the folders holding the files are watched with inotify, so no work is done until a file changes. Elsewhere,
+or when inotify is unavailable, each file is checked with a single stat call per polling interval.
+
+Folders are watched rather than the files themselves, as many editors save by writing a new file and renaming it over
+the old one, which would end an inotify watch on the file.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from typing import Dict, Set, Tuple, Union
+
+logger = logging.getLogger()
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class PollingWatcher:
+    """Detects changes by comparing each file's stat result between polls.
+
+    Args:
+        files: Maps the absolute path of each file to watch to the name to report it by.
+        interval: The number of seconds between polls.
+    """
+
+    def __init__(self, files: Dict[str, str], interval: float = 0.5):
+        self.files = dict(files)
+        self.interval = interval
+        self.signatures = {path: self._get_signature(path) for path in self.files}
+
+    @staticmethod
+    def _get_signature(file_path: str) -> Union[Tuple[int, int, int, int], None]:
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return None
+        return (
+            file_stat.st_mtime_ns,
+            file_stat.st_ctime_ns,
+            file_stat.st_size,
+            file_stat.st_ino,
+        )
+
+    def read(self, timeout: Union[float, None] = None) -> Set[str]:
+        """Wait for at least one file to change.
+
+        Args:
+            timeout: The number of seconds to wait. None waits until a file changes.
+
+        Returns:
+            set: The names of the files that changed, or an empty set if none changed within the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for path, name in self.files.items():
+                signature = self._get_signature(path)
+                if signature != self.signatures[path]:
+                    self.signatures[path] = signature
+                    changed.add(name)
+            if changed:
+                return changed
+
+            remaining = (
+                self.interval if deadline is None else deadline - time.monotonic()
+            )
+            if remaining <= 0:
+                return set()
+            time.sleep(min(self.interval, remaining))
+
+    def close(self) -> None:
+        return None
+
+
+class InotifyWatcher:
+    """Detects changes with inotify, watching the folder of each file.
+
+    Args:
+        files: Maps the absolute path of each file to watch to the name to report it by.
+
+    Raises:
+        OSError: If inotify is not available, or a folder could not be watched, such as when it does not exist or the
+          limit on the number of watches was reached.
+    """
+
+    def __init__(self, files: Dict[str, str]):
+        self.files = dict(files)
+        library = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.folders = {}  # type: Dict[int, str]
+        try:
+            for folder in sorted(set(os.path.dirname(path) for path in self.files)):
+                watch = self._libc.inotify_add_watch(
+                    self.fd, os.fsencode(folder), WATCH_MASK
+                )
+                if watch < 0:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, os.strerror(errno), folder)
+                self.folders[watch] = folder
+        except BaseException:
+            self.close()
+            raise
+
+    def read(self, timeout: Union[float, None] = None) -> Set[str]:
+        """Wait for at least one file to change.
+
+        Args:
+            timeout: The number of seconds to wait. None waits until a file changes.
+
+        Returns:
+            set: The names of the files that changed, or an empty set if none changed within the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = (
+                None if deadline is None else max(deadline - time.monotonic(), 0)
+            )
+            if not select.select([self.fd], [], [], remaining)[0]:
+                return set()
+            changed = self._parse_events(os.read(self.fd, 64 * 1024))
+            if changed:
+                return changed
+
+    def _parse_events(self, data: bytes) -> Set[str]:
+        changed = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            watch, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, so any file may have changed
+                changed.update(self.files.values())
+                continue
+            folder = self.folders.get(watch)
+            if folder is None or not name:
+                continue
+            name = self.files.get(os.path.join(folder, os.fsdecode(name)))
+            if name is not None:
+                changed.add(name)
+        return changed
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def get_watcher(
+    files: Dict[str, str], poll: bool = False, interval: float = 0.5
+) -> Union[InotifyWatcher, PollingWatcher]:
+    """Get the most efficient watcher available for the files.
+
+    Args:
+        files: Maps the absolute path of each file to watch to the name to report it by.
+        poll: Always poll, even where inotify is available.
+        interval: The number of seconds between polls, when polling.
+
+    Returns:
+        InotifyWatcher or PollingWatcher: The watcher.
+    """
+    if not poll and os.name == "posix":
+        try:
+            return InotifyWatcher(files)
+        except (OSError, AttributeError) as e:
+            logger.info("Not using inotify ({}). Polling for changes.".format(e))
+    return PollingWatcher(files, interval=interval)
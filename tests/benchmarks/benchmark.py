@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""Benchmarks of heysops commands against generated configurations, using the fake sops executable.
+
+Each command runs in a fresh interpreter, so the measured wall time includes Python startup and imports, as a user
+would experience it. The fake sops executable from tests/fixtures only adds or strips a marker, and sleeps for
+--latency seconds per invocation to stand in for a key service round trip.
+
+Results are written as JSON, and can be compared against the results of another version with --compare:
+
+    python -m tests.benchmarks.benchmark --output before.json
+    python -m tests.benchmarks.benchmark --output after.json --compare before.json
+
+Large sizes need free disk space for the plaintext, the ciphertext and a temporary copy of each file.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple, Union
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FAKE_SOPS = os.path.join(REPO_ROOT, "tests", "fixtures", "fake_sops.py")
+
+OPERATIONS = ["startup", "encrypt", "encrypt_unchanged", "decrypt", "clean", "forget"]
+QUICK_ENTRIES = [10, 100, 1000]
+QUICK_SIZES = ["1K", "1M"]
+FULL_ENTRIES = [10, 100, 1000, 10000]
+FULL_SIZES = ["1K", "1M", "100M", "500M"]
+# Keeps the full run to a few gigabytes on disk: large files are only generated for small configurations. A size too
+# large for every configuration is measured with as many entries as fit, at least one
+MAX_TOTAL_BYTES = 2 * 1024**3
+
+# Runs a single heysops command in a fresh interpreter and reports its peak memory use
+RUN_COMMAND = """
+import json, resource, sys
+from libheysops.heysops import main
+try:
+    main(json.loads(sys.argv[1]))
+except SystemExit as e:
+    if e.code:
+        raise
+scale = 1 if sys.platform == "darwin" else 1024
+with open(sys.argv[2], "w") as open_file:
+    json.dump({
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "sops_peak_rss": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }, open_file)
+"""
+
+CONFIG_HEADER = "secrets:\n"
+CHUNK_SIZE = 1024**2
+
+
+def parse_size(size: str) -> int:
+    """Convert a size such as 1K, 500M or 2G to a number of bytes.
+
+    Args:
+        size: A number of bytes, optionally followed by K, M or G.
+
+    Returns:
+        int: The number of bytes.
+    """
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    size = size.strip().upper()
+    if size[-1:] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+class Workspace:
+    """A temporary folder holding a configuration with generated secrets.
+
+    Args:
+        entries: The number of secrets in the configuration.
+        file_size: The size of each decrypted secret, in bytes.
+    """
+
+    def __init__(self, entries: int, file_size: int):
+        self.entries = entries
+        self.file_size = file_size
+        self.folder = tempfile.mkdtemp(prefix="heysops-benchmark-")
+        self.cache_dir = tempfile.mkdtemp(prefix="heysops-benchmark-cache-")
+        # Spread the secrets over folders, as real repositories do
+        self.paths = [
+            "secrets/{:03d}/secret_{:05d}.txt".format(i // 100, i)
+            for i in range(entries)
+        ]
+
+    def __enter__(self) -> "Workspace":
+        with open(os.path.join(self.folder, ".gitignore"), "w"):
+            pass
+        with open(os.path.join(self.folder, ".heysops.yaml"), "w") as open_config:
+            open_config.write(CONFIG_HEADER)
+            for path in self.paths:
+                open_config.write(
+                    "- decrypted_path: {}\n  encrypted_path: {}.sops\n  type: null\n".format(
+                        path, path
+                    )
+                )
+        self.write_plaintexts()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        shutil.rmtree(self.folder, ignore_errors=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def write_plaintexts(self) -> None:
+        chunk = os.urandom(min(self.file_size, CHUNK_SIZE))
+        for path in self.paths:
+            abs_path = os.path.join(self.folder, path)
+            os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+            with open(abs_path, "wb") as open_file:
+                remaining = self.file_size
+                while remaining > 0:
+                    open_file.write(chunk[:remaining])
+                    remaining -= len(chunk)
+
+    def remove_plaintexts(self) -> None:
+        for path in self.paths:
+            os.remove(os.path.join(self.folder, path))
+
+    def run(self, user_args: List[str], latency: float) -> Dict[str, float]:
+        """Run a heysops command in this workspace.
+
+        Args:
+            user_args: The command line arguments to pass to heysops.
+            latency: The number of seconds each sops invocation sleeps for.
+
+        Raises:
+            subprocess.CalledProcessError: If the command failed.
+
+        Returns:
+            dict: The wall time in seconds, and the peak memory use of heysops and of the sops processes in bytes.
+        """
+        env = dict(
+            os.environ,
+            SOPS_PATH=FAKE_SOPS,
+            FAKE_SOPS_DELAY=str(latency),
+            HEYSOPS_CACHE_DIR=self.cache_dir,
+            HEYSOPS_AGENT_SOCK=os.path.join(self.cache_dir, "no-agent.sock"),
+            PYTHONPATH=os.pathsep.join(
+                filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])
+            ),
+        )
+        report_path = os.path.join(self.cache_dir, "report.json")
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", RUN_COMMAND, json.dumps(user_args), report_path],
+            cwd=self.folder,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=True,
+        )
+        seconds = time.perf_counter() - start
+        with open(report_path) as open_report:
+            report = json.load(open_report)
+        report["seconds"] = seconds
+        return report
+
+
+def run_scenario(
+    entries: int, file_size: int, latency: float, jobs: int
+) -> Dict[str, Dict[str, float]]:
+    """Run every operation once against a fresh workspace.
+
+    Args:
+        entries: The number of secrets in the configuration.
+        file_size: The size of each decrypted secret, in bytes.
+        latency: The number of seconds each sops invocation sleeps for.
+        jobs: The number of concurrent sops invocations for encrypt and decrypt.
+
+    Returns:
+        dict: The measurements of each operation.
+    """
+    jobs_args = ["--jobs", str(jobs)]
+    with Workspace(entries, file_size) as workspace:
+        measurements = {
+            "startup": workspace.run(["--version"], latency),
+            "encrypt": workspace.run(["encrypt"] + jobs_args, latency),
+            "encrypt_unchanged": workspace.run(["encrypt"] + jobs_args, latency),
+        }
+        workspace.remove_plaintexts()
+        measurements["decrypt"] = workspace.run(["decrypt"] + jobs_args, latency)
+        measurements["clean"] = workspace.run(["clean"], latency)
+        measurements["forget"] = workspace.run(["forget", workspace.paths[-1]], latency)
+    return measurements
+
+
+def summarize(samples: List[Dict[str, float]]) -> Dict[str, float]:
+    seconds = [sample["seconds"] for sample in samples]
+    return {
+        "seconds": seconds,
+        "median_seconds": statistics.median(seconds),
+        "min_seconds": min(seconds),
+        "peak_rss": max(sample["peak_rss"] for sample in samples),
+        "sops_peak_rss": max(sample["sops_peak_rss"] for sample in samples),
+    }
+
+
+def get_scaling(results: List[dict]) -> List[dict]:
+    """Estimate how each operation's time grows with the number of entries.
+
+    An exponent close to 1 is linear. Fixed costs such as startup keep it below 1 for small configurations, so an
+    exponent above 1.5 hints at quadratic behaviour.
+
+    Args:
+        results: The summarized measurements.
+
+    Returns:
+        list: The exponent of each operation and file size measured with more than one number of entries.
+    """
+    scaling = []
+    for operation in OPERATIONS:
+        for file_size in sorted({result["file_size"] for result in results}):
+            points = sorted(
+                (result["entries"], result["median_seconds"])
+                for result in results
+                if result["operation"] == operation and result["file_size"] == file_size
+            )
+            if len(points) < 2 or points[0][0] == points[-1][0]:
+                continue
+            (small_n, small_t), (large_n, large_t) = points[0], points[-1]
+            scaling.append(
+                {
+                    "operation": operation,
+                    "file_size": file_size,
+                    "entries": [small_n, large_n],
+                    "exponent": round(
+                        math.log(large_t / small_t) / math.log(large_n / small_n), 3
+                    ),
+                }
+            )
+    return scaling
+
+
+def compare(results: List[dict], baseline: List[dict], threshold: float) -> List[str]:
+    """Find the measurements that regressed compared to an earlier run.
+
+    Args:
+        results: The summarized measurements of this run.
+        baseline: The summarized measurements of the earlier run.
+        threshold: The ratio over the earlier measurement that counts as a regression.
+
+    Returns:
+        list: A description of each regression.
+    """
+    previous = {
+        (result["operation"], result["entries"], result["file_size"]): result
+        for result in baseline
+    }
+    regressions = []
+    for result in results:
+        key = (result["operation"], result["entries"], result["file_size"])
+        if key not in previous:
+            continue
+        for metric in ["median_seconds", "peak_rss"]:
+            before, after = previous[key][metric], result[metric]
+            if before and after / before > threshold:
+                regressions.append(
+                    "{} with {} entries of {} bytes: {} went from {:.4g} to {:.4g}".format(
+                        *key, metric, before, after
+                    )
+                )
+    return regressions
+
+
+def parse_args(user_args: Union[List[str], None] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--entries",
+        help="The numbers of secrets in the generated configurations.",
+        nargs="+",
+        type=int,
+    )
+    parser.add_argument(
+        "--sizes",
+        help="The sizes of the generated secrets, such as 1K, 1M or 500M.",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--full",
+        help="Measure up to {} entries and {} files, instead of {} entries and {} files.".format(
+            FULL_ENTRIES[-1], FULL_SIZES[-1], QUICK_ENTRIES[-1], QUICK_SIZES[-1]
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--latency",
+        help="The number of seconds each fake sops invocation sleeps for.",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="The --jobs to pass to heysops.", type=int, default=4
+    )
+    parser.add_argument(
+        "--repeat",
+        help="The number of times to run each scenario.",
+        type=int,
+        default=3,
+    )
+    parser.add_argument("-o", "--output", help="The path to write the JSON results to.")
+    parser.add_argument(
+        "--compare", help="The JSON results of an earlier run to compare with."
+    )
+    parser.add_argument(
+        "--threshold",
+        help="The ratio of time or memory over the earlier run that counts as a regression.",
+        type=float,
+        default=1.25,
+    )
+    return parser.parse_args(user_args)
+
+
+def get_scenarios(
+    entry_counts: List[int], sizes: List[int], max_total_bytes: Union[int, None]
+) -> List[Tuple[int, int]]:
+    """Pair each number of entries with each file size, leaving out pairs that would generate too much data.
+
+    A file size that is too large for every number of entries is paired with the largest number of entries that fits,
+    at least one, so every size is measured. Each pair left out is reported on stderr.
+
+    Args:
+        entry_counts: The numbers of secrets to generate configurations with.
+        sizes: The sizes of the generated secrets, in bytes.
+        max_total_bytes: The most bytes of secrets a configuration may hold. None pairs every count with every size.
+
+    Returns:
+        list: The (entries, file size) pairs to measure, grouped by file size.
+    """
+    scenarios = []
+    for file_size in sizes:
+        fitting = [
+            entries
+            for entries in entry_counts
+            if max_total_bytes is None or entries * file_size <= max_total_bytes
+        ]
+        if not fitting:
+            fitting = [max(max_total_bytes // file_size, 1)]
+        for entries in entry_counts:
+            if entries not in fitting:
+                sys.stderr.write(
+                    "Skipping {} entries of {} bytes, over the limit of {} bytes\n".format(
+                        entries, file_size, max_total_bytes
+                    )
+                )
+        scenarios.extend((entries, file_size) for entries in fitting)
+    return scenarios
+
+
+def main(user_args: Union[List[str], None] = None) -> int:
+    args = parse_args(user_args)
+    entry_counts = args.entries or (FULL_ENTRIES if args.full else QUICK_ENTRIES)
+    sizes = [
+        parse_size(size)
+        for size in args.sizes or (FULL_SIZES if args.full else QUICK_SIZES)
+    ]
+
+    results = []
+    for entries, file_size in get_scenarios(
+        entry_counts, sizes, None if args.sizes else MAX_TOTAL_BYTES
+    ):
+        samples = [
+            run_scenario(entries, file_size, args.latency, args.jobs)
+            for _ in range(args.repeat)
+        ]
+        for operation in OPERATIONS:
+            result = {
+                "operation": operation,
+                "entries": entries,
+                "file_size": file_size,
+            }
+            result.update(summarize([sample[operation] for sample in samples]))
+            results.append(result)
+            sys.stderr.write(
+                "{:<18} {:>6} entries {:>10} bytes {:>9.3f}s {:>8.1f} MiB\n".format(
+                    operation,
+                    entries,
+                    file_size,
+                    result["median_seconds"],
+                    result["peak_rss"] / 1024**2,
+                )
+            )
+
+    output = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency": args.latency,
+        "jobs": args.jobs,
+        "repeat": args.repeat,
+        "results": results,
+        "scaling": get_scaling(results),
+    }
+    try:
+        output["git_revision"] = (
+            subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                cwd=REPO_ROOT,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+            .stdout.decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        output["git_revision"] = None
+
+    if args.output:
+        with open(args.output, "w") as open_output:
+            json.dump(output, open_output, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+
+    for scaling in output["scaling"]:
+        if scaling["exponent"] > 1.5:
+            sys.stderr.write(
+                "Warning: {operation} grows with exponent {exponent} between {entries} entries\n".format(
+                    **scaling
+                )
+            )
+
+    if args.compare:
+        with open(args.compare) as open_baseline:
+            regressions = compare(
+                results, json.load(open_baseline)["results"], args.threshold
+            )
+        for regression in regressions:
+            sys.stderr.write("Regression: {}\n".format(regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""A stand-in for the sops executable, used by tests that run real subprocesses.
+
+Encryption prefixes the file content with a marker and decryption removes it, so no keys are needed. Content is
+streamed, so large files do not need to fit in memory.
+
+Environment Variables:
+    FAKE_SOPS_DELAY: Number of seconds to sleep before doing any work.
+    FAKE_SOPS_FAIL: If set, exit with this return code instead of encrypting or decrypting.
+    FAKE_SOPS_STDERR: The error message to write when failing. Defaults to "fake sops failure".
+    FAKE_SOPS_COUNTER: A file to count encrypt and decrypt calls in, across processes.
+    FAKE_SOPS_DELAY_CALLS: With FAKE_SOPS_COUNTER, only sleep for the first this many calls.
+    FAKE_SOPS_FAIL_CALLS: With FAKE_SOPS_COUNTER, only fail the first this many calls.
+"""
+
+import os
+import shutil
+import sys
+import time
+
+MARKER = b"FAKE-SOPS-ENCRYPTED\n"
+VERSION = "sops 3.7.1 (latest)"
+
+
+def count_call():
+    """Count this call in the FAKE_SOPS_COUNTER file, one byte per call.
+
+    Returns:
+        int: The number of calls so far, including this one. 0 if calls are not counted.
+    """
+    counter = os.environ.get("FAKE_SOPS_COUNTER")
+    if not counter:
+        return 0
+    counter_fd = os.open(counter, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(counter_fd, b".")
+        return os.fstat(counter_fd).st_size
+    finally:
+        os.close(counter_fd)
+
+
+def applies_to(call, limit_name):
+    limit = os.environ.get(limit_name)
+    return not limit or call <= int(limit)
+
+
+def main(args):
+    call = 0 if args == ["-v"] else count_call()
+    if applies_to(call, "FAKE_SOPS_DELAY_CALLS"):
+        time.sleep(float(os.environ.get("FAKE_SOPS_DELAY", 0)))
+    if args == ["-v"]:
+        print(VERSION)
+        return 0
+
+    if os.environ.get("FAKE_SOPS_FAIL") and applies_to(call, "FAKE_SOPS_FAIL_CALLS"):
+        sys.stderr.write(os.environ.get("FAKE_SOPS_STDERR", "fake sops failure") + "\n")
+        return int(os.environ["FAKE_SOPS_FAIL"])
+
+    with open(args[-1], "rb") as open_file:
+        if "-e" in args:
+            sys.stdout.buffer.write(MARKER)
+        elif "-d" in args:
+            if open_file.read(len(MARKER)) != MARKER:
+                sys.stderr.write("Error unmarshalling input: not encrypted\n")
+                return 128
+        else:
+            sys.stderr.write("Unsupported arguments {}\n".format(args))
+            return 1
+        shutil.copyfileobj(open_file, sys.stdout.buffer)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
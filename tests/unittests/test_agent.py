@@ -0,0 +1,190 @@
+import asyncio
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from libheysops.agent.agent import Agent
+from libheysops.agent import client
+from libheysops.agent.client import decrypt_with_agent, send_request
+from libheysops.base import CONFIG_TEMPLATE
+from libheysops.decrypt.decrypt import Decrypt
+from libheysops.engine import run_sync
+
+FAKE_SOPS = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "fixtures", "fake_sops.py"
+)
+
+
+@unittest.skipIf(os.name == "nt", "The agent listens on a Unix socket")
+class TestAgentFakeSops(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.encrypted_path = os.path.join(self.folder, "db.json.sops")
+        self.write_encrypted(b'{"DB_PASSWORD": "hunter2"}')
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.socket_path = os.path.join(cache_dir, "agent.sock")
+        environ = patch.dict(
+            os.environ,
+            {
+                "SOPS_PATH": FAKE_SOPS,
+                "HEYSOPS_CACHE_DIR": cache_dir,
+                "HEYSOPS_AGENT_SOCK": self.socket_path,
+            },
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+
+    def write_encrypted(self, content: bytes) -> None:
+        with open(self.encrypted_path, "wb") as open_file:
+            open_file.write(b"FAKE-SOPS-ENCRYPTED\n" + content)
+
+    def start_agent(self) -> Agent:
+        agent = Agent(ttl=60)
+        ready = threading.Event()
+        thread = threading.Thread(
+            target=run_sync, args=(agent.serve(self.socket_path, ready),)
+        )
+        thread.start()
+        self.assertTrue(ready.wait(10))
+
+        def stop():
+            run_sync(send_request({"op": "stop"}))
+            thread.join(10)
+
+        self.addCleanup(stop)
+        return agent
+
+    def test_no_agent(self):
+        self.assertIsNone(run_sync(decrypt_with_agent(self.encrypted_path)))
+
+    def test_socket_permissions(self):
+        self.start_agent()
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.socket_path).st_mode))
+        self.assertEqual(b"", run_sync(send_request({"op": "ping"})))
+
+    def test_decrypt_cached(self):
+        agent = self.start_agent()
+        expected = b'{"DB_PASSWORD": "hunter2"}'
+        self.assertEqual(expected, run_sync(decrypt_with_agent(self.encrypted_path)))
+        self.assertEqual(1, len(agent.cache))
+
+        # Served from memory, so sops is not run again
+        with patch.dict(os.environ, {"FAKE_SOPS_FAIL": "1"}):
+            self.assertEqual(
+                expected, run_sync(decrypt_with_agent(self.encrypted_path))
+            )
+
+            # A changed encrypted file is decrypted again
+            self.write_encrypted(b'{"DB_PASSWORD": "correcthorse"}')
+            with self.assertRaises(OSError):
+                run_sync(decrypt_with_agent(self.encrypted_path))
+
+        self.assertEqual(
+            b'{"DB_PASSWORD": "correcthorse"}',
+            run_sync(decrypt_with_agent(self.encrypted_path)),
+        )
+
+    def test_decrypt_streamed(self):
+        self.start_agent()
+        content = b'{"DB_PASSWORD": "' + b"x" * (3 * client.CHUNK_SIZE) + b'"}'
+        self.write_encrypted(content)
+        with tempfile.TemporaryFile(dir=self.folder) as open_file:
+            open_file.write(b"kept")
+            self.assertEqual(
+                b"",
+                run_sync(decrypt_with_agent(self.encrypted_path, stdout=open_file)),
+            )
+            open_file.seek(0)
+            self.assertEqual(b"kept" + content, open_file.read())
+
+    def test_decrypt_streamed_broken(self):
+        self.start_agent()
+
+        async def broken_copy(reader, stdout, size):
+            stdout.write(b"partial")
+            raise asyncio.IncompleteReadError(b"", size)
+
+        # A response cut short leaves the file as it was, for the caller to decrypt into
+        with patch.object(client, "copy_content", broken_copy):
+            with tempfile.TemporaryFile(dir=self.folder) as open_file:
+                open_file.write(b"kept")
+                self.assertIsNone(
+                    run_sync(decrypt_with_agent(self.encrypted_path, stdout=open_file))
+                )
+                open_file.write(b"!")
+                open_file.seek(0)
+                self.assertEqual(b"kept!", open_file.read())
+
+    def test_global_options(self):
+        agent = Agent(timeout=5, retries=3, hedge=True, durability="strict")
+        self.assertEqual(5, agent.timeout)
+        self.assertEqual(3, agent.retries)
+        self.assertTrue(agent.hedge)
+        self.assertEqual("strict", agent.durability)
+        with self.assertRaises(ValueError):
+            Agent(durability="bogus")
+
+        with patch(
+            "libheysops.decrypt.decrypt.run_sops",
+            AsyncMock(side_effect=OSError("boom")),
+        ) as mock_run:
+            with self.assertRaises(OSError):
+                agent.load_secret(self.encrypted_path)
+        self.assertEqual(5, mock_run.call_args.kwargs["timeout"])
+        self.assertEqual(3, mock_run.call_args.kwargs["retries"])
+        self.assertTrue(mock_run.call_args.kwargs["hedge"])
+
+    def test_decrypt_errors(self):
+        self.start_agent()
+        with self.assertRaises(OSError):
+            run_sync(decrypt_with_agent(os.path.join(self.folder, "missing.sops")))
+        with self.assertRaises(OSError):
+            run_sync(send_request({"op": "decrypt", "path": "relative.sops"}))
+        with self.assertRaises(OSError):
+            run_sync(send_request({"op": "bogus"}))
+
+    def test_decrypt_action_uses_agent(self):
+        config_path = os.path.join(self.folder, ".heysops.yaml")
+        with open(config_path, "w") as open_config:
+            open_config.write(
+                CONFIG_TEMPLATE
+                + "- decrypted_path: db.json\n  encrypted_path: db.json.sops\n  type: json\n"
+            )
+        self.start_agent()
+        run_sync(decrypt_with_agent(self.encrypted_path, output_type="json"))
+
+        with patch.dict(os.environ, {"FAKE_SOPS_FAIL": "1"}):
+            Decrypt(config=config_path).start(FILE=["db.json"])
+        with open(os.path.join(self.folder, "db.json"), "rb") as open_file:
+            self.assertEqual(b'{"DB_PASSWORD": "hunter2"}', open_file.read())
+
+    def test_stale_socket(self):
+        with open(self.socket_path, "w"):
+            pass
+        self.start_agent()
+        self.assertEqual(b"", run_sync(send_request({"op": "ping"})))
+
+    def test_second_agent(self):
+        self.start_agent()
+        with self.assertRaises(FileExistsError):
+            run_sync(Agent().serve(self.socket_path))
+
+    def test_stop(self):
+        self.start_agent()
+        Agent().run(stop=True)
+        for _ in range(100):
+            if not os.path.exists(self.socket_path):
+                break
+            threading.Event().wait(0.05)
+        self.assertIsNone(run_sync(decrypt_with_agent(self.encrypted_path)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import libheysops
+from libheysops.base import CONFIG_TEMPLATE
+from libheysops.secret_cache import SecretCache
+
+FAKE_SOPS = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "fixtures", "fake_sops.py"
+)
+
+
+@unittest.skipIf(os.name == "nt", "The fake sops executable requires a POSIX shell")
+class TestApi(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.folder, ".heysops.yaml")
+        gitignore_path = os.path.join(self.folder, ".gitignore")
+        with open(gitignore_path, "w") as open_gitignore:
+            open_gitignore.write("")
+        with open(self.config_path, "w") as open_config:
+            open_config.write(
+                CONFIG_TEMPLATE.replace(
+                    "gitignore_path: ", "gitignore_path: {}".format(gitignore_path)
+                )
+            )
+        for name in ["a.txt", "b.txt", "c.txt"]:
+            with open(os.path.join(self.folder, name), "w") as open_file:
+                open_file.write("secret {}".format(name))
+        environ = patch.dict(
+            os.environ,
+            {
+                "SOPS_PATH": FAKE_SOPS,
+                "HEYSOPS_CACHE_DIR": os.path.join(self.folder, "cache"),
+            },
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.folder)
+
+    def test_encrypt_decrypt_many(self):
+        actual = asyncio.run(
+            libheysops.encrypt_many(
+                files=["a.txt", "b.txt", "c.txt"], config=self.config_path, jobs=3
+            )
+        )
+        self.assertDictEqual({"a.txt": None, "b.txt": None, "c.txt": None}, actual)
+        self.assertTrue(os.path.exists(os.path.join(self.folder, "b.txt.sops")))
+        with open(os.path.join(self.folder, ".gitignore")) as open_gitignore:
+            self.assertListEqual(
+                [
+                    "# BEGIN heysops managed entries",
+                    "a.txt",
+                    "b.txt",
+                    "c.txt",
+                    "# END heysops managed entries",
+                ],
+                open_gitignore.read().splitlines(),
+            )
+
+        # Unchanged files are not encrypted again
+        with open(os.path.join(self.folder, "a.txt"), "w") as open_file:
+            open_file.write("new secret")
+        os.remove(os.path.join(self.folder, "c.txt.sops"))
+        before = os.stat(os.path.join(self.folder, "b.txt.sops")).st_mtime_ns
+        actual = asyncio.run(libheysops.encrypt_many(config=self.config_path))
+        self.assertDictEqual({"a.txt": None, "b.txt": None, "c.txt": None}, actual)
+        self.assertEqual(
+            before, os.stat(os.path.join(self.folder, "b.txt.sops")).st_mtime_ns
+        )
+        self.assertTrue(os.path.exists(os.path.join(self.folder, "c.txt.sops")))
+        with open(os.path.join(self.folder, "a.txt.sops")) as open_file:
+            self.assertIn("new secret", open_file.read())
+
+        for name in ["a.txt", "b.txt", "c.txt"]:
+            os.remove(os.path.join(self.folder, name))
+        # Damage one encrypted file, the others must still decrypt
+        with open(os.path.join(self.folder, "b.txt.sops"), "w") as open_file:
+            open_file.write("garbage")
+
+        actual = asyncio.run(libheysops.decrypt_many(config=self.config_path, jobs=3))
+        self.assertListEqual(["a.txt.sops", "b.txt.sops", "c.txt.sops"], list(actual))
+        self.assertIsNone(actual["a.txt.sops"])
+        self.assertIsInstance(actual["b.txt.sops"], OSError)
+        self.assertIsNone(actual["c.txt.sops"])
+        with open(os.path.join(self.folder, "c.txt")) as open_file:
+            self.assertEqual("secret c.txt", open_file.read())
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "b.txt")))
+
+        # Files that were not touched since they were decrypted are left alone, even when forced
+        with open(os.path.join(self.folder, "b.txt.sops"), "w") as open_file:
+            open_file.write("FAKE-SOPS-ENCRYPTED\nrepaired")
+        with patch.dict(os.environ, {"FAKE_SOPS_FAIL": "1"}):
+            actual = asyncio.run(
+                libheysops.decrypt_many(
+                    files=["a.txt.sops", "c.txt.sops"],
+                    config=self.config_path,
+                    force=True,
+                )
+            )
+        self.assertDictEqual({"a.txt.sops": None, "c.txt.sops": None}, actual)
+        actual = asyncio.run(libheysops.decrypt_many(config=self.config_path))
+        self.assertDictEqual(
+            {"a.txt.sops": None, "b.txt.sops": None, "c.txt.sops": None}, actual
+        )
+        with open(os.path.join(self.folder, "b.txt")) as open_file:
+            self.assertEqual("repaired", open_file.read())
+
+        # A failed decryption leaves the previous output in place, and no temporary file behind
+        with open(os.path.join(self.folder, "b.txt.sops"), "w") as open_file:
+            open_file.write("garbage")
+        actual = asyncio.run(
+            libheysops.decrypt_many(
+                files=["b.txt.sops"], config=self.config_path, force=True
+            )
+        )
+        self.assertIsInstance(actual["b.txt.sops"], OSError)
+        with open(os.path.join(self.folder, "b.txt")) as open_file:
+            self.assertEqual("repaired", open_file.read())
+        self.assertFalse([x for x in os.listdir(self.folder) if x.endswith(".tmp")])
+
+    def test_decrypt_many_twice(self):
+        asyncio.run(libheysops.encrypt_many(files=["a.txt"], config=self.config_path))
+        os.remove(os.path.join(self.folder, "a.txt"))
+        # As after pulling a change made elsewhere
+        with open(os.path.join(self.folder, "a.txt.sops"), "w") as open_file:
+            open_file.write("FAKE-SOPS-ENCRYPTED\nchanged elsewhere")
+
+        actual = asyncio.run(libheysops.decrypt_many(config=self.config_path))
+        self.assertDictEqual({"a.txt.sops": None}, actual)
+        # The state recorded by the first call is saved, so the second call finds the file up to date
+        before = os.stat(os.path.join(self.folder, "a.txt")).st_mtime_ns
+        with patch.dict(os.environ, {"FAKE_SOPS_FAIL": "1"}):
+            actual = asyncio.run(libheysops.decrypt_many(config=self.config_path))
+        self.assertDictEqual({"a.txt.sops": None}, actual)
+        self.assertEqual(
+            before, os.stat(os.path.join(self.folder, "a.txt")).st_mtime_ns
+        )
+
+    @patch("libheysops.api.secret_cache", SecretCache())
+    def test_get_secret(self):
+        with open(os.path.join(self.folder, "db.json"), "w") as open_file:
+            open_file.write('{"password": "hunter2"}')
+        asyncio.run(
+            libheysops.encrypt_many(files=["db.json", "a.txt"], config=self.config_path)
+        )
+        os.remove(os.path.join(self.folder, "db.json"))
+
+        actual = libheysops.get_secret("db.json", config=self.config_path)
+        self.assertDictEqual({"password": "hunter2"}, actual)
+        actual["password"] = "changed by the caller"
+        self.assertEqual(
+            b"secret a.txt", libheysops.get_secret("a.txt", config=self.config_path)
+        )
+        self.assertEqual(
+            b'{"password": "hunter2"}',
+            libheysops.get_secret("db.json.sops", config=self.config_path, raw=True),
+        )
+
+        # Repeated reads are served from the cache, without running sops
+        with patch.dict(os.environ, {"FAKE_SOPS_FAIL": "1"}):
+            self.assertDictEqual(
+                {"password": "hunter2"},
+                libheysops.get_secret("db.json", config=self.config_path),
+            )
+
+            # Until the encrypted file changes
+            with open(os.path.join(self.folder, "db.json.sops"), "ab") as open_file:
+                open_file.write(b" ")
+            self.assertRaises(
+                OSError, libheysops.get_secret, "db.json", config=self.config_path
+            )
+
+        self.assertRaises(
+            ValueError, libheysops.get_secret, "missing.json", config=self.config_path
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
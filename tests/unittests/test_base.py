@@ -1,9 +1,12 @@
 import os
+import shutil
 import subprocess
+import tempfile
 import unittest
-from unittest.mock import patch, MagicMock, call, mock_open
+from unittest.mock import patch, AsyncMock, MagicMock, call, mock_open
 
 from libheysops.base import BaseAction, SopsNotFoundError
+from libheysops.engine import run_sync
 
 
 class TestBaseAction(unittest.TestCase):
@@ -14,114 +17,99 @@ class TestBaseAction(unittest.TestCase):
         actual = BaseAction.find_config(config_file_path=".heysops.yaml")
         self.assertEqual(".heysops.yaml", actual)
 
-    @patch("libheysops.base.os")
-    def test_find_config2(self, mock_os):
-        mock_os.path.exists.return_value = False
-        mock_os.path.isfile.return_value = False
-        mock_os.curdir = os.curdir
-        mock_os.path.join = os.path.join
-        mock_os.path.abspath = os.path.abspath
-        BaseAction._check_folder_for_file = MagicMock(side_effect=[False, False, True])
-        actual = BaseAction.find_config(config_file_path=None)
-        self.assertEqual(os.path.abspath("../.heysops.yaml"), actual)
+    @patch.dict("libheysops.base._found_in_parents", clear=True)
+    def test_find_config2(self):
+        folder = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, folder)
+        working_dir = os.path.join(folder, "a", "b")
+        os.makedirs(working_dir)
+        config_path = os.path.join(folder, ".heysops.yml")
+        with open(config_path, "w") as open_config:
+            open_config.write("")
+        # A folder with the configuration file name does not count
+        os.makedirs(os.path.join(folder, "a", ".heysops.yaml"))
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(working_dir)
 
+        self.assertEqual(config_path, BaseAction.find_config(config_file_path=None))
+
+        # The result is remembered for the process
+        with patch.object(BaseAction, "_find_file_in_folder") as mock_find:
+            self.assertEqual(config_path, BaseAction.find_config())
+            mock_find.assert_not_called()
+
+        # A closer configuration is only found once the remembered one is removed
+        with open(os.path.join(working_dir, ".heysops.yaml"), "w") as open_config:
+            open_config.write("")
+        self.assertEqual(config_path, BaseAction.find_config())
+        os.remove(config_path)
+        self.assertEqual(
+            os.path.join(os.curdir, ".heysops.yaml"), BaseAction.find_config()
+        )
+
+    @patch.dict("libheysops.base._found_in_parents", clear=True)
+    def test_find_config3(self):
+        with patch.object(BaseAction, "_find_file_in_folder", return_value=None):
+            self.assertRaises(FileNotFoundError, BaseAction.find_config)
+
+    @patch("libheysops.base.probe_sops")
     @patch("libheysops.base.os")
-    def test_find_config3(self, mock_os):
-        mock_os.path.exists.return_value = False
-        mock_os.path.isfile.return_value = False
-        mock_os.curdir = os.curdir
-        mock_os.path.join = os.path.join
-        mock_os.path.abspath = os.path.abspath
-        mock_os.path.split = os.path.split
-        BaseAction._check_folder_for_file = MagicMock(return_value=False)
-        self.assertRaises(FileNotFoundError, BaseAction.find_config)
-
-    @patch("libheysops.base.subprocess")
-    @patch("libheysops.base.os")
-    def test_get_sops1(self, mock_os, mock_subprocess):
+    def test_get_sops1(self, mock_os, mock_probe_sops):
         mock_os.path.exists.return_value = True
-        mock_os.path.is_file.return_value = True
+        mock_os.path.isfile.return_value = True
+        mock_probe_sops.return_value = "3.7.1"
         actual = BaseAction._get_sops(sops_executable="/path/to/sops")
         self.assertEqual("/path/to/sops", actual)
-        mock_subprocess.assert_has_calls(
-            calls=[
-                call.run(
-                    ["/path/to/sops", "-v"],
-                    stdout=mock_subprocess.DEVNULL,
-                    stderr=mock_subprocess.DEVNULL,
-                ),
-                call.run().check_returncode(),
-            ]
-        )
+        mock_probe_sops.assert_called_once_with("/path/to/sops")
 
-    @patch("libheysops.base.subprocess")
-    def test_get_sops2(self, mock_subprocess):
+    @patch("libheysops.base.probe_sops")
+    def test_get_sops2(self, mock_probe_sops):
+        mock_probe_sops.return_value = "3.7.1"
         actual = BaseAction._get_sops()
         self.assertEqual("sops", actual)
-        mock_subprocess.assert_has_calls(
-            calls=[
-                call.run(
-                    ["sops", "-v"],
-                    stdout=mock_subprocess.DEVNULL,
-                    stderr=mock_subprocess.DEVNULL,
-                ),
-                call.run().check_returncode(),
-            ]
+        mock_probe_sops.assert_called_once_with("sops")
+        self.assertTupleEqual(
+            ("sops", "3.7.1"), run_sync(BaseAction._probe_sops_async())
         )
 
-    @patch("libheysops.base.subprocess")
-    def test_get_sops3(self, mock_subprocess):
-        mock_subprocess.run.side_effect = Exception
+    @patch("libheysops.base.probe_sops")
+    def test_get_sops3(self, mock_probe_sops):
+        mock_probe_sops.side_effect = FileNotFoundError
         self.assertRaises(SopsNotFoundError, BaseAction._get_sops)
-        mock_subprocess.assert_has_calls(
-            calls=[
-                call.run(
-                    ["sops", "-v"],
-                    stdout=mock_subprocess.DEVNULL,
-                    stderr=mock_subprocess.DEVNULL,
-                )
-            ]
-        )
+        mock_probe_sops.assert_called_once_with("sops")
 
-    @patch("libheysops.base.subprocess")
+    @patch("libheysops.base.probe_sops")
     @patch("libheysops.base.os")
-    def test_get_sops4(self, mock_os, mock_subprocess):
+    def test_get_sops4(self, mock_os, mock_probe_sops):
         mock_os.path.exists.return_value = True
-        mock_os.path.is_file.return_value = True
-        mock_subprocess.run.side_effect = Exception
+        mock_os.path.isfile.return_value = True
+        mock_probe_sops.side_effect = subprocess.CalledProcessError(1, [])
         self.assertRaises(
             SopsNotFoundError, BaseAction._get_sops, sops_executable="some/bad/path"
         )
-        mock_subprocess.assert_has_calls(
-            calls=[
-                call.run(
-                    ["some/bad/path", "-v"],
-                    stdout=mock_subprocess.DEVNULL,
-                    stderr=mock_subprocess.DEVNULL,
-                )
-            ]
-        )
+        mock_probe_sops.assert_called_once_with("some/bad/path")
 
-    @patch("libheysops.base.os")
-    def test_check_folder_for_file(self, mock_os):
-        mock_os.path.exists.return_value = False
-        mock_os.path.isdir.return_value = False
-        self.assertRaises(
-            NotADirectoryError,
-            BaseAction._check_folder_for_file,
-            folder_path="test",
-            filename="path.txt",
-        )
+    def test_check_folder_for_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            self.assertRaises(
+                NotADirectoryError,
+                BaseAction._check_folder_for_file,
+                folder_path=os.path.join(folder, "test"),
+                filename="path.txt",
+            )
 
-        mock_os.path.exists.return_value = True
-        mock_os.path.isdir.return_value = True
-        mock_os.listdir.return_value = ["path1.txt", "path2.txt"]
-        self.assertFalse(
-            BaseAction._check_folder_for_file(folder_path="test", filename="path.txt")
-        )
-        self.assertTrue(
-            BaseAction._check_folder_for_file(folder_path="test", filename="path1.txt")
-        )
+            with open(os.path.join(folder, "path1.txt"), "w") as open_file:
+                open_file.write("")
+            self.assertFalse(
+                BaseAction._check_folder_for_file(
+                    folder_path=folder, filename="path.txt"
+                )
+            )
+            self.assertTrue(
+                BaseAction._check_folder_for_file(
+                    folder_path=folder, filename="path1.txt"
+                )
+            )
 
     def test_parse_config(self):
         sample_data = "sample: yaml data"
@@ -129,6 +117,66 @@ class TestBaseAction(unittest.TestCase):
             actual = BaseAction.parse_config(config_file="something.txt")
             self.assertDictEqual({"sample": "yaml data"}, actual)
 
+    def test_parse_config_cache(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        config_path = os.path.join(folder, ".heysops.yaml")
+        with open(config_path, "w") as open_config:
+            open_config.write("sample: yaml data\n")
+
+        with patch.dict(os.environ, {"HEYSOPS_CACHE_DIR": os.path.join(folder, "c")}):
+            self.assertDictEqual(
+                {"sample": "yaml data"}, BaseAction.parse_config(config_path)
+            )
+            # Recently modified, so the cache is only used once the digest matches
+            with patch("ruamel.yaml.YAML") as mock_yaml:
+                self.assertDictEqual(
+                    {"sample": "yaml data"}, BaseAction.parse_config(config_path)
+                )
+                mock_yaml.assert_not_called()
+
+            # Old enough that the size and modification time are trusted, without reading the file
+            os.utime(config_path, ns=(0, 0))
+            BaseAction.parse_config(config_path)
+            with patch("libheysops.base.open") as mock_open_file:
+                self.assertDictEqual(
+                    {"sample": "yaml data"}, BaseAction.parse_config(config_path)
+                )
+                mock_open_file.assert_not_called()
+
+            # Changing the file parses it again
+            with open(config_path, "w") as open_config:
+                open_config.write("sample: new data\n")
+            os.utime(config_path, ns=(0, 0))
+            self.assertDictEqual(
+                {"sample": "new data"}, BaseAction.parse_config(config_path)
+            )
+
+    def test_flush_config_refreshes_cache(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        config_path = os.path.join(folder, ".heysops.yaml")
+        with open(config_path, "w") as open_config:
+            open_config.write("secrets: []\n")
+
+        with patch.dict(os.environ, {"HEYSOPS_CACHE_DIR": os.path.join(folder, "c")}):
+            with patch.object(BaseAction, "__init__", lambda x, **y: None):
+                action = BaseAction()
+            action.config_path = config_path
+            action.config = BaseAction.parse_config(config_path)
+            action.add_file_to_config(
+                {"decrypted_path": "a", "encrypted_path": "a.sops", "type": None}
+            )
+            action.flush_config()
+
+            with patch("ruamel.yaml.YAML") as mock_yaml:
+                actual = BaseAction.parse_config(config_path)
+                mock_yaml.assert_not_called()
+            self.assertEqual(
+                [{"decrypted_path": "a", "encrypted_path": "a.sops", "type": None}],
+                actual["secrets"],
+            )
+
     def test_abstract_base_classes(self):
         with patch.object(BaseAction, "__init__", lambda x, **y: None):
             action = BaseAction()
@@ -137,43 +185,83 @@ class TestBaseAction(unittest.TestCase):
                 NotImplementedError, BaseAction.argparse_sub_parser, "test"
             )
 
-    def test_baseaction_init(self):
+    @patch("libheysops.base.StateStore")
+    def test_baseaction_init(self, mock_state_store):
         with patch.object(BaseAction, "find_config", lambda x, **y: "some/path"):
             with patch.object(
                 BaseAction, "parse_config", lambda x, **y: {"config": "data"}
             ):
                 with patch.object(
-                    BaseAction, "_get_sops", lambda x, **y: "path/to/sops"
+                    BaseAction,
+                    "_probe_sops_async",
+                    AsyncMock(return_value=("path/to/sops", "3.7.1")),
                 ):
                     action = BaseAction(force=True, config="my/config.file")
                     self.assertTrue(action.force)
+                    self.assertIsNone(action.timeout)
+                    self.assertEqual(0, action.retries)
+                    self.assertFalse(action.hedge)
                     self.assertEqual("some/path", action.config_path)
                     self.assertDictEqual({"config": "data"}, action.config)
                     self.assertEqual("path/to/sops", action.sops)
+                    self.assertEqual("3.7.1", action.sops_version)
+                    mock_state_store.for_config.assert_called_with("some/path")
+
+                    action = BaseAction(
+                        sops="known/sops",
+                        sops_version="3.6.0",
+                        timeout=2.5,
+                        retries=3,
+                        hedge=True,
+                    )
+                    self.assertEqual("known/sops", action.sops)
+                    self.assertEqual("3.6.0", action.sops_version)
+                    self.assertEqual(2.5, action.timeout)
+                    self.assertEqual(3, action.retries)
+                    self.assertTrue(action.hedge)
 
     def test_start(self):
         with patch.object(BaseAction, "__init__", lambda x, **y: None):
             action = BaseAction()
             action.run = MagicMock()
             action.flush_config = MagicMock()
+            action.state = MagicMock()
             action.start()
+            action.run.assert_called_once()
+            action.flush_config.assert_called_once()
+            action.state.save.assert_called_once()
+
+    def test_start_flushes_on_error(self):
+        with patch.object(BaseAction, "__init__", lambda x, **y: None):
+            action = BaseAction()
+            action.run = MagicMock(side_effect=OSError)
+            action.flush_config = MagicMock()
+            action.state = MagicMock()
+            self.assertRaises(OSError, action.start)
+            action.flush_config.assert_called_once()
+            action.state.save.assert_called_once()
 
     def test_flush_config(self):
         with patch.object(BaseAction, "__init__", lambda x, **y: None):
             action = BaseAction()
-            with patch("libheysops.base.open", mock_open()) as m:
+            with patch("libheysops.base.write_file_atomic") as m:
                 action.config = {"sample": {"data": "here"}}
                 action.config_path = "if this file exists a test failed.txt"
                 action.flush_config()
-                m.assert_has_calls(
-                    calls=[
-                        call("if this file exists a test failed.txt", "w"),
-                        call().__enter__(),
-                        call().write("sample: {data: here}\n"),
-                        call().__exit__(None, None, None),
-                    ]
+                m.assert_not_called()
+
+                action.mark_config_modified()
+                action.flush_config()
+                m.assert_called_once_with(
+                    os.path.realpath("if this file exists a test failed.txt"),
+                    b"sample: {data: here}\n",
+                    "batch",
                 )
 
+                # Nothing changed since the last flush
+                action.flush_config()
+                m.assert_called_once()
+
     def test_get_absolute_path(self):
         with patch.object(BaseAction, "__init__", lambda x, **y: None):
             action = BaseAction()
@@ -225,7 +313,7 @@ class TestBaseAction(unittest.TestCase):
                         },
                     ]
                 },
-                action.config,
+                {"secrets": action.secrets.to_list()},
             )
 
     def test_add_file_to_config2(self):
@@ -249,7 +337,7 @@ class TestBaseAction(unittest.TestCase):
                         }
                     ]
                 },
-                action.config,
+                {"secrets": action.secrets.to_list()},
             )
 
     def test_add_file_to_config3(self):
@@ -291,7 +379,7 @@ class TestBaseAction(unittest.TestCase):
                         },
                     ]
                 },
-                action.config,
+                {"secrets": action.secrets.to_list()},
             )
 
     def test_delete_file_from_config(self):
@@ -322,7 +410,7 @@ class TestBaseAction(unittest.TestCase):
                         },
                     ]
                 },
-                action.config,
+                {"secrets": action.secrets.to_list()},
             )
 
             action.config = {}
@@ -361,6 +449,66 @@ class TestBaseAction(unittest.TestCase):
             actual_encrypted = action.get_all_encrypted_file_paths_from_config()
             self.assertListEqual([], actual_encrypted)
 
+    def test_flush_secrets(self):
+        with patch.object(BaseAction, "__init__", lambda x, **y: None):
+            action = BaseAction()
+            action.config_path = "if this file exists a test failed.txt"
+            action.config = {"project": {}, "secrets": None}
+            with patch("libheysops.base.write_file_atomic") as m:
+                action.flush_config()
+                m.assert_not_called()
+                self.assertDictEqual({"project": {}, "secrets": None}, action.config)
+
+                secrets = action.secrets
+                action.add_file_to_config(
+                    {"decrypted_path": "a.txt", "encrypted_path": "a.txt.sops"}
+                )
+                action.flush_config()
+                m.assert_called_once()
+            self.assertFalse(action.secrets.modified)
+            self.assertDictEqual(
+                {
+                    "project": {},
+                    "secrets": [
+                        {"decrypted_path": "a.txt", "encrypted_path": "a.txt.sops"}
+                    ],
+                },
+                action.config,
+            )
+            self.assertIs(secrets, action.secrets)
+
+            # Replacing the configuration rebuilds the table
+            action.config = {"secrets": []}
+            self.assertListEqual([], action.secrets.to_list())
+
+    def test_is_secret_current(self):
+        with patch.object(BaseAction, "__init__", lambda x, **y: None):
+            action = BaseAction()
+            action.config_path = "path/to/.heysops.yaml"
+            action.state = MagicMock()
+            action.state.is_current.return_value = True
+            entry = {
+                "decrypted_path": "file1.txt",
+                "encrypted_path": "file1.txt.sops",
+                "type": None,
+            }
+            self.assertTrue(action.is_secret_current(entry))
+            action.state.is_current.assert_has_calls(
+                calls=[
+                    call(
+                        "file1.txt",
+                        "ciphertext",
+                        os.path.abspath("path/to/file1.txt.sops"),
+                    ),
+                    call(
+                        "file1.txt", "plaintext", os.path.abspath("path/to/file1.txt")
+                    ),
+                ]
+            )
+            self.assertFalse(action.is_secret_current({}))
+            action.state.is_current.return_value = False
+            self.assertFalse(action.is_secret_current(entry))
+
     def test_find_file_in_config(self):
         with patch.object(BaseAction, "__init__", lambda x, **y: None):
             action = BaseAction()
@@ -0,0 +1,83 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from tests.benchmarks import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(1024, benchmark.parse_size("1K"))
+        self.assertEqual(500 * 1024**2, benchmark.parse_size("500m"))
+        self.assertEqual(10, benchmark.parse_size("10"))
+
+    def test_compare(self):
+        baseline = [
+            {
+                "operation": "encrypt",
+                "entries": 10,
+                "file_size": 1024,
+                "median_seconds": 1.0,
+                "peak_rss": 100,
+            }
+        ]
+        results = [dict(baseline[0], median_seconds=1.1, peak_rss=200)]
+        regressions = benchmark.compare(results, baseline, 1.25)
+        self.assertEqual(1, len(regressions))
+        self.assertIn("peak_rss", regressions[0])
+
+    def test_scaling(self):
+        results = [
+            {"operation": "forget", "entries": n, "file_size": 1, "median_seconds": t}
+            for n, t in [(10, 1.0), (100, 100.0)]
+        ]
+        self.assertEqual(
+            [
+                {
+                    "operation": "forget",
+                    "file_size": 1,
+                    "entries": [10, 100],
+                    "exponent": 2.0,
+                }
+            ],
+            benchmark.get_scaling(results),
+        )
+
+    def test_get_scenarios(self):
+        sizes = [1, 10, 1000]
+        with patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            actual = benchmark.get_scenarios([2, 20, 200], sizes, 400)
+        # The largest size fits no count, so it is measured with as many entries as fit
+        self.assertListEqual(
+            [(2, 1), (20, 1), (200, 1), (2, 10), (20, 10), (1, 1000)], actual
+        )
+        self.assertEqual(4, len(stderr.getvalue().splitlines()))
+        self.assertIn("Skipping 200 entries of 10 bytes", stderr.getvalue())
+
+        self.assertEqual(9, len(benchmark.get_scenarios([2, 20, 200], sizes, None)))
+
+    @unittest.skipIf(os.name == "nt", "The fake sops executable requires a POSIX shell")
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as folder:
+            output_path = os.path.join(folder, "results.json")
+            self.assertEqual(
+                0,
+                benchmark.main(
+                    ["--entries", "2", "--sizes", "1K", "--repeat", "1"]
+                    + ["-o", output_path]
+                ),
+            )
+            with open(output_path) as open_output:
+                results = json.load(open_output)["results"]
+        self.assertEqual(
+            benchmark.OPERATIONS, [result["operation"] for result in results]
+        )
+        for result in results:
+            self.assertGreater(result["peak_rss"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
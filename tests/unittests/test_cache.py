@@ -0,0 +1,42 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from libheysops.cache import get_cache_dir
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def get_mode(self, *parts: str) -> int:
+        return stat.S_IMODE(os.stat(os.path.join(self.folder, *parts)).st_mode)
+
+    @unittest.skipIf(os.name == "nt", "Windows does not have POSIX permissions")
+    def test_get_cache_dir_mode(self):
+        environ = {"XDG_CACHE_HOME": self.folder, "HEYSOPS_CACHE_DIR": ""}
+        with patch.dict(os.environ, environ):
+            # The first call creates the cache directory as the parent of a sub folder
+            actual = get_cache_dir("state")
+        self.assertEqual(os.path.join(self.folder, "heysops", "state"), actual)
+        self.assertEqual(0o700, self.get_mode("heysops"))
+        self.assertEqual(0o700, self.get_mode("heysops", "state"))
+
+    @unittest.skipIf(os.name == "nt", "Windows does not have POSIX permissions")
+    def test_get_cache_dir_existing(self):
+        # Such as one created by an earlier version
+        os.makedirs(os.path.join(self.folder, "heysops"), mode=0o755)
+        os.chmod(os.path.join(self.folder, "heysops"), 0o755)
+        with patch.dict(
+            os.environ, {"HEYSOPS_CACHE_DIR": os.path.join(self.folder, "heysops")}
+        ):
+            get_cache_dir("config")
+        self.assertEqual(0o700, self.get_mode("heysops"))
+
+
+if __name__ == "__main__":
+    unittest.main()
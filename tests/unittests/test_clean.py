@@ -1,32 +1,138 @@
+import os
+import shutil
+import tempfile
 import unittest
-from unittest.mock import patch, MagicMock, call
+from unittest.mock import patch, AsyncMock, MagicMock, call
 
+from libheysops.base import CONFIG_TEMPLATE
 from libheysops.clean.clean import Clean
+from libheysops.encrypt.encrypt import Encrypt
+
+FAKE_SOPS = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "fixtures", "fake_sops.py"
+)
 
 
 class MyTestCase(unittest.TestCase):
     def setUp(self) -> None:
         with patch.object(Clean, "__init__", lambda x, **y: None):
             self.action = Clean()
+        self.action.state = MagicMock()
+        self.action.state.is_current.return_value = True
 
     def test_run(self):
+        self.action.get_all_decrypted_file_paths_from_config = MagicMock(
+            return_value=["a.txt", "b.txt", "c.txt"]
+        )
+        self.action.get_absolute_path = MagicMock(
+            side_effect=lambda x: "a/{}".format(x)
+        )
+        self.action.encrypt_files = AsyncMock(
+            return_value=[
+                ("a.txt", {}, None),
+                ("b.txt", {"encrypted_path": "b.txt.sops"}, None),
+            ]
+        )
+
+        with patch("libheysops.clean.clean.os") as mock_os:
+            mock_os.path.exists.side_effect = lambda x: x != "a/c.txt"
+            self.action.run(jobs=4)
+            self.action.encrypt_files.assert_called_once_with(
+                decrypted_file_paths=["a.txt", "b.txt"], jobs=4
+            )
+            mock_os.remove.assert_has_calls(
+                calls=[call("a/a.txt"), call("a/b.txt")], any_order=True
+            )
+            self.assertEqual(2, mock_os.remove.call_count)
+
+    def test_run_failed(self):
         self.action.get_all_decrypted_file_paths_from_config = MagicMock(
             return_value=["a.txt", "b.txt"]
         )
         self.action.get_absolute_path = MagicMock(
             side_effect=lambda x: "a/{}".format(x)
         )
+        self.action.encrypt_files = AsyncMock(
+            return_value=[
+                ("a.txt", None, OSError("sops failed")),
+                ("b.txt", {}, None),
+            ]
+        )
+        # b.txt was edited after it was encrypted
+        self.action.state.is_current.return_value = False
 
-        with patch("libheysops.clean.clean.Action") as mock_action:
-            with patch("libheysops.clean.clean.os") as mock_os:
+        with patch("libheysops.clean.clean.os") as mock_os:
+            mock_os.path.exists.return_value = True
+            with self.assertRaises(OSError) as error:
                 self.action.run()
-                mock_os.remove.assert_has_calls(
-                    calls=[
-                        call("a/a.txt"),
-                        call("a/b.txt"),
-                    ]
+            mock_os.remove.assert_not_called()
+        self.assertIn("a.txt, b.txt", str(error.exception))
+
+
+@unittest.skipIf(os.name == "nt", "The fake sops executable requires a POSIX shell")
+class TestCleanFakeSops(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.config_path = os.path.join(self.folder, ".heysops.yaml")
+        with open(self.config_path, "w") as open_config:
+            open_config.write(
+                CONFIG_TEMPLATE.replace(
+                    "gitignore_path: ",
+                    "gitignore_path: {}/.gitignore".format(self.folder),
                 )
-                mock_action.encrypt.assert_called_once_with(FILE="-")
+                + "- decrypted_path: a.txt\n  encrypted_path: a.txt.sops\n  type: null\n"
+                + "- decrypted_path: b.txt\n  encrypted_path: b.txt.sops\n  type: null\n"
+            )
+        for name in ["a.txt", "b.txt"]:
+            with open(os.path.join(self.folder, name), "w") as open_file:
+                open_file.write(name)
+        environ = patch.dict(
+            os.environ,
+            {"SOPS_PATH": FAKE_SOPS, "HEYSOPS_CACHE_DIR": tempfile.mkdtemp()},
+        )
+        environ.start()
+        self.addCleanup(shutil.rmtree, os.environ["HEYSOPS_CACHE_DIR"])
+        self.addCleanup(environ.stop)
+
+    def test_clean(self):
+        Clean(config=self.config_path).start(jobs=2)
+        self.assertEqual(
+            [".gitignore", ".heysops.yaml", "a.txt.sops", "b.txt.sops"],
+            sorted(os.listdir(self.folder)),
+        )
+        with open(os.path.join(self.folder, "a.txt.sops"), "rb") as open_file:
+            self.assertEqual(b"FAKE-SOPS-ENCRYPTED\na.txt", open_file.read())
+
+        # Cleaning again keeps the secrets, whose decrypted files are already gone
+        Clean(config=self.config_path).start()
+        action = Clean(config=self.config_path)
+        self.assertEqual(
+            ["a.txt", "b.txt"], action.get_all_decrypted_file_paths_from_config()
+        )
+
+    def test_clean_unchanged(self):
+        Encrypt(config=self.config_path).start(FILE=["-"])
+        with open(os.path.join(self.folder, "b.txt"), "w") as open_file:
+            open_file.write("changed")
+
+        action = Clean(config=self.config_path)
+        action.encrypt_file_async = MagicMock(side_effect=action.encrypt_file_async)
+        action.start()
+        self.assertEqual(
+            ["b.txt"],
+            [x.kwargs["file_entry"] for x in action.encrypt_file_async.call_args_list],
+        )
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "a.txt")))
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "b.txt")))
+
+    def test_clean_failed(self):
+        with patch.dict(os.environ, {"FAKE_SOPS_FAIL": "1"}):
+            action = Clean(config=self.config_path)
+            with self.assertRaises(OSError):
+                action.start()
+        self.assertTrue(os.path.exists(os.path.join(self.folder, "a.txt")))
+        self.assertTrue(os.path.exists(os.path.join(self.folder, "b.txt")))
 
 
 if __name__ == "__main__":
@@ -1,13 +1,36 @@
+import asyncio
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
 import unittest
-from unittest.mock import patch, MagicMock, call, mock_open
+from unittest.mock import patch, AsyncMock, MagicMock, call
 
+from libheysops.base import CONFIG_TEMPLATE
 from libheysops.decrypt.decrypt import Decrypt
+from libheysops.engine import run_sync
+
+FAKE_SOPS = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "fixtures", "fake_sops.py"
+)
 
 
 class MyTestCase(unittest.TestCase):
     def setUp(self) -> None:
         with patch.object(Decrypt, "__init__", lambda x, **y: None):
             self.action = Decrypt()
+        self.action.config_path = "a/.heysops.yaml"
+        self.action.state = MagicMock()
+        self.action.state.is_current.return_value = False
+        # Never reach an agent running on the machine executing the tests
+        agent = patch(
+            "libheysops.decrypt.decrypt.decrypt_with_agent",
+            AsyncMock(return_value=None),
+        )
+        agent.start()
+        self.addCleanup(agent.stop)
 
     def test_run1(self):
         self.action.find_file_in_config = MagicMock(
@@ -17,11 +40,11 @@ class MyTestCase(unittest.TestCase):
                 "type": None,
             }
         )
-        self.action.decrypt_file = MagicMock()
+        self.action.decrypt_file_async = AsyncMock()
 
         self.action.run(FILE=["test123.txt"])
         self.action.find_file_in_config.assert_called_once_with(file_path="test123.txt")
-        self.action.decrypt_file.assert_called_once_with(
+        self.action.decrypt_file_async.assert_called_once_with(
             file_entry="test.txt.sops",
             output_type=None,
             output_filename="test.txt",
@@ -35,23 +58,102 @@ class MyTestCase(unittest.TestCase):
                 "type": None,
             }
         )
-        self.action.decrypt_file = MagicMock()
+        self.action.decrypt_file_async = AsyncMock()
 
         self.action.get_all_encrypted_file_paths_from_config = MagicMock(
             return_value=["test456.txt"]
         )
         self.action.find_file_in_config.reset_mock()
-        self.action.decrypt_file.reset_mock()
+        self.action.decrypt_file_async.reset_mock()
         self.action.run(FILE="-")
         self.action.find_file_in_config.assert_called_once_with(file_path="test456.txt")
-        self.action.decrypt_file.assert_called_once_with(
+        self.action.decrypt_file_async.assert_called_once_with(
             file_entry="test.txt.sops",
             output_type=None,
             output_filename="test.txt",
         )
 
-    @patch("libheysops.decrypt.decrypt.subprocess")
-    def test_decrypt_file1(self, mock_subprocess):
+    def test_run3(self):
+        self.action.find_file_in_config = MagicMock(
+            side_effect=lambda file_path: (
+                {}
+                if file_path == "unknown.txt.sops"
+                else {
+                    "encrypted_path": file_path,
+                    "decrypted_path": file_path.replace(".sops", ""),
+                    "type": None,
+                }
+            )
+        )
+
+        def decrypt_file(file_entry, output_type, output_filename):
+            if file_entry == "b.txt.sops":
+                raise OSError("Unable to decrypt file.")
+
+        self.action.decrypt_file_async = AsyncMock(side_effect=decrypt_file)
+
+        with self.assertLogs(level="INFO") as logs:
+            with self.assertRaises(OSError) as raised:
+                self.action.run(
+                    FILE=["a.txt.sops", "b.txt.sops", "unknown.txt.sops"], jobs=3
+                )
+        self.assertIn("1 of 3", str(raised.exception))
+        self.assertEqual(3, self.action.decrypt_file_async.call_count)
+        self.action.decrypt_file_async.assert_any_call(
+            file_entry="unknown.txt.sops", output_type=None, output_filename=None
+        )
+        self.assertListEqual(
+            [
+                "INFO:root:Decrypted a.txt.sops",
+                "ERROR:root:Failed to decrypt b.txt.sops: Unable to decrypt file.",
+                "INFO:root:Decrypted unknown.txt.sops",
+            ],
+            logs.output,
+        )
+
+    def test_run4(self):
+        self.action.find_file_in_config = MagicMock(
+            side_effect=lambda file_path: {
+                "encrypted_path": file_path,
+                "decrypted_path": file_path.replace(".sops", ""),
+                "type": None,
+            }
+        )
+        threads = []
+
+        def is_secret_current(entry):
+            threads.append(threading.current_thread())
+            return entry["encrypted_path"] == "same.txt.sops"
+
+        self.action.is_secret_current = MagicMock(side_effect=is_secret_current)
+        self.action.decrypt_file_async = AsyncMock()
+
+        with self.assertLogs(level="INFO") as logs, patch(
+            "sys.stderr", new_callable=io.StringIO
+        ) as stderr:
+            self.action.run(FILE=["same.txt.sops", "changed.txt.sops"])
+        self.action.decrypt_file_async.assert_called_once_with(
+            file_entry="changed.txt.sops",
+            output_type=None,
+            output_filename="changed.txt",
+        )
+        self.assertListEqual(
+            [
+                "INFO:root:same.txt.sops has not changed since it was last decrypted. Skipping.",
+                "INFO:root:Up to date same.txt.sops",
+                "INFO:root:Decrypted changed.txt.sops",
+            ],
+            logs.output,
+        )
+        self.assertEqual(
+            "Decrypted 1 of 2 files. The others were up to date.\n", stderr.getvalue()
+        )
+        # Checking may hash large files, so it does not run on the event loop's thread
+        self.assertEqual(2, len(threads))
+        self.assertNotIn(threading.main_thread(), threads)
+
+    @patch("libheysops.decrypt.decrypt.run_sops")
+    def test_decrypt_file1(self, mock_run_sops):
         self.action.find_file_in_config = MagicMock(
             return_value={
                 "encrypted_path": "test.txt.sops",
@@ -64,34 +166,26 @@ class MyTestCase(unittest.TestCase):
         )
         self.action.sops = "sops"
         self.action.force = False
-        mock_run = MagicMock()
-        mock_run.stderr = b""
-        mock_run.stdout = b"data"
-        mock_subprocess.run.return_value = mock_run
-        with patch("libheysops.decrypt.decrypt.open", mock_open()) as m:
+        mock_run_sops.return_value = subprocess.CompletedProcess([], 0, b"data", b"")
+        with patch("libheysops.base.atomic_output") as m:
             self.action.decrypt_file(
                 file_entry="test.txt.sops", output_type=None, output_filename="test.txt"
             )
-            mock_subprocess.assert_has_calls(
-                calls=[
-                    call.run(
-                        ["sops", "-d", "a/test.txt.sops"],
-                        stdout=mock_subprocess.PIPE,
-                        stderr=mock_subprocess.PIPE,
-                    )
-                ]
+            mock_run_sops.assert_called_once_with(
+                ["sops", "-d", "a/test.txt.sops"],
+                timeout=None,
+                stdout=m.return_value.__enter__.return_value,
+                retries=0,
+                hedge=False,
             )
-            m.assert_has_calls(
-                calls=[
-                    call("a/test.txt", "wb"),
-                    call().__enter__(),
-                    call().write(b"data"),
-                    call().__exit__(None, None, None),
-                ]
+            m.assert_called_once_with("a/test.txt", "output write", "batch")
+            self.action.state.snapshot.assert_has_calls(
+                calls=[call("a/test.txt.sops"), call("a/test.txt")]
             )
+            self.assertEqual(2, self.action.state.record.call_count)
 
-    @patch("libheysops.decrypt.decrypt.subprocess")
-    def test_decrypt_file2(self, mock_subprocess):
+    @patch("libheysops.decrypt.decrypt.run_sops")
+    def test_decrypt_file2(self, mock_run_sops):
         self.action.find_file_in_config = MagicMock(
             return_value={
                 "encrypted_path": "test.txt.sops",
@@ -104,62 +198,160 @@ class MyTestCase(unittest.TestCase):
         )
         self.action.sops = "sops"
         self.action.force = False
-        mock_run = MagicMock()
-        mock_run.stderr = b"err"
-        mock_run.stdout = b"data"
-        mock_subprocess.run.return_value = mock_run
-        with patch("libheysops.decrypt.decrypt.open", mock_open()) as m:
+        mock_run_sops.return_value = subprocess.CompletedProcess([], 0, b"data", b"err")
+        with patch("libheysops.base.atomic_output") as m:
             self.action.decrypt_file(file_entry="test.txt.sops", output_type="binary")
-            mock_subprocess.assert_has_calls(
-                calls=[
-                    call.run(
-                        ["sops", "--output-type", "binary", "-d", "a/test.txt.sops"],
-                        stdout=mock_subprocess.PIPE,
-                        stderr=mock_subprocess.PIPE,
-                    )
-                ]
+            mock_run_sops.assert_called_once_with(
+                ["sops", "--output-type", "binary", "-d", "a/test.txt.sops"],
+                timeout=None,
+                stdout=m.return_value.__enter__.return_value,
+                retries=0,
+                hedge=False,
             )
-            m.assert_has_calls(
-                calls=[
-                    call("a/test.txt", "wb"),
-                    call().__enter__(),
-                    call().write(b"data"),
-                    call().__exit__(None, None, None),
-                ]
+            m.assert_called_once_with("a/test.txt", "output write", "batch")
+            self.action.state.snapshot.assert_has_calls(
+                calls=[call("a/test.txt.sops"), call("a/test.txt")]
             )
+            self.assertEqual(2, self.action.state.record.call_count)
 
-    @patch("libheysops.decrypt.decrypt.subprocess")
-    def test_decrypt_file3(self, mock_subprocess):
+    @patch("libheysops.decrypt.decrypt.run_sops")
+    def test_decrypt_file3(self, mock_run_sops):
         self.action.find_file_in_config = MagicMock(return_value={})
         self.action.get_absolute_path = MagicMock(
             side_effect=lambda x: "a/{}".format(x)
         )
         self.action.sops = "sops"
         self.action.force = False
-        mock_run = MagicMock()
-        mock_run.stderr = b"err"
-        mock_run.stdout = b"data"
-        mock_subprocess.run.return_value = mock_run
-        with patch("libheysops.decrypt.decrypt.open", mock_open()) as m:
+        mock_run_sops.return_value = subprocess.CompletedProcess([], 0, b"data", b"err")
+        with patch("libheysops.base.atomic_output") as m:
             self.action.decrypt_file(file_entry="test.txt.sops", output_type="binary")
-            mock_subprocess.assert_has_calls(
-                calls=[
-                    call.run(
-                        ["sops", "--output-type", "binary", "-d", "a/test.txt.sops"],
-                        stdout=mock_subprocess.PIPE,
-                        stderr=mock_subprocess.PIPE,
+            mock_run_sops.assert_called_once_with(
+                ["sops", "--output-type", "binary", "-d", "a/test.txt.sops"],
+                timeout=None,
+                stdout=m.return_value.__enter__.return_value,
+                retries=0,
+                hedge=False,
+            )
+            m.assert_called_once_with("a/test.txt", "output write", "batch")
+            self.action.state.snapshot.assert_has_calls(
+                calls=[call("a/test.txt.sops"), call("a/test.txt")]
+            )
+            self.assertEqual(2, self.action.state.record.call_count)
+
+    def test_get_secret_format(self):
+        tests = [
+            ({"decrypted_path": ".env", "type": None}, "dotenv"),
+            ({"decrypted_path": "a/prod.env"}, "dotenv"),
+            ({"decrypted_path": "a.JSON", "type": None}, "json"),
+            ({"decrypted_path": "a.yml", "type": None}, "yaml"),
+            ({"decrypted_path": "a.txt", "type": "json"}, "json"),
+            ({"decrypted_path": "a.json", "type": "binary"}, None),
+            ({"decrypted_path": "a.pem", "type": None}, None),
+        ]
+        for config_entry, expected in tests:
+            with self.subTest(msg=config_entry["decrypted_path"]):
+                self.assertEqual(expected, Decrypt.get_secret_format(config_entry))
+
+
+@unittest.skipIf(os.name == "nt", "The fake sops executable requires a POSIX shell")
+class TestDecryptFakeSops(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.config_path = os.path.join(self.folder, ".heysops.yaml")
+        self.names = ["a.txt", "b.txt", "c.txt"]
+        with open(self.config_path, "w") as open_config:
+            open_config.write(
+                CONFIG_TEMPLATE
+                + "".join(
+                    "- decrypted_path: {0}\n  encrypted_path: {0}.sops\n  type: null\n".format(
+                        name
                     )
-                ]
+                    for name in self.names
+                )
             )
-            m.assert_has_calls(
-                calls=[
-                    call("a/test.txt", "wb"),
-                    call().__enter__(),
-                    call().write(b"data"),
-                    call().__exit__(None, None, None),
-                ]
+        for name in self.names:
+            with open(os.path.join(self.folder, name + ".sops"), "w") as open_file:
+                open_file.write("FAKE-SOPS-ENCRYPTED\n" + name)
+        environ = patch.dict(
+            os.environ,
+            {
+                "SOPS_PATH": FAKE_SOPS,
+                "HEYSOPS_CACHE_DIR": tempfile.mkdtemp(),
+                "HEYSOPS_AGENT_SOCK": os.path.join(self.folder, "no-agent.sock"),
+            },
+        )
+        environ.start()
+        self.addCleanup(shutil.rmtree, os.environ["HEYSOPS_CACHE_DIR"])
+        self.addCleanup(environ.stop)
+
+    def test_durability(self):
+        for durability in ["none", "batch", "strict"]:
+            with self.subTest(durability=durability):
+                for name in self.names:
+                    if os.path.exists(os.path.join(self.folder, name)):
+                        os.remove(os.path.join(self.folder, name))
+                action = Decrypt(config=self.config_path, durability=durability)
+                action.start(jobs=2)
+                for name in self.names:
+                    with open(os.path.join(self.folder, name)) as open_file:
+                        self.assertEqual(name, open_file.read())
+                # The state of every file was recorded once it was in place
+                results = run_sync(Decrypt(config=self.config_path).decrypt_files())
+                self.assertListEqual(
+                    [False, False, False], [decrypted for _, decrypted, _ in results]
+                )
+
+    def test_interrupted(self):
+        action = Decrypt(config=self.config_path)
+        decrypt_file_async = action.decrypt_file_async
+
+        async def interrupt_on_last(file_entry, output_type, output_filename):
+            if file_entry == "c.txt.sops":
+                raise KeyboardInterrupt
+            return await decrypt_file_async(
+                file_entry=file_entry,
+                output_type=output_type,
+                output_filename=output_filename,
+            )
+
+        action.decrypt_file_async = interrupt_on_last
+        with self.assertRaises(KeyboardInterrupt):
+            action.start(jobs=1)
+        # The files decrypted before the interruption were never moved into place
+        self.assertListEqual(
+            [".heysops.yaml", "a.txt.sops", "b.txt.sops", "c.txt.sops"],
+            sorted(os.listdir(self.folder)),
+        )
+
+    def test_interrupted_in_flight(self):
+        action = Decrypt(config=self.config_path)
+        decrypt_file_async = action.decrypt_file_async
+
+        async def interrupt_on_last(file_entry, output_type, output_filename):
+            if file_entry == "c.txt.sops":
+                await asyncio.sleep(0.2)
+                raise RuntimeError("interrupted")
+            return await decrypt_file_async(
+                file_entry=file_entry,
+                output_type=output_type,
+                output_filename=output_filename,
             )
 
+        async def decrypt_then_wait():
+            with self.assertRaises(RuntimeError):
+                await action.decrypt_files(jobs=3)
+            # The other files were still being decrypted; none of them may finish once the batch was discarded
+            await asyncio.sleep(1)
+
+        action.decrypt_file_async = interrupt_on_last
+        with patch.dict(os.environ, {"FAKE_SOPS_DELAY": "0.5"}):
+            asyncio.run(decrypt_then_wait())
+        self.assertListEqual(
+            [".heysops.yaml", "a.txt.sops", "b.txt.sops", "c.txt.sops"],
+            sorted(os.listdir(self.folder)),
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,6 +1,8 @@
 import os
+import subprocess
+import tempfile
 import unittest
-from unittest.mock import patch, MagicMock, call, mock_open
+from unittest.mock import patch, AsyncMock, MagicMock, call
 
 from libheysops.encrypt.encrypt import Encrypt
 
@@ -9,8 +11,15 @@ class MyTestCase(unittest.TestCase):
     def setUp(self) -> None:
         with patch.object(Encrypt, "__init__", lambda x, **y: None):
             self.action = Encrypt()
+        self.action.state = MagicMock()
+        self.action.state.is_current.return_value = False
 
-    def test_run1(self):
+    @patch("libheysops.encrypt.encrypt.os")
+    def test_run1(self, mock_os):
+        mock_os.path.exists.return_value = True
+        self.action.get_absolute_path = MagicMock(
+            side_effect=lambda x: "a/{}".format(x)
+        )
         self.action.find_file_in_config = MagicMock(
             return_value={
                 "encrypted_path": "test.txt.sops",
@@ -18,7 +27,7 @@ class MyTestCase(unittest.TestCase):
                 "type": None,
             }
         )
-        self.action.encrypt_file = MagicMock(
+        self.action.encrypt_file_async = AsyncMock(
             return_value={
                 "decrypted_path": "test.txt",
                 "encrypted_path": "test.txt.sops",
@@ -30,7 +39,7 @@ class MyTestCase(unittest.TestCase):
 
         self.action.run(FILE=["test123.txt"])
         self.action.find_file_in_config.assert_called_once_with(file_path="test123.txt")
-        self.action.encrypt_file.assert_called_once_with(
+        self.action.encrypt_file_async.assert_called_once_with(
             file_entry="test123.txt",
             input_type=None,
             output_filename=None,
@@ -56,9 +65,120 @@ class MyTestCase(unittest.TestCase):
         )
         self.action.run(FILE="-")
 
-    @patch("libheysops.encrypt.encrypt.subprocess")
     @patch("libheysops.encrypt.encrypt.os")
-    def test_encrypt_file1(self, mock_os, mock_subprocess):
+    def test_run2(self, mock_os):
+        mock_os.path.exists.side_effect = lambda x: x != "a/missing.txt"
+        self.action.get_absolute_path = MagicMock(
+            side_effect=lambda x: "a/{}".format(x)
+        )
+        self.action.find_file_in_config = MagicMock(return_value={})
+        self.action.delete_file_from_config = MagicMock()
+        self.action.add_file_to_config = MagicMock()
+        self.action.add_file_to_gitignore = MagicMock()
+
+        def encrypt_file(file_entry, input_type, output_filename):
+            if file_entry == "bad.txt":
+                raise OSError("Unable to encrypt file.")
+            return {
+                "decrypted_path": file_entry,
+                "encrypted_path": file_entry + ".sops",
+                "type": None,
+            }
+
+        self.action.encrypt_file_async = AsyncMock(side_effect=encrypt_file)
+
+        with self.assertRaises(OSError) as raised:
+            self.action.run(
+                FILE=["c.txt", "bad.txt", "missing.txt", "b.txt", "a.txt"], jobs=4
+            )
+        self.assertIn("1 of 4", str(raised.exception))
+        self.assertIn("bad.txt", str(raised.exception))
+        self.action.delete_file_from_config.assert_called_once_with(
+            file_to_remove="missing.txt"
+        )
+        self.assertEqual(4, self.action.encrypt_file_async.call_count)
+        # Updates are applied in the requested order, after all files are encrypted
+        self.assertListEqual(
+            ["c.txt", "b.txt", "a.txt"],
+            [
+                c[0][0]["decrypted_path"]
+                for c in self.action.add_file_to_config.call_args_list
+            ],
+        )
+        self.assertListEqual(
+            ["c.txt", "b.txt", "a.txt"],
+            [
+                c[0][0]["decrypted_path"]
+                for c in self.action.add_file_to_gitignore.call_args_list
+            ],
+        )
+
+    @patch("libheysops.encrypt.encrypt.os")
+    def test_run3(self, mock_os):
+        mock_os.path.exists.return_value = True
+        self.action.get_absolute_path = MagicMock(
+            side_effect=lambda x: "a/{}".format(x)
+        )
+        self.action.find_file_in_config = MagicMock(
+            side_effect=lambda file_path: {
+                "decrypted_path": file_path,
+                "encrypted_path": file_path + ".sops",
+                "type": None,
+            }
+        )
+        self.action.is_encryption_current = MagicMock(
+            side_effect=lambda entry, *_: entry["decrypted_path"] == "same.txt"
+        )
+        self.action.encrypt_file_async = AsyncMock(
+            side_effect=lambda file_entry, **_: {
+                "decrypted_path": file_entry,
+                "encrypted_path": file_entry + ".sops",
+                "type": None,
+            }
+        )
+        self.action.add_file_to_config = MagicMock()
+        self.action.add_file_to_gitignore = MagicMock()
+
+        self.action.run(FILE=["same.txt", "changed.txt"])
+        self.action.encrypt_file_async.assert_called_once_with(
+            file_entry="changed.txt", input_type=None, output_filename=None
+        )
+        self.action.add_file_to_config.assert_called_once()
+
+        # Forcing encrypts every file
+        self.action.force = True
+        self.action.encrypt_file_async.reset_mock()
+        self.action.run(FILE=["same.txt", "changed.txt"])
+        self.assertEqual(2, self.action.encrypt_file_async.call_count)
+
+    def test_is_encryption_current(self):
+        entry = {
+            "decrypted_path": "test.txt",
+            "encrypted_path": "test.txt.sops",
+            "type": "json",
+        }
+        self.action.get_absolute_path = MagicMock(
+            side_effect=lambda x: "a/{}".format(x)
+        )
+        self.action.state.is_current.return_value = True
+        self.assertTrue(self.action.is_encryption_current(entry))
+        self.assertTrue(self.action.is_encryption_current(entry, "json"))
+        self.action.state.is_current.assert_has_calls(
+            calls=[
+                call("test.txt", "plaintext", "a/test.txt"),
+                call("test.txt", "ciphertext", "a/test.txt.sops"),
+            ]
+        )
+        self.assertFalse(self.action.is_encryption_current({}))
+        self.assertFalse(self.action.is_encryption_current(entry, "yaml"))
+        self.assertFalse(self.action.is_encryption_current(entry, None, "other.sops"))
+
+        self.action.state.is_current.side_effect = [True, False]
+        self.assertFalse(self.action.is_encryption_current(entry))
+
+    @patch("libheysops.encrypt.encrypt.run_sops")
+    @patch("libheysops.encrypt.encrypt.os")
+    def test_encrypt_file1(self, mock_os, mock_run_sops):
         self.action.find_file_in_config = MagicMock(
             return_value={
                 "encrypted_path": "test.txt.sops",
@@ -72,35 +192,27 @@ class MyTestCase(unittest.TestCase):
         self.action.sops = "sops"
         self.action.force = False
         mock_os.path.exists.return_value = True
-        mock_run = MagicMock()
-        mock_run.stderr = b""
-        mock_run.stdout = b"data"
-        mock_subprocess.run.return_value = mock_run
-        with patch("libheysops.encrypt.encrypt.open", mock_open()) as m:
+        mock_run_sops.return_value = subprocess.CompletedProcess([], 0, b"data", b"")
+        with patch("libheysops.base.atomic_output") as m:
             self.action.encrypt_file(
                 file_entry="test.txt", input_type=None, output_filename="test.txt.sops"
             )
-            mock_subprocess.assert_has_calls(
-                calls=[
-                    call.run(
-                        ["sops", "-e", "a/test.txt"],
-                        stdout=mock_subprocess.PIPE,
-                        stderr=mock_subprocess.PIPE,
-                    )
-                ]
+            mock_run_sops.assert_called_once_with(
+                ["sops", "-e", "a/test.txt"],
+                timeout=None,
+                stdout=m.return_value.__enter__.return_value,
+                retries=0,
+                hedge=False,
             )
-            m.assert_has_calls(
-                calls=[
-                    call("a/test.txt.sops", "wb"),
-                    call().__enter__(),
-                    call().write(b"data"),
-                    call().__exit__(None, None, None),
-                ]
+            self.action.state.snapshot.assert_has_calls(
+                calls=[call("a/test.txt"), call("a/test.txt.sops")]
             )
+            self.assertEqual(2, self.action.state.record.call_count)
+            m.assert_called_once_with("a/test.txt.sops", "output write", "batch")
 
-    @patch("libheysops.encrypt.encrypt.subprocess")
+    @patch("libheysops.encrypt.encrypt.run_sops")
     @patch("libheysops.encrypt.encrypt.os")
-    def test_encrypt_file2(self, mock_os, mock_subprocess):
+    def test_encrypt_file2(self, mock_os, mock_run_sops):
         self.action.find_file_in_config = MagicMock(
             return_value={
                 "encrypted_path": "test.txt.sops",
@@ -114,33 +226,21 @@ class MyTestCase(unittest.TestCase):
         self.action.sops = "sops"
         self.action.force = False
         mock_os.path.exists.return_value = True
-        mock_run = MagicMock()
-        mock_run.stderr = b"err"
-        mock_run.stdout = b"data"
-        mock_subprocess.run.return_value = mock_run
-        with patch("libheysops.encrypt.encrypt.open", mock_open()) as m:
+        mock_run_sops.return_value = subprocess.CompletedProcess([], 0, b"data", b"err")
+        with patch("libheysops.base.atomic_output") as m:
             self.action.encrypt_file(file_entry="test.txt", input_type="binary")
-            mock_subprocess.assert_has_calls(
-                calls=[
-                    call.run(
-                        ["sops", "--input-type", "binary", "-e", "a/test.txt"],
-                        stdout=mock_subprocess.PIPE,
-                        stderr=mock_subprocess.PIPE,
-                    )
-                ]
-            )
-            m.assert_has_calls(
-                calls=[
-                    call("a/test.txt.sops", "wb"),
-                    call().__enter__(),
-                    call().write(b"data"),
-                    call().__exit__(None, None, None),
-                ]
+            mock_run_sops.assert_called_once_with(
+                ["sops", "--input-type", "binary", "-e", "a/test.txt"],
+                timeout=None,
+                stdout=m.return_value.__enter__.return_value,
+                retries=0,
+                hedge=False,
             )
+            m.assert_called_once_with("a/test.txt.sops", "output write", "batch")
 
-    @patch("libheysops.encrypt.encrypt.subprocess")
+    @patch("libheysops.encrypt.encrypt.run_sops")
     @patch("libheysops.encrypt.encrypt.os")
-    def test_decrypt_file3(self, mock_os, mock_subprocess):
+    def test_decrypt_file3(self, mock_os, mock_run_sops):
         self.action.find_file_in_config = MagicMock(return_value={})
         self.action.get_absolute_path = MagicMock(
             side_effect=lambda x: "a/{}".format(x)
@@ -148,29 +248,17 @@ class MyTestCase(unittest.TestCase):
         self.action.sops = "sops"
         self.action.force = False
         mock_os.path.exists.return_value = True
-        mock_run = MagicMock()
-        mock_run.stderr = b"err"
-        mock_run.stdout = b"data"
-        mock_subprocess.run.return_value = mock_run
-        with patch("libheysops.encrypt.encrypt.open", mock_open()) as m:
+        mock_run_sops.return_value = subprocess.CompletedProcess([], 0, b"data", b"err")
+        with patch("libheysops.base.atomic_output") as m:
             self.action.encrypt_file(file_entry="test.txt", input_type="binary")
-            mock_subprocess.assert_has_calls(
-                calls=[
-                    call.run(
-                        ["sops", "--input-type", "binary", "-e", "a/test.txt"],
-                        stdout=mock_subprocess.PIPE,
-                        stderr=mock_subprocess.PIPE,
-                    )
-                ]
-            )
-            m.assert_has_calls(
-                calls=[
-                    call("a/test.txt.sops", "wb"),
-                    call().__enter__(),
-                    call().write(b"data"),
-                    call().__exit__(None, None, None),
-                ]
+            mock_run_sops.assert_called_once_with(
+                ["sops", "--input-type", "binary", "-e", "a/test.txt"],
+                timeout=None,
+                stdout=m.return_value.__enter__.return_value,
+                retries=0,
+                hedge=False,
             )
+            m.assert_called_once_with("a/test.txt.sops", "output write", "batch")
 
     def test_decrypt_file4(self):
         self.action.find_file_in_config = MagicMock(return_value={})
@@ -182,97 +270,194 @@ class MyTestCase(unittest.TestCase):
         self.action.delete_file_from_config = MagicMock()
         self.action.encrypt_file(file_entry="test.txt", input_type="binary")
         self.action.delete_file_from_config.assert_called_once_with(
-            file_to_remove="a/test.txt"
+            file_to_remove="test.txt"
         )
 
+    @patch.dict("libheysops.base._found_in_parents", clear=True)
     def test_find_gitignore_files(self):
-        self.action._check_folder_for_file = MagicMock(
-            side_effect=[False, True]
-        )
-        actual = self.action.find_gitignore_file()
-        self.assertEqual(
-            os.path.abspath(os.path.join(os.curdir, "../.gitignore")), actual
-        )
+        # Searched from the folder of the configuration, rather than the current directory
+        config_folder = os.path.abspath(os.path.join("a", "b"))
+        self.action.config_path = os.path.join(config_folder, ".heysops.yaml")
+        with patch.object(
+            Encrypt,
+            "_find_file_in_folder",
+            side_effect=lambda folder, filenames: (
+                None if folder == config_folder else os.path.join(folder, filenames[0])
+            ),
+        ) as mock_find:
+            actual = self.action.find_gitignore_file()
+        self.assertEqual(config_folder, mock_find.call_args_list[0].args[0])
+        self.assertEqual(os.path.abspath(os.path.join("a", ".gitignore")), actual)
 
+    @patch.dict("libheysops.base._found_in_parents", clear=True)
+    def test_find_gitignore_files_missing(self):
+        self.action.config_path = ".heysops.yaml"
         # Cause the search to go to the root of the drive
-        self.action._check_folder_for_file = MagicMock(return_value=False)
-        self.assertRaises(FileNotFoundError, self.action.find_gitignore_file)
+        with patch.object(Encrypt, "_find_file_in_folder", return_value=None):
+            self.assertRaises(FileNotFoundError, self.action.find_gitignore_file)
 
     def test_add_file_to_gitignore1(self):
-        sample_content = ["testfile.txt", "# Commented entry", "", "Skip a line"]
-        sample_gitignore = os.linesep.join(sample_content)
-        expected_content = sample_content
-        expected_content.append("test.txt")
-        with patch(
-            "libheysops.encrypt.encrypt.open", mock_open(read_data=sample_gitignore)
-        ) as m:
-            self.action.config = {}
-            self.action.find_gitignore_file = MagicMock(
-                return_value="not_a_real_filename.txt"
-            )
-            self.action.flush_config = MagicMock()
-            self.action.add_file_to_gitignore(
-                {
-                    "decrypted_path": "test.txt",
-                    "encrypted_path": "test.txt.sops",
-                    "type": None,
-                }
-            )
-            self.action.find_gitignore_file.assert_called_once()
-            self.action.flush_config.assert_called_once()
-            self.assertEqual(
-                "not_a_real_filename.txt",
-                self.action.config.get("project", {}).get("gitignore_path"),
-            )
-            m.assert_has_calls(
-                calls=[
-                    call("not_a_real_filename.txt", "r"),
-                    call().__enter__(),
-                    call().__iter__(),
-                    call().__exit__(None, None, None),
-                    call("not_a_real_filename.txt", "w"),
-                    call().__enter__(),
-                    call().writelines([x + os.linesep for x in expected_content]),
-                    call().__exit__(None, None, None),
-                ]
-            )
+        self.action.config = {}
+        self.action.config_path = os.path.join("a", "b", ".heysops.yaml")
+        self.action._gitignore_changes = None
+        self.action.find_gitignore_file = MagicMock(
+            return_value=os.path.abspath(os.path.join("a", ".gitignore"))
+        )
+        self.action.mark_config_modified = MagicMock()
+        self.action.add_file_to_gitignore(
+            {
+                "decrypted_path": "test.txt",
+                "encrypted_path": "test.txt.sops",
+                "type": None,
+            }
+        )
+        self.action.find_gitignore_file.assert_called_once()
+        self.action.mark_config_modified.assert_called_once()
+        # Stored relative to the configuration file
+        self.assertEqual(
+            os.path.join("..", ".gitignore"),
+            self.action.config.get("project", {}).get("gitignore_path"),
+        )
+        self.assertEqual([("test.txt", None)], self.action._gitignore_changes)
 
     def test_add_file_to_gitignore2(self):
-        sample_content = ["testfile.txt", "# Commented entry", "", "Skip a line"]
-        sample_gitignore = os.linesep.join(sample_content)
-        with patch(
-            "libheysops.encrypt.encrypt.open", mock_open(read_data=sample_gitignore)
-        ) as m:
-            self.action.config = {}
-            self.action.find_gitignore_file = MagicMock(
-                return_value="not_a_real_filename.txt"
-            )
-            self.action.flush_config = MagicMock()
-            self.action.add_file_to_gitignore(
-                {
-                    "decrypted_path": "testfile.txt",
-                    "encrypted_path": "testfile.txt.sops",
-                    "type": None,
-                }
-            )
-            self.action.find_gitignore_file.assert_called_once()
-            self.action.flush_config.assert_called_once()
-            self.assertEqual(
-                "not_a_real_filename.txt",
-                self.action.config.get("project", {}).get("gitignore_path"),
-            )
-            m.assert_has_calls(
-                calls=[
-                    call("not_a_real_filename.txt", "r"),
-                    call().__enter__(),
-                    call().__iter__(),
-                    call().__exit__(None, None, None),
-                    call("not_a_real_filename.txt", "w"),
-                    call().__enter__(),
-                    call().writelines([x + os.linesep for x in sample_content]),
-                    call().__exit__(None, None, None),
-                ]
-            )
+        self.action.config = {"project": {"gitignore_path": "a/.gitignore"}}
+        self.action._gitignore_changes = None
+        self.action.find_gitignore_file = MagicMock()
+        self.action.mark_config_modified = MagicMock()
+        self.action.add_file_to_gitignore(
+            {
+                "decrypted_path": "testfile.txt",
+                "encrypted_path": "testfile.txt.sops",
+                "type": None,
+            },
+            prior_decrypted_file="old.txt",
+        )
+        self.action.find_gitignore_file.assert_not_called()
+        self.action.mark_config_modified.assert_not_called()
+        self.assertEqual([("testfile.txt", "old.txt")], self.action._gitignore_changes)
+
+    def test_flush_gitignore(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            gitignore_path = os.path.join(temp_dir, ".gitignore")
+            self.action.config_path = os.path.join(temp_dir, ".heysops.yaml")
+            with open(gitignore_path, "w") as open_gitignore:
+                open_gitignore.write("testfile.txt\n# Commented entry\n\nSkip a line\n")
+            self.action.config = {"project": {"gitignore_path": gitignore_path}}
+            self.action._gitignore_changes = [
+                ("testfile.txt", None),
+                ("test.txt", None),
+                ("other.txt", None),
+            ]
+            self.action.flush_gitignore()
+            with open(gitignore_path) as open_gitignore:
+                self.assertEqual(
+                    [
+                        "testfile.txt",
+                        "# Commented entry",
+                        "",
+                        "Skip a line",
+                        "# BEGIN heysops managed entries",
+                        "test.txt",
+                        "other.txt",
+                        "# END heysops managed entries",
+                    ],
+                    open_gitignore.read().splitlines(),
+                )
+            self.assertEqual([], self.action._gitignore_changes)
+
+            # Renaming removes the prior entry from the block only
+            self.action._gitignore_changes = [
+                ("renamed.txt", "test.txt"),
+                ("testfile2.txt", "testfile.txt"),
+            ]
+            self.action.flush_gitignore()
+            with open(gitignore_path) as open_gitignore:
+                self.assertEqual(
+                    [
+                        "testfile.txt",
+                        "# Commented entry",
+                        "",
+                        "Skip a line",
+                        "# BEGIN heysops managed entries",
+                        "other.txt",
+                        "renamed.txt",
+                        "testfile2.txt",
+                        "# END heysops managed entries",
+                    ],
+                    open_gitignore.read().splitlines(),
+                )
+
+    def test_flush_gitignore_outside_block(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            gitignore_path = os.path.join(temp_dir, ".gitignore")
+            self.action.config_path = os.path.join(temp_dir, ".heysops.yaml")
+            with open(gitignore_path, "w") as open_gitignore:
+                open_gitignore.write("*.log\nold.txt\ntracked.txt\n")
+            # As written by earlier versions, without a block
+            self.action.config = {
+                "project": {"gitignore_path": gitignore_path},
+                "secrets": [
+                    {
+                        "decrypted_path": "tracked.txt",
+                        "encrypted_path": "tracked.txt.sops",
+                    },
+                    {"decrypted_path": "new.txt", "encrypted_path": "new.txt.sops"},
+                ],
+            }
+            self.action._gitignore_changes = [("new.txt", "old.txt")]
+            self.action.flush_gitignore()
+            with open(gitignore_path) as open_gitignore:
+                self.assertEqual(
+                    [
+                        "*.log",
+                        "old.txt",
+                        "tracked.txt",
+                        "# BEGIN heysops managed entries",
+                        "new.txt",
+                        "# END heysops managed entries",
+                    ],
+                    open_gitignore.read().splitlines(),
+                )
+
+    def test_flush_gitignore_parent(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            gitignore_path = os.path.join(temp_dir, ".gitignore")
+            self.action.config_path = os.path.join(temp_dir, "svc", ".heysops.yaml")
+            self.action.config = {"project": {"gitignore_path": "../.gitignore"}}
+            self.action._gitignore_changes = [
+                ("x/s.json", None),
+                ("renamed.txt", "old.txt"),
+            ]
+            self.action.flush_gitignore()
+            # Entries are relative to the folder of the .gitignore file
+            with open(gitignore_path) as open_gitignore:
+                self.assertEqual(
+                    [
+                        "# BEGIN heysops managed entries",
+                        "svc/x/s.json",
+                        "svc/renamed.txt",
+                        "# END heysops managed entries",
+                    ],
+                    open_gitignore.read().splitlines(),
+                )
+
+    @patch("libheysops.encrypt.encrypt.write_file_atomic")
+    def test_flush_gitignore_unchanged(self, mock_write):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            gitignore_path = os.path.join(temp_dir, ".gitignore")
+            self.action.config_path = os.path.join(temp_dir, ".heysops.yaml")
+            with open(gitignore_path, "w") as open_gitignore:
+                open_gitignore.write("test.txt\n")
+            self.action.config = {"project": {"gitignore_path": gitignore_path}}
+            self.action._gitignore_changes = [("test.txt", None)]
+            self.action.flush_gitignore()
+            mock_write.assert_not_called()
+
+            # Nothing queued, so the file is not read either
+            self.action._gitignore_changes = None
+            self.action.flush_gitignore()
+            mock_write.assert_not_called()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,324 @@
+import asyncio
+import collections
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from libheysops import engine, stats
+from libheysops.cache import load_cache_file
+from libheysops.engine import (
+    gather_bounded,
+    get_hedge_delay,
+    get_retry_delay,
+    is_transient_failure,
+    probe_sops,
+    run_sops,
+    run_sync,
+)
+
+FAKE_SOPS = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "fixtures", "fake_sops.py"
+)
+
+
+class TestEngine(unittest.TestCase):
+    def test_run_sops1(self):
+        actual = run_sync(
+            run_sops(
+                [
+                    sys.executable,
+                    "-c",
+                    "import sys; sys.stdout.write('out'); sys.stderr.write('err')",
+                ]
+            )
+        )
+        self.assertEqual(0, actual.returncode)
+        self.assertEqual(b"out", actual.stdout)
+        self.assertEqual(b"err", actual.stderr)
+
+    def test_run_sops_stdout(self):
+        with tempfile.TemporaryFile() as open_file:
+            actual = run_sync(
+                run_sops(
+                    [sys.executable, "-c", "import sys; sys.stdout.write('out')"],
+                    stdout=open_file,
+                )
+            )
+            self.assertIsNone(actual.stdout)
+            open_file.seek(0)
+            self.assertEqual(b"out", open_file.read())
+
+    def test_run_sops2(self):
+        actual = run_sync(run_sops([sys.executable, "-c", "import sys; sys.exit(3)"]))
+        self.assertRaises(subprocess.CalledProcessError, actual.check_returncode)
+
+    def test_run_sops_timeout(self):
+        with self.assertRaises(subprocess.TimeoutExpired) as raised:
+            run_sync(
+                run_sops(
+                    [sys.executable, "-c", "import time; time.sleep(30)"], timeout=0.5
+                )
+            )
+        self.assertEqual(0.5, raised.exception.timeout)
+
+    @unittest.skipIf(os.name == "nt", "The fake sops executable requires a POSIX shell")
+    def test_probe_sops(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        sops = os.path.join(folder, "sops")
+        shutil.copy(FAKE_SOPS, sops)
+
+        with patch.dict(os.environ, {"HEYSOPS_CACHE_DIR": folder}):
+            self.assertEqual("3.7.1", run_sync(probe_sops(sops)))
+            cached = load_cache_file(engine.SOPS_CACHE_FILE)
+            self.assertEqual("3.7.1", cached[os.path.realpath(sops)]["version"])
+
+            # The cached version is used while the binary is unchanged
+            with patch.object(engine, "_run_sops_once") as mock_run_sops:
+                self.assertEqual("3.7.1", run_sync(probe_sops(sops)))
+                mock_run_sops.assert_not_called()
+
+            # Replacing the binary probes it again
+            with open(sops, "r") as open_sops:
+                content = open_sops.read().replace(
+                    'VERSION = "sops 3.7.1 (latest)"', 'VERSION = "sops 3.8.0"'
+                )
+            with open(sops, "w") as open_sops:
+                open_sops.write(content)
+            # The probe is not reported as one of the sops invocations
+            stats.enable()
+            self.addCleanup(stats.disable)
+            self.assertEqual("3.8.0", run_sync(probe_sops(sops)))
+            self.assertListEqual([], stats.get_report()["sops_calls"])
+            self.assertListEqual([], stats.get_report()["phases"])
+
+            self.assertRaises(
+                FileNotFoundError,
+                run_sync,
+                probe_sops(os.path.join(folder, "missing")),
+            )
+
+    def test_gather_bounded(self):
+        in_flight = []
+        peak = []
+
+        async def func(item):
+            in_flight.append(item)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(item)
+            if item % 3 == 0:
+                raise OSError(item)
+            return item * 2
+
+        actual = run_sync(gather_bounded(func, range(1, 8), jobs=2))
+        self.assertEqual(2, max(peak))
+        self.assertListEqual([1, 2, 3, 4, 5, 6, 7], [item for item, _, _ in actual])
+        self.assertListEqual(
+            [2, 4, None, 8, 10, None, 14], [result for _, result, _ in actual]
+        )
+        self.assertListEqual(
+            [3, 6], [error.args[0] for _, _, error in actual if error is not None]
+        )
+
+    def test_gather_bounded_semaphore(self):
+        in_flight = []
+        peak = []
+
+        async def func(item):
+            in_flight.append(item)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(item)
+
+        async def gather_twice():
+            # Both calls share the limit of the semaphore, rather than each using jobs
+            semaphore = asyncio.Semaphore(3)
+            await asyncio.gather(
+                gather_bounded(func, range(0, 5), jobs=5, semaphore=semaphore),
+                gather_bounded(func, range(5, 10), jobs=5, semaphore=semaphore),
+            )
+
+        run_sync(gather_twice())
+        self.assertEqual(3, max(peak))
+
+    def test_gather_bounded_cancels(self):
+        finished = []
+
+        async def func(item):
+            if item == 0:
+                raise ValueError(item)
+            await asyncio.sleep(0.5)
+            finished.append(item)
+
+        async def gather_then_wait():
+            with self.assertRaises(ValueError):
+                await gather_bounded(func, range(3), jobs=3)
+            await asyncio.sleep(1)
+
+        run_sync(gather_then_wait())
+        # The calls in flight were cancelled, rather than left running
+        self.assertListEqual([], finished)
+
+    def test_gather_bounded_other_errors(self):
+        async def func(item):
+            return int(item)
+
+        self.assertRaises(
+            ValueError, run_sync, gather_bounded(func, ["1", "a"], jobs=2)
+        )
+
+    def test_run_sync_in_running_loop(self):
+        async def inner():
+            return 42
+
+        async def outer():
+            return run_sync(inner())
+
+        self.assertEqual(42, asyncio.run(outer()))
+
+    def test_is_transient_failure(self):
+        self.assertTrue(
+            is_transient_failure(128, b"ThrottlingException: Rate exceeded")
+        )
+        self.assertTrue(is_transient_failure(128, b"503 Service Unavailable"))
+        self.assertTrue(is_transient_failure(128, b"read: connection reset by peer"))
+        self.assertFalse(is_transient_failure(128, b"AccessDeniedException"))
+        self.assertFalse(
+            is_transient_failure(128, b"Rate exceeded. AccessDeniedException")
+        )
+        self.assertFalse(is_transient_failure(51, b"timeout"))
+        self.assertFalse(is_transient_failure(128, b"fake sops failure"))
+
+    def test_get_retry_delay(self):
+        with patch.object(engine, "RETRY_BASE_DELAY", 1.0), patch.object(
+            engine, "RETRY_MAX_DELAY", 3.0
+        ):
+            for attempt, upper in [(1, 1.0), (2, 2.0), (3, 3.0), (10, 3.0)]:
+                with self.subTest(attempt=attempt):
+                    for _ in range(20):
+                        self.assertTrue(0 <= get_retry_delay(attempt) <= upper)
+
+    def test_get_hedge_delay(self):
+        with patch.object(engine, "_latencies", collections.deque([0.1] * 19)):
+            self.assertIsNone(get_hedge_delay())
+            engine._latencies.extend([0.1, 2.0])
+            self.assertEqual(0.1, get_hedge_delay())
+
+
+@unittest.skipIf(os.name == "nt", "The fake sops executable requires a POSIX shell")
+class TestRunSopsRetries(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.plaintext = os.path.join(self.folder, "test.txt")
+        with open(self.plaintext, "wb") as open_file:
+            open_file.write(b"secret")
+        self.counter = os.path.join(self.folder, "counter")
+        for patcher in [
+            patch.object(engine, "RETRY_BASE_DELAY", 0.01),
+            patch.object(engine, "_latencies", collections.deque(maxlen=1000)),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_calls(self) -> int:
+        return os.path.getsize(self.counter) if os.path.exists(self.counter) else 0
+
+    def run_fake_sops(self, environ: dict, **kwargs):
+        environ = dict(environ, FAKE_SOPS_COUNTER=self.counter)
+        with patch.dict(os.environ, environ):
+            return run_sync(
+                run_sops([sys.executable, FAKE_SOPS, "-e", self.plaintext], **kwargs)
+            )
+
+    def test_transient_failure(self):
+        environ = {
+            "FAKE_SOPS_FAIL": "128",
+            "FAKE_SOPS_FAIL_CALLS": "2",
+            "FAKE_SOPS_STDERR": "ThrottlingException: Rate exceeded",
+        }
+        with self.assertLogs(level="WARNING") as logs:
+            actual = self.run_fake_sops(environ, retries=2)
+        self.assertEqual(0, actual.returncode)
+        self.assertTrue(actual.stdout.endswith(b"secret"))
+        self.assertEqual(3, self.get_calls())
+        self.assertEqual(2, len(logs.records))
+
+        # Not retried once the retries are used up
+        os.remove(self.counter)
+        with self.assertLogs(level="WARNING"):
+            actual = self.run_fake_sops(environ, retries=1)
+        self.assertEqual(128, actual.returncode)
+        self.assertEqual(2, self.get_calls())
+
+    def test_permanent_failure(self):
+        environ = {
+            "FAKE_SOPS_FAIL": "128",
+            "FAKE_SOPS_STDERR": "AccessDeniedException: not authorized",
+        }
+        actual = self.run_fake_sops(environ, retries=3)
+        self.assertEqual(128, actual.returncode)
+        self.assertEqual(1, self.get_calls())
+
+    def test_timeout(self):
+        environ = {"FAKE_SOPS_DELAY": "30", "FAKE_SOPS_DELAY_CALLS": "1"}
+        with tempfile.TemporaryFile() as open_file, self.assertLogs(level="WARNING"):
+            # The partial output of the attempt that timed out is discarded
+            open_file.write(b"partial")
+            actual = self.run_fake_sops(environ, timeout=1, stdout=open_file, retries=1)
+            open_file.seek(0)
+            content = open_file.read()
+        self.assertEqual(0, actual.returncode)
+        self.assertEqual(b"FAKE-SOPS-ENCRYPTED\nsecret", content)
+        self.assertEqual(2, self.get_calls())
+
+        os.remove(self.counter)
+        self.assertRaises(
+            subprocess.TimeoutExpired,
+            self.run_fake_sops,
+            environ,
+            timeout=0.5,
+            retries=0,
+        )
+
+    def test_hedge(self):
+        engine._latencies.extend([0.05] * engine.HEDGE_MIN_SAMPLES)
+        environ = {"FAKE_SOPS_DELAY": "30", "FAKE_SOPS_DELAY_CALLS": "1"}
+        output_path = os.path.join(self.folder, "test.txt.sops")
+        start = time.monotonic()
+        with patch(
+            "libheysops.engine.tempfile.TemporaryFile",
+            side_effect=tempfile.TemporaryFile,
+        ) as mock_temporary_file, open(output_path, "w+b") as open_file:
+            actual = self.run_fake_sops(environ, stdout=open_file, hedge=True)
+            self.assertEqual(len(b"FAKE-SOPS-ENCRYPTED\nsecret"), open_file.tell())
+        self.assertLess(time.monotonic() - start, 15)
+        self.assertEqual(0, actual.returncode)
+        # The duplicate wrote to a file next to the output rather than to memory, and it is gone
+        self.assertIsNone(actual.stdout)
+        mock_temporary_file.assert_called_once_with(dir=self.folder)
+        with open(output_path, "rb") as open_file:
+            self.assertEqual(b"FAKE-SOPS-ENCRYPTED\nsecret", open_file.read())
+        self.assertListEqual(
+            ["counter", "test.txt", "test.txt.sops"], sorted(os.listdir(self.folder))
+        )
+        self.assertEqual(2, self.get_calls())
+
+        # Without hedging the slow call is waited for
+        os.remove(self.counter)
+        self.assertRaises(
+            subprocess.TimeoutExpired,
+            self.run_fake_sops,
+            environ,
+            timeout=1,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
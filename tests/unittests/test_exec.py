@@ -0,0 +1,181 @@
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from libheysops.base import CONFIG_TEMPLATE
+from libheysops.exec.exec import Exec
+from libheysops.secrets_table import SecretsTable
+
+FAKE_SOPS = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "fixtures", "fake_sops.py"
+)
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        with patch.object(Exec, "__init__", lambda x, **y: None):
+            self.action = Exec()
+        self.action.config = {
+            "secrets": [
+                {"decrypted_path": ".env", "encrypted_path": ".env.sops", "type": None},
+                {
+                    "decrypted_path": "db.json",
+                    "encrypted_path": "db.json.sops",
+                    "type": None,
+                },
+                {
+                    "decrypted_path": "cert.pem",
+                    "encrypted_path": "cert.pem.sops",
+                    "type": None,
+                },
+                {
+                    "decrypted_path": "settings.conf",
+                    "encrypted_path": "settings.conf.sops",
+                    "type": "yaml",
+                },
+            ]
+        }
+
+    def test_select_secrets(self):
+        actual = self.action.select_secrets()
+        self.assertListEqual(
+            [".env", "db.json", "settings.conf"],
+            [x["decrypted_path"] for x in actual],
+        )
+
+        actual = self.action.select_secrets(["db.json.sops"])
+        self.assertListEqual(["db.json"], [x["decrypted_path"] for x in actual])
+
+        self.assertRaises(ValueError, self.action.select_secrets, ["cert.pem"])
+        self.assertRaises(ValueError, self.action.select_secrets, ["missing.json"])
+
+    def test_decrypt_secrets(self):
+        self.action.decrypt_to_memory_async = AsyncMock(return_value=b"{}")
+        actual = asyncio.run(
+            self.action.decrypt_secrets(self.action.select_secrets(), jobs=2)
+        )
+        self.assertEqual(3, len(actual))
+        self.action.decrypt_to_memory_async.assert_any_call(
+            file_entry="settings.conf.sops", input_type="yaml", output_type="json"
+        )
+
+        self.action.decrypt_to_memory_async = AsyncMock(
+            side_effect=[b"A=1", OSError("bad"), b"a: 1"]
+        )
+        with self.assertRaises(OSError) as raised:
+            asyncio.run(
+                self.action.decrypt_secrets(
+                    self.action.select_secrets(), keep_format=True
+                )
+            )
+        self.assertIn("1 of 3", str(raised.exception))
+        self.action.decrypt_to_memory_async.assert_any_call(
+            file_entry=".env.sops", input_type="dotenv", output_type="dotenv"
+        )
+
+    def test_build_environment(self):
+        actual = Exec.build_environment(
+            [
+                ({"decrypted_path": ".env"}, b'{"USER": "admin", "PORT": "5432"}'),
+                (
+                    {"decrypted_path": "db.json"},
+                    b'{"PORT": 6543, "tls": true, "hosts": ["a", "b"]}',
+                ),
+            ]
+        )
+        self.assertDictEqual(
+            {
+                "USER": "admin",
+                "PORT": "6543",
+                "tls": "true",
+                "hosts": '["a", "b"]',
+            },
+            actual,
+        )
+        self.assertRaises(
+            ValueError, Exec.build_environment, [({"decrypted_path": "a"}, b"[1]")]
+        )
+
+    def test_get_fd_variable(self):
+        self.assertEqual(
+            "HEYSOPS_FD_CONFIG_DB_JSON", Exec.get_fd_variable("config/db.json")
+        )
+        self.assertEqual("HEYSOPS_FD__ENV", Exec.get_fd_variable(".env"))
+
+    def test_run(self):
+        self.assertRaises(ValueError, self.action.run, COMMAND=["--"])
+
+        self.action.select_secrets = MagicMock(return_value=[{}])
+        self.action.decrypt_secrets = AsyncMock(return_value=[({}, b"{}")])
+        self.action.run_with_environment = MagicMock(return_value=3)
+        self.action.run_with_fds = MagicMock(return_value=4)
+        self.action.run(COMMAND=["--", "env"], secret=["db.json"])
+        self.action.select_secrets.assert_called_once_with(["db.json"])
+        self.action.run_with_environment.assert_called_once_with(["env"], [({}, b"{}")])
+        self.assertEqual(3, self.action.returncode)
+
+        self.action.run(COMMAND=["env"], fd=True)
+        self.action.run_with_fds.assert_called_once_with(["env"], [({}, b"{}")])
+        self.assertEqual(4, self.action.returncode)
+
+
+@unittest.skipIf(os.name == "nt", "The fake sops executable requires a POSIX shell")
+class TestExecFakeSops(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.config_path = os.path.join(self.folder, ".heysops.yaml")
+        with open(self.config_path, "w") as open_config:
+            open_config.write(
+                CONFIG_TEMPLATE
+                + "- decrypted_path: db.json\n  encrypted_path: db.json.sops\n  type: json\n"
+            )
+        with open(os.path.join(self.folder, "db.json.sops"), "wb") as open_file:
+            open_file.write(b'FAKE-SOPS-ENCRYPTED\n{"DB_PASSWORD": "hunter2"}')
+        environ = patch.dict(
+            os.environ,
+            {
+                "SOPS_PATH": FAKE_SOPS,
+                "HEYSOPS_CACHE_DIR": tempfile.mkdtemp(),
+            },
+        )
+        environ.start()
+        self.addCleanup(shutil.rmtree, os.environ["HEYSOPS_CACHE_DIR"])
+        self.addCleanup(environ.stop)
+
+    def run_exec(self, script: str, **kwargs) -> str:
+        output_path = os.path.join(self.folder, "output.txt")
+        action = Exec(config=self.config_path)
+        action.start(
+            COMMAND=["--", sys.executable, "-c", script, output_path], **kwargs
+        )
+        self.assertEqual(0, action.returncode)
+        with open(output_path) as open_output:
+            return open_output.read()
+
+    def test_exec_environment(self):
+        before = sorted(os.listdir(self.folder))
+        actual = self.run_exec(
+            "import os, sys; open(sys.argv[1], 'w').write(os.environ['DB_PASSWORD'])"
+        )
+        self.assertEqual("hunter2", actual)
+        # Nothing was decrypted to disk
+        self.assertListEqual(before + ["output.txt"], sorted(os.listdir(self.folder)))
+
+    def test_exec_fd(self):
+        actual = self.run_exec(
+            "import json, os, sys; "
+            "data = os.fdopen(int(os.environ['HEYSOPS_FD_DB_JSON'])).read(); "
+            "open(sys.argv[1], 'w').write(json.loads(data)['DB_PASSWORD'])",
+            fd=True,
+        )
+        self.assertEqual("hunter2", actual)
+
+
+if __name__ == "__main__":
+    unittest.main()
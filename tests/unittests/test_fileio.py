@@ -0,0 +1,173 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from libheysops.fileio import (
+    DURABILITY_BATCH,
+    DURABILITY_NONE,
+    DURABILITY_STRICT,
+    StagedOutputs,
+    atomic_output,
+    write_file_atomic,
+)
+
+
+class TestWriteFileAtomic(unittest.TestCase):
+    @unittest.skipIf(os.name == "nt", "POSIX permissions")
+    def test_write_file_atomic(self):
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, "secret.txt")
+            write_file_atomic(file_path, b"first")
+            self.assertEqual(0o600, os.stat(file_path).st_mode & 0o777)
+            os.chmod(file_path, 0o640)
+
+            write_file_atomic(file_path, b"second")
+            with open(file_path, "rb") as open_file:
+                self.assertEqual(b"second", open_file.read())
+            self.assertEqual(0o640, os.stat(file_path).st_mode & 0o777)
+            self.assertListEqual(["secret.txt"], os.listdir(folder))
+
+    def test_write_file_atomic_failure(self):
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, "secret.txt")
+            write_file_atomic(file_path, b"first")
+            self.assertRaises(TypeError, write_file_atomic, file_path, "not bytes")
+            with open(file_path, "rb") as open_file:
+                self.assertEqual(b"first", open_file.read())
+            self.assertListEqual(["secret.txt"], os.listdir(folder))
+
+
+class TestAtomicOutput(unittest.TestCase):
+    def test_atomic_output(self):
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, "secret.txt")
+            write_file_atomic(file_path, b"first")
+            with atomic_output(file_path) as open_temp_file:
+                open_temp_file.write(b"second")
+                self.assertEqual(folder, os.path.dirname(open_temp_file.name))
+                # Nothing is visible at the destination until the block exits
+                with open(file_path, "rb") as open_file:
+                    self.assertEqual(b"first", open_file.read())
+            with open(file_path, "rb") as open_file:
+                self.assertEqual(b"second", open_file.read())
+            self.assertListEqual(["secret.txt"], os.listdir(folder))
+
+    def test_atomic_output_failure(self):
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, "secret.txt")
+            write_file_atomic(file_path, b"first")
+            with self.assertRaises(OSError):
+                with atomic_output(file_path) as open_temp_file:
+                    open_temp_file.write(b"partial")
+                    raise OSError("sops failed")
+            with open(file_path, "rb") as open_file:
+                self.assertEqual(b"first", open_file.read())
+            self.assertListEqual(["secret.txt"], os.listdir(folder))
+
+    def test_atomic_output_durability(self):
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, "secret.txt")
+            for durability, expected in [(DURABILITY_NONE, 0), (DURABILITY_STRICT, 2)]:
+                with patch("libheysops.fileio.os.fsync") as mock_fsync:
+                    with atomic_output(file_path, durability=durability) as open_file:
+                        open_file.write(b"data")
+                self.assertEqual(expected, mock_fsync.call_count)
+
+
+class TestStagedOutputs(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.folder = temp_dir.name
+        self.addCleanup(temp_dir.cleanup)
+        os.makedirs(os.path.join(self.folder, "sub"))
+        self.paths = [
+            os.path.join(self.folder, "a.txt"),
+            os.path.join(self.folder, "b.txt"),
+            os.path.join(self.folder, "sub", "c.txt"),
+        ]
+        write_file_atomic(self.paths[0], b"old")
+
+    def read(self, file_path: str) -> bytes:
+        with open(file_path, "rb") as open_file:
+            return open_file.read()
+
+    def stage(self, staged: StagedOutputs, committed: list) -> None:
+        for file_path in self.paths:
+            with staged.open(
+                file_path, on_commit=lambda x=file_path: committed.append(x)
+            ) as open_file:
+                open_file.write(b"new")
+        with self.assertRaises(OSError):
+            with staged.open(os.path.join(self.folder, "failed.txt")) as open_file:
+                raise OSError("sops failed")
+
+    def test_commit(self):
+        staged = StagedOutputs(DURABILITY_BATCH)
+        committed = []
+        self.stage(staged, committed)
+        self.assertEqual(3, len(staged))
+        # Nothing is visible at the destinations until the batch is committed
+        self.assertEqual(b"old", self.read(self.paths[0]))
+        self.assertFalse(os.path.exists(self.paths[1]))
+        self.assertListEqual([], committed)
+
+        with patch("libheysops.fileio.os.fsync") as mock_fsync:
+            self.assertEqual({}, staged.commit())
+        # One flush per file, then one per folder
+        self.assertEqual(5, mock_fsync.call_count)
+        self.assertListEqual(self.paths, committed)
+        for file_path in self.paths:
+            self.assertEqual(b"new", self.read(file_path))
+        self.assertListEqual(["a.txt", "b.txt", "sub"], sorted(os.listdir(self.folder)))
+        self.assertEqual(0, len(staged))
+
+    def test_commit_without_fsync(self):
+        staged = StagedOutputs(DURABILITY_NONE)
+        self.stage(staged, [])
+        with patch("libheysops.fileio.os.fsync") as mock_fsync:
+            self.assertEqual({}, staged.commit())
+        mock_fsync.assert_not_called()
+        self.assertEqual(b"new", self.read(self.paths[2]))
+
+    def test_commit_failure(self):
+        staged = StagedOutputs(DURABILITY_BATCH)
+        committed = []
+        self.stage(staged, committed)
+        # The staged file of c.txt can no longer be flushed, and b.txt can not be replaced
+        shutil.rmtree(os.path.join(self.folder, "sub"))
+        os.mkdir(self.paths[1])
+
+        errors = staged.commit()
+        self.assertListEqual(sorted(self.paths[1:]), sorted(errors))
+        self.assertListEqual(self.paths[:1], committed)
+        self.assertEqual(b"new", self.read(self.paths[0]))
+        self.assertListEqual(["a.txt", "b.txt"], sorted(os.listdir(self.folder)))
+
+    def test_discard(self):
+        staged = StagedOutputs()
+        committed = []
+        self.stage(staged, committed)
+        staged.discard()
+        self.assertEqual({}, staged.commit())
+        self.assertListEqual([], committed)
+        self.assertEqual(b"old", self.read(self.paths[0]))
+        self.assertListEqual(["a.txt", "sub"], sorted(os.listdir(self.folder)))
+
+    def test_discard_in_progress(self):
+        staged = StagedOutputs()
+        with self.assertRaises(OSError):
+            with staged.open(self.paths[1]) as open_file:
+                open_file.write(b"new")
+                # Such as when the batch is interrupted while sops is still writing
+                staged.discard()
+        with self.assertRaises(OSError):
+            with staged.open(self.paths[1]):
+                pass
+        self.assertEqual(0, len(staged))
+        self.assertListEqual(["a.txt", "sub"], sorted(os.listdir(self.folder)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,5 @@
+import subprocess
+import sys
 from unittest import TestCase
 from unittest.mock import patch, MagicMock, call
 
@@ -16,8 +18,85 @@ class TestHeySops(TestCase):
                 "expected": "forget",
             },
             {"desc": "Clean command", "args": ["clean"], "expected": "clean"},
+            {
+                "desc": "Exec command",
+                "args": ["exec", "--", "env"],
+                "expected": "exec",
+            },
+            {"desc": "Agent command", "args": ["agent"], "expected": "agent"},
+            {"desc": "Watch command", "args": ["watch"], "expected": "watch"},
+            {"desc": "Status command", "args": ["status"], "expected": "status"},
         ]
         for test in tests:
             with self.subTest(msg=test["desc"]):
                 parsed_args = heysops.parse_user_args(test["args"])
                 self.assertEqual(test["expected"], parsed_args.command)
+
+    def test_parse_user_args_global_options(self):
+        parsed_args = heysops.parse_user_args(
+            ["-c", "decrypt", "--timeout", "5", "forget", "a.txt"]
+        )
+        self.assertEqual("forget", parsed_args.command)
+        self.assertEqual("decrypt", parsed_args.config)
+        self.assertEqual(["a.txt"], parsed_args.FILE)
+
+    def test_parse_user_args_stats(self):
+        self.assertIsNone(heysops.parse_user_args(["clean"]).stats)
+        self.assertEqual("table", heysops.parse_user_args(["--stats", "clean"]).stats)
+        self.assertEqual(
+            "json", heysops.parse_user_args(["--stats-json", "clean"]).stats
+        )
+
+    def test_parse_user_args_profile(self):
+        parsed_args = heysops.parse_user_args(["--profile", "clean.pstats", "clean"])
+        self.assertEqual("clean.pstats", parsed_args.profile)
+        self.assertFalse(parsed_args.profile_sampling)
+
+    @patch("libheysops.heysops.setup_logging", MagicMock())
+    @patch("libheysops.profiling.profile_call")
+    def test_main_profile(self, mock_profile_call):
+        with patch("libheysops.Action.clean") as mock_clean:
+            heysops.main(["--profile", "clean.pstats", "--profile-sampling", "clean"])
+            mock_clean.assert_not_called()
+            mock_profile_call.assert_called_once()
+            args, kwargs = mock_profile_call.call_args
+            self.assertEqual("clean.pstats", args[1])
+            self.assertTrue(kwargs["sampling"])
+            args[0]()
+            mock_clean.assert_called_once()
+
+    def test_find_command(self):
+        self.assertEqual("clean", heysops.find_command(["-f", "-v", "clean"]))
+        self.assertEqual("init", heysops.find_command(["-l", "clean", "init"]))
+        self.assertIsNone(heysops.find_command(["-v"]))
+        self.assertIsNone(heysops.find_command(["bogus"]))
+        self.assertIsNone(heysops.find_command(["-c"]))
+
+    def get_imported_modules(self, user_args: list) -> set:
+        # A fresh interpreter, so modules imported by other tests do not count
+        script = (
+            "import sys; from libheysops import heysops; "
+            "heysops.parse_user_args({!r}); print(' '.join(sys.modules))".format(
+                user_args
+            )
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script], stdout=subprocess.PIPE, check=True
+        ).stdout
+        return set(output.decode().split())
+
+    def test_lazy_imports(self):
+        modules = self.get_imported_modules(["-v"])
+        for module in ["libheysops.base", "asyncio", "ruamel.yaml"]:
+            with self.subTest(msg=module):
+                self.assertNotIn(module, modules)
+
+        modules = self.get_imported_modules(["forget", "a.txt"])
+        self.assertIn("libheysops.forget.forget", modules)
+        for module in [
+            "libheysops.encrypt.encrypt",
+            "libheysops.decrypt.decrypt",
+            "ruamel.yaml",
+        ]:
+            with self.subTest(msg=module):
+                self.assertNotIn(module, modules)
@@ -0,0 +1,54 @@
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+
+from libheysops.profiling import profile_call
+
+
+def busy_wait(seconds: float) -> str:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+    return "done"
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_cprofile(self):
+        output_path = os.path.join(self.folder, "heysops.pstats")
+        self.assertEqual("done", profile_call(lambda: busy_wait(0.01), output_path))
+        functions = [x[2] for x in pstats.Stats(output_path).stats]
+        self.assertIn("busy_wait", functions)
+
+    def test_cprofile_raises(self):
+        output_path = os.path.join(self.folder, "heysops.pstats")
+
+        def fail():
+            raise OSError("sops failed")
+
+        with self.assertRaises(OSError):
+            profile_call(fail, output_path)
+        self.assertTrue(os.path.exists(output_path))
+
+    def test_sampling(self):
+        output_path = os.path.join(self.folder, "heysops.folded")
+        self.assertEqual(
+            "done",
+            profile_call(lambda: busy_wait(0.2), output_path, sampling=True),
+        )
+        with open(output_path) as open_output:
+            lines = open_output.read().splitlines()
+        self.assertTrue(any("test_profiling.py:busy_wait" in x for x in lines))
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            self.assertGreater(int(count), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
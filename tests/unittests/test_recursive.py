@@ -0,0 +1,243 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from ruamel.yaml import YAML
+
+from libheysops.base import CONFIG_TEMPLATE
+from libheysops.heysops import main
+from libheysops.recursive import find_configs
+
+FAKE_SOPS = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "fixtures", "fake_sops.py"
+)
+
+
+class TestFindConfigs(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def touch(self, *parts: str) -> str:
+        path = os.path.join(self.folder, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+        return path
+
+    def test_find_configs(self):
+        expected = [
+            self.touch(".heysops.yaml"),
+            self.touch("services", "api", ".heysops.yaml"),
+            self.touch("services", "web", "deploy", ".heysops.yml"),
+        ]
+        self.touch("services", "api", ".heysops.yml")
+        self.touch(".git", ".heysops.yaml")
+        self.touch("services", "web", "node_modules", "pkg", ".heysops.yaml")
+        self.touch("services", "web", "heysops.yaml")
+        os.makedirs(os.path.join(self.folder, "services", "empty"))
+        os.symlink(
+            os.path.join(self.folder, "services"),
+            os.path.join(self.folder, "services", "loop"),
+        )
+
+        self.assertListEqual(expected, find_configs(self.folder))
+
+    def test_find_configs_missing(self):
+        self.assertListEqual([], find_configs(os.path.join(self.folder, "missing")))
+
+
+@unittest.skipIf(os.name == "nt", "The fake sops executable requires a POSIX shell")
+class TestRecursiveFakeSops(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.services = ["api", "web", "worker"]
+        for service in self.services:
+            service_folder = os.path.join(self.folder, service)
+            os.makedirs(service_folder)
+            with open(
+                os.path.join(service_folder, ".heysops.yaml"), "w"
+            ) as open_config:
+                open_config.write(
+                    CONFIG_TEMPLATE.replace(
+                        "gitignore_path: ",
+                        "gitignore_path: {}/.gitignore".format(self.folder),
+                    )
+                    + "".join(
+                        "- decrypted_path: {0}.txt\n  encrypted_path: {0}.txt.sops\n  type: null\n".format(
+                            name
+                        )
+                        for name in ["a", "b"]
+                    )
+                )
+            for name in ["a", "b"]:
+                self.write(service, name + ".txt", service + name)
+        environ = patch.dict(
+            os.environ,
+            {"SOPS_PATH": FAKE_SOPS, "HEYSOPS_CACHE_DIR": tempfile.mkdtemp()},
+        )
+        environ.start()
+        self.addCleanup(shutil.rmtree, os.environ["HEYSOPS_CACHE_DIR"])
+        self.addCleanup(environ.stop)
+        setup_logging = patch("libheysops.heysops.setup_logging")
+        setup_logging.start()
+        self.addCleanup(setup_logging.stop)
+
+    def write(self, service: str, name: str, content: str) -> None:
+        with open(os.path.join(self.folder, service, name), "w") as open_file:
+            open_file.write(content)
+
+    def read(self, service: str, name: str) -> str:
+        with open(os.path.join(self.folder, service, name)) as open_file:
+            return open_file.read()
+
+    def status(self) -> dict:
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            with self.assertRaises(SystemExit) as exit_code:
+                main(["status", "--json", "--exit-code", "--recursive", self.folder])
+        return exit_code.exception.code, {
+            os.path.basename(os.path.dirname(config_path)): {
+                x["decrypted_path"]: x["status"] for x in statuses
+            }
+            for config_path, statuses in json.loads(stdout.getvalue()).items()
+        }
+
+    def test_recursive(self):
+        with patch(
+            "libheysops.base.probe_sops", AsyncMock(return_value="3.7.1")
+        ) as probe:
+            main(["encrypt", "-j", "2", "--recursive", self.folder])
+        probe.assert_called_once()
+        for service in self.services:
+            self.assertEqual(
+                "FAKE-SOPS-ENCRYPTED\n{}a".format(service),
+                self.read(service, "a.txt.sops"),
+            )
+
+        self.write("web", "a.txt", "changed")
+        self.assertEqual(
+            (
+                1,
+                {
+                    "api": {"a.txt": "up to date", "b.txt": "up to date"},
+                    "web": {"a.txt": "plaintext modified", "b.txt": "up to date"},
+                    "worker": {"a.txt": "up to date", "b.txt": "up to date"},
+                },
+            ),
+            self.status(),
+        )
+
+        main(["clean", "--recursive", self.folder])
+        self.assertEqual("FAKE-SOPS-ENCRYPTED\nchanged", self.read("web", "a.txt.sops"))
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "api", "a.txt")))
+
+        main(["decrypt", "--recursive", self.folder])
+        self.assertEqual("changed", self.read("web", "a.txt"))
+        self.assertEqual("workerb", self.read("worker", "b.txt"))
+        code, statuses = self.status()
+        self.assertEqual(0, code)
+        self.assertEqual(
+            {"up to date"},
+            {status for x in statuses.values() for status in x.values()},
+        )
+
+    def test_recursive_gitignore(self):
+        # api has its own .gitignore, the others use the one of the parent folder
+        with open(os.path.join(self.folder, ".gitignore"), "w") as open_gitignore:
+            open_gitignore.write("*.log\n")
+        with open(os.path.join(self.folder, "api", ".gitignore"), "w"):
+            pass
+        for service in self.services:
+            with open(os.path.join(self.folder, service, ".heysops.yaml"), "w") as f:
+                f.write(
+                    CONFIG_TEMPLATE
+                    + "- decrypted_path: x/s.txt\n  encrypted_path: x/s.txt.sops\n  type: null\n"
+                )
+            os.makedirs(os.path.join(self.folder, service, "x"))
+            self.write(service, os.path.join("x", "s.txt"), service)
+
+        # The current directory plays no part in which .gitignore file is used
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(self.folder)
+        main(["encrypt", "--recursive", "."])
+
+        def read_lines(*parts: str) -> list:
+            with open(os.path.join(self.folder, *parts)) as open_file:
+                return open_file.read().splitlines()
+
+        self.assertEqual(
+            [
+                "# BEGIN heysops managed entries",
+                "x/s.txt",
+                "# END heysops managed entries",
+            ],
+            read_lines("api", ".gitignore"),
+        )
+        root_lines = read_lines(".gitignore")
+        self.assertEqual(["*.log", "# BEGIN heysops managed entries"], root_lines[:2])
+        self.assertEqual(["web/x/s.txt", "worker/x/s.txt"], sorted(root_lines[2:-1]))
+        self.assertEqual("# END heysops managed entries", root_lines[-1])
+        yaml = YAML(typ="safe")
+        for service, expected in [
+            ("api", ".gitignore"),
+            ("web", "../.gitignore"),
+            ("worker", "../.gitignore"),
+        ]:
+            with open(os.path.join(self.folder, service, ".heysops.yaml")) as f:
+                self.assertEqual(expected, yaml.load(f)["project"]["gitignore_path"])
+
+    def test_recursive_failure(self):
+        main(["clean", "--recursive", self.folder])
+        # One configuration failing does not stop the others
+        self.write("web", "a.txt.sops", "not encrypted")
+        with self.assertRaises(OSError) as raised:
+            main(["decrypt", "-j", "4", "--recursive", self.folder])
+        self.assertIn(
+            "1 of 3 configurations: {}".format(
+                os.path.join(self.folder, "web", ".heysops.yaml")
+            ),
+            str(raised.exception),
+        )
+        self.assertEqual("apia", self.read("api", "a.txt"))
+        self.assertEqual("webb", self.read("web", "b.txt"))
+
+    def test_recursive_invalid_config(self):
+        # A configuration that can not be loaded fails alone, rather than stopping every other configuration
+        web_config = os.path.join(self.folder, "web", ".heysops.yaml")
+        with open(web_config, "w") as open_config:
+            open_config.write("secrets: [unclosed\n")
+        with self.assertRaises(OSError) as raised:
+            main(["encrypt", "--recursive", self.folder])
+        self.assertIn(
+            "1 of 3 configurations: {}".format(web_config), str(raised.exception)
+        )
+        self.assertEqual("FAKE-SOPS-ENCRYPTED\napia", self.read("api", "a.txt.sops"))
+        self.assertTrue(
+            os.path.exists(os.path.join(self.folder, "worker", "b.txt.sops"))
+        )
+
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            with self.assertRaises(OSError):
+                main(["status", "--json", "--recursive", self.folder])
+        self.assertListEqual(
+            [
+                os.path.join(self.folder, "api", ".heysops.yaml"),
+                os.path.join(self.folder, "worker", ".heysops.yaml"),
+            ],
+            list(json.loads(stdout.getvalue())),
+        )
+
+    def test_recursive_errors(self):
+        with self.assertRaises(ValueError):
+            main(["encrypt", "--recursive", self.folder, "--", "a.txt"])
+        with self.assertRaises(FileNotFoundError):
+            main(["decrypt", "--recursive", os.path.join(self.folder, "api", "x")])
+
+
+if __name__ == "__main__":
+    unittest.main()
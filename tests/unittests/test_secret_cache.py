@@ -0,0 +1,117 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from libheysops.secret_cache import SecretCache
+from libheysops.state import StateStore
+
+
+class TestSecretCache(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_file = tempfile.NamedTemporaryFile(delete=False)
+        temp_file.write(b"encrypted")
+        temp_file.close()
+        self.file_path = temp_file.name
+        self.addCleanup(os.remove, self.file_path)
+
+    def loader(self, value):
+        return MagicMock(
+            side_effect=lambda: (
+                value,
+                self.file_path,
+                StateStore.snapshot(self.file_path),
+            )
+        )
+
+    def test_get(self):
+        cache = SecretCache()
+        load = self.loader(b"secret")
+        self.assertEqual(b"secret", cache.get("a", load))
+        self.assertEqual(b"secret", cache.get("a", load))
+        load.assert_called_once()
+        self.assertEqual(1, len(cache))
+
+        cache.clear()
+        self.assertEqual(b"secret", cache.get("a", load))
+        self.assertEqual(2, load.call_count)
+
+    def test_get_ttl(self):
+        cache = SecretCache(ttl=60)
+        load = self.loader(b"secret")
+        with patch("libheysops.secret_cache.time.monotonic", return_value=100):
+            cache.get("a", load)
+        with patch("libheysops.secret_cache.time.monotonic", return_value=159):
+            cache.get("a", load)
+        load.assert_called_once()
+        with patch("libheysops.secret_cache.time.monotonic", return_value=160):
+            cache.get("a", load)
+        self.assertEqual(2, load.call_count)
+
+    def test_get_lru(self):
+        cache = SecretCache(max_entries=2)
+        loads = {key: self.loader(key) for key in ["a", "b", "c"]}
+        cache.get("a", loads["a"])
+        cache.get("b", loads["b"])
+        # Reading "a" makes "b" the least recently used entry
+        cache.get("a", loads["a"])
+        cache.get("c", loads["c"])
+        self.assertEqual(2, len(cache))
+        cache.get("a", loads["a"])
+        cache.get("b", loads["b"])
+        self.assertEqual(1, loads["a"].call_count)
+        self.assertEqual(2, loads["b"].call_count)
+
+    def test_get_file_changed(self):
+        cache = SecretCache()
+        load = self.loader(b"secret")
+        cache.get("a", load)
+        with open(self.file_path, "wb") as open_file:
+            open_file.write(b"re-encrypted")
+        cache.get("a", load)
+        self.assertEqual(2, load.call_count)
+
+        # Same size, and modified too recently to trust the modification time, so the content is compared
+        with open(self.file_path, "wb") as open_file:
+            open_file.write(b"re-encrypted")
+        cache.get("a", load)
+        self.assertEqual(2, load.call_count)
+        with open(self.file_path, "wb") as open_file:
+            open_file.write(b"RE-ENCRYPTED")
+        cache.get("a", load)
+        self.assertEqual(3, load.call_count)
+
+    def test_get_error(self):
+        cache = SecretCache()
+        self.assertRaises(
+            OSError, cache.get, "a", MagicMock(side_effect=OSError("sops failed"))
+        )
+        self.assertEqual(0, len(cache))
+        self.assertEqual(b"secret", cache.get("a", self.loader(b"secret")))
+
+    def test_get_threads(self):
+        cache = SecretCache()
+        calls = []
+
+        def load():
+            calls.append(1)
+            time.sleep(0.2)
+            return b"secret", self.file_path, StateStore.snapshot(self.file_path)
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get("a", load)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([b"secret"] * 8, results)
+        self.assertEqual(1, len(calls))
+
+
+if __name__ == "__main__":
+    unittest.main()
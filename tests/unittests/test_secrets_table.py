@@ -0,0 +1,67 @@
+import unittest
+
+from libheysops.secrets_table import SecretsTable
+
+
+def entry(name, encrypted_name=None):
+    return {
+        "decrypted_path": name,
+        "encrypted_path": encrypted_name or name + ".sops",
+        "type": None,
+    }
+
+
+class TestSecretsTable(unittest.TestCase):
+    def test_load(self):
+        table = SecretsTable([entry("a"), {}, entry("b")])
+        self.assertEqual(2, len(table))
+        self.assertListEqual([entry("a"), entry("b")], table.to_list())
+        self.assertListEqual(["a", "b"], table.decrypted_paths())
+        self.assertListEqual(["a.sops", "b.sops"], table.encrypted_paths())
+        self.assertListEqual([entry("a"), entry("b")], list(table))
+        self.assertFalse(table.modified)
+        self.assertListEqual([], SecretsTable(None).to_list())
+
+    def test_get(self):
+        table = SecretsTable([entry("a"), entry("b"), entry("c", "a")])
+        self.assertDictEqual(entry("b"), table.get("b"))
+        self.assertDictEqual(entry("b"), table.get("b.sops"))
+        # "a" is both a decrypted and an encrypted path; the earliest entry wins
+        self.assertDictEqual(entry("a"), table.get("a"))
+        self.assertDictEqual({}, table.get("d"))
+
+    def test_upsert(self):
+        table = SecretsTable([entry("a"), entry("b"), entry("c")])
+        table.upsert(entry("b", "new.sops"))
+        self.assertTrue(table.modified)
+        table.upsert(entry("renamed", "c.sops"))
+        table.upsert(entry("d"))
+        self.assertListEqual(
+            [
+                entry("a"),
+                entry("b", "new.sops"),
+                entry("renamed", "c.sops"),
+                entry("d"),
+            ],
+            table.to_list(),
+        )
+        self.assertDictEqual({}, table.get("b.sops"))
+        self.assertDictEqual({}, table.get("c"))
+        self.assertDictEqual(entry("renamed", "c.sops"), table.get("renamed"))
+
+    def test_delete(self):
+        table = SecretsTable([entry("a"), entry("b"), entry("c"), entry("b", "x")])
+        table.delete("missing")
+        self.assertFalse(table.modified)
+        table.delete("b")
+        self.assertTrue(table.modified)
+        self.assertListEqual([entry("a"), entry("c")], table.to_list())
+        table.delete("c.sops")
+        self.assertListEqual([entry("a")], table.to_list())
+        self.assertDictEqual({}, table.get("c"))
+        table.upsert(entry("b"))
+        self.assertListEqual([entry("a"), entry("b")], table.to_list())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from libheysops import state
+from libheysops.state import (
+    CIPHERTEXT,
+    PLAINTEXT,
+    StateStore,
+    file_signature,
+    hash_file,
+)
+
+
+class TestState(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        environ = patch.dict(
+            os.environ, {"HEYSOPS_CACHE_DIR": os.path.join(self.folder, "cache")}
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.file_path = os.path.join(self.folder, "secret.txt")
+        with open(self.file_path, "wb") as open_file:
+            open_file.write(b"secret")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.folder)
+
+    def test_hash_file(self):
+        small = hash_file(self.file_path, key=b"key")
+        self.assertNotEqual(small, hash_file(self.file_path, key=b"other key"))
+        with patch.object(state, "MMAP_THRESHOLD", 1):
+            self.assertEqual(small, hash_file(self.file_path, key=b"key"))
+
+    def test_file_signature(self):
+        self.assertEqual(6, file_signature(self.file_path)["size"])
+        self.assertIsNone(file_signature(os.path.join(self.folder, "missing")))
+
+    def test_is_current(self):
+        store = StateStore()
+        self.assertFalse(store.is_current("secret.txt", PLAINTEXT, self.file_path))
+
+        store.record("secret.txt", PLAINTEXT, store.snapshot(self.file_path))
+        self.assertTrue(store.dirty)
+        self.assertTrue(store.is_current("secret.txt", PLAINTEXT, self.file_path))
+        self.assertFalse(store.is_current("secret.txt", CIPHERTEXT, self.file_path))
+
+        # Same size and modification time, but recorded long ago: the file is not read
+        record = store.records["secret.txt"][PLAINTEXT]
+        record["recorded_ns"] = record["mtime_ns"] + 10 * state.RACY_WINDOW_NS
+        with patch.object(state, "hash_file") as mock_hash_file:
+            self.assertTrue(store.is_current("secret.txt", PLAINTEXT, self.file_path))
+            mock_hash_file.assert_not_called()
+
+        # Same size, different content
+        with open(self.file_path, "wb") as open_file:
+            open_file.write(b"SECRET")
+        self.assertFalse(store.is_current("secret.txt", PLAINTEXT, self.file_path))
+
+        os.remove(self.file_path)
+        self.assertFalse(store.is_current("secret.txt", PLAINTEXT, self.file_path))
+
+        store.record("secret.txt", PLAINTEXT, None)
+        self.assertDictEqual({"secret.txt": {}}, store.records)
+
+    def test_save_and_load(self):
+        config_path = os.path.join(self.folder, ".heysops.yaml")
+        store = StateStore.for_config(config_path)
+        self.assertDictEqual({}, store.records)
+        store.save()
+        self.assertFalse(os.path.exists(store.state_path))
+
+        store.record("secret.txt", PLAINTEXT, store.snapshot(self.file_path))
+        store.save()
+        self.assertFalse(store.dirty)
+
+        loaded = StateStore.for_config(config_path)
+        self.assertDictEqual(store.records, loaded.records)
+        self.assertTrue(loaded.is_current("secret.txt", PLAINTEXT, self.file_path))
+
+        self.assertDictEqual(
+            {}, StateStore.for_config(os.path.join(self.folder, "other.yaml")).records
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import unittest
+
+from libheysops import stats
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self) -> None:
+        stats.enable()
+        self.addCleanup(stats.disable)
+
+    def test_disabled(self):
+        stats.disable()
+        stats.add(stats.SOPS, 1.0)
+        with stats.measure(stats.CONFIG_PARSE):
+            pass
+        stats.enable()
+        self.assertEqual([], stats.get_report()["phases"])
+
+    def test_measure(self):
+        @stats.measure(stats.CONFIG_FLUSH)
+        def flush():
+            stats.count(stats.CONFIG_FLUSH, bytes_written=10)
+
+        flush()
+        flush()
+        with stats.measure(stats.CONFIG_PARSE):
+            stats.count(stats.CONFIG_PARSE, bytes_read=5)
+
+        phases = {x["phase"]: x for x in stats.get_report()["phases"]}
+        self.assertEqual(2, phases[stats.CONFIG_FLUSH]["calls"])
+        self.assertEqual(20, phases[stats.CONFIG_FLUSH]["bytes_written"])
+        self.assertEqual(1, phases[stats.CONFIG_PARSE]["calls"])
+        self.assertEqual(5, phases[stats.CONFIG_PARSE]["bytes_read"])
+        self.assertEqual(
+            [stats.CONFIG_FLUSH, stats.CONFIG_PARSE],
+            [x["phase"] for x in stats.get_report()["phases"]],
+        )
+
+    def test_add_sops_call(self):
+        stats.add_sops_call(["sops", "-d", "a.txt.sops"], 0.5, 0, 100, 80)
+        stats.add_sops_call(["sops", "-d", "b.txt.sops"], 0.25, 128, 10, 0)
+        report = stats.get_report()
+        self.assertEqual(
+            [
+                {
+                    "phase": stats.SOPS,
+                    "calls": 2,
+                    "seconds": 0.75,
+                    "bytes_read": 110,
+                    "bytes_written": 80,
+                }
+            ],
+            report["phases"],
+        )
+        self.assertEqual("b.txt.sops", report["sops_calls"][1]["file"])
+        self.assertEqual(128, report["sops_calls"][1]["returncode"])
+
+    def test_format_report(self):
+        stats.add_sops_call(["sops", "-d", "a.txt.sops"], 0.5, 0, 100, 80)
+        report = stats.get_report()
+        self.assertEqual(report, json.loads(stats.format_report(report, "json")))
+
+        table = stats.format_report(report).splitlines()
+        self.assertTrue(table[0].startswith("phase"))
+        self.assertTrue(table[1].startswith("sops"))
+        self.assertIn("a.txt.sops", "\n".join(table))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from libheysops.base import CONFIG_TEMPLATE
+from libheysops.encrypt.encrypt import Encrypt
+from libheysops.status import status
+from libheysops.status.status import Status
+
+FAKE_SOPS = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "fixtures", "fake_sops.py"
+)
+
+
+@unittest.skipIf(os.name == "nt", "The fake sops executable requires a POSIX shell")
+class TestStatusFakeSops(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.config_path = os.path.join(self.folder, ".heysops.yaml")
+        names = ["a", "b", "c", "d", "e", "f"]
+        with open(self.config_path, "w") as open_config:
+            open_config.write(
+                CONFIG_TEMPLATE.replace(
+                    "gitignore_path: ",
+                    "gitignore_path: {}/.gitignore".format(self.folder),
+                )
+                + "".join(
+                    "- decrypted_path: {0}.txt\n  encrypted_path: {0}.txt.sops\n  type: null\n".format(
+                        name
+                    )
+                    for name in names
+                )
+            )
+        for name in names:
+            self.write(name + ".txt", name)
+        environ = patch.dict(
+            os.environ,
+            {"SOPS_PATH": FAKE_SOPS, "HEYSOPS_CACHE_DIR": tempfile.mkdtemp()},
+        )
+        environ.start()
+        self.addCleanup(shutil.rmtree, os.environ["HEYSOPS_CACHE_DIR"])
+        self.addCleanup(environ.stop)
+
+        Encrypt(config=self.config_path).start(
+            FILE=["a.txt", "b.txt", "c.txt", "d.txt", "f.txt"]
+        )
+        self.write("b.txt", "changed")
+        self.write("c.txt.sops", "FAKE-SOPS-ENCRYPTED\nchanged")
+        os.remove(os.path.join(self.folder, "d.txt"))
+        self.write("f.txt", "changed")
+        self.write("f.txt.sops", "FAKE-SOPS-ENCRYPTED\nchanged elsewhere")
+
+    def write(self, name: str, content: str) -> None:
+        with open(os.path.join(self.folder, name), "w") as open_file:
+            open_file.write(content)
+
+    def run_status(self, **kwargs) -> Status:
+        # sops must never run, so an executable that does not exist is fine
+        with patch.dict(os.environ, {"SOPS_PATH": "/does/not/exist/sops"}):
+            action = Status(config=self.config_path)
+            with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+                action.start(**kwargs)
+        self.output = stdout.getvalue()
+        return action
+
+    def test_statuses(self):
+        action = self.run_status(json=True)
+        self.assertEqual(
+            [
+                ("a.txt", status.UP_TO_DATE),
+                ("b.txt", status.PLAINTEXT_MODIFIED),
+                ("c.txt", status.CIPHERTEXT_NEWER),
+                ("d.txt", status.MISSING_PLAINTEXT),
+                ("e.txt", status.MISSING_CIPHERTEXT),
+                ("f.txt", status.CONFLICT),
+            ],
+            [(x["decrypted_path"], x["status"]) for x in json.loads(self.output)],
+        )
+        self.assertEqual(0, action.returncode)
+
+    def test_files_and_exit_code(self):
+        action = self.run_status(FILE=["a.txt.sops"], exit_code=True)
+        self.assertEqual("up to date          a.txt\n", self.output)
+        self.assertEqual(0, action.returncode)
+
+        action = self.run_status(FILE=["a.txt", "b.txt"], exit_code=True)
+        self.assertEqual(1, action.returncode)
+
+    def test_without_state(self):
+        with patch.dict(os.environ, {"HEYSOPS_CACHE_DIR": tempfile.mkdtemp()}):
+            self.addCleanup(shutil.rmtree, os.environ["HEYSOPS_CACHE_DIR"])
+            os.utime(os.path.join(self.folder, "a.txt"), (1, 1))
+            os.utime(os.path.join(self.folder, "b.txt.sops"), (1, 1))
+            self.run_status(FILE=["a.txt", "b.txt"], json=True)
+        self.assertEqual(
+            [status.CIPHERTEXT_NEWER, status.PLAINTEXT_MODIFIED],
+            [x["status"] for x in json.loads(self.output)],
+        )
+
+    def test_report_recursive_error(self):
+        statuses = [
+            {
+                "decrypted_path": "a.txt",
+                "encrypted_path": "a.txt.sops",
+                "status": "conflict",
+            }
+        ]
+        results = [
+            ("api/.heysops.yaml", None, None, OSError("Unable to load configuration")),
+            ("web/.heysops.yaml", None, statuses, None),
+        ]
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            with self.assertLogs(level="ERROR") as logs:
+                with self.assertRaises(OSError) as raised:
+                    Status.report_recursive(results, json=True)
+        self.assertIn("1 of 2 configurations: api/.heysops.yaml", str(raised.exception))
+        self.assertIn("Unable to load configuration", logs.output[0])
+        # The configurations that were loaded are still reported
+        self.assertDictEqual(
+            {"web/.heysops.yaml": statuses}, json.loads(stdout.getvalue())
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from libheysops.base import CONFIG_TEMPLATE
+from libheysops.watch.watch import Watch
+from libheysops.watch.watcher import InotifyWatcher, PollingWatcher, get_watcher
+
+FAKE_SOPS = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "fixtures", "fake_sops.py"
+)
+
+
+class TestWatchers(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.file_path = os.path.join(self.folder, "a.txt")
+        with open(self.file_path, "w") as open_file:
+            open_file.write("one")
+        self.files = {self.file_path: "a.txt"}
+
+    def check_watcher(self, watcher) -> None:
+        self.addCleanup(watcher.close)
+        self.assertEqual(set(), watcher.read(timeout=0.05))
+
+        # Saved by writing a new file and renaming it over the old one, as editors do
+        temp_path = os.path.join(self.folder, "a.txt.swp")
+        with open(temp_path, "w") as open_file:
+            open_file.write("two, and longer")
+        os.replace(temp_path, self.file_path)
+        self.assertEqual({"a.txt"}, watcher.read(timeout=5))
+
+        with open(os.path.join(self.folder, "b.txt"), "w") as open_file:
+            open_file.write("not watched")
+        self.assertEqual(set(), watcher.read(timeout=0.2))
+
+    def test_polling(self):
+        self.check_watcher(PollingWatcher(self.files, interval=0.01))
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_inotify(self):
+        self.check_watcher(InotifyWatcher(self.files))
+
+    def test_get_watcher(self):
+        watcher = get_watcher(self.files, poll=True)
+        self.assertIsInstance(watcher, PollingWatcher)
+
+        # A missing folder cannot be watched with inotify
+        watcher = get_watcher({os.path.join(self.folder, "missing", "a.txt"): "a"})
+        self.assertIsInstance(watcher, PollingWatcher)
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self) -> None:
+        with patch.object(Watch, "__init__", lambda x, **y: None):
+            self.action = Watch()
+        self.action._stopped = threading.Event()
+
+    def test_wait_for_changes(self):
+        watcher = MagicMock()
+        watcher.read.side_effect = [set(), {"a.txt"}, {"b.txt"}, {"a.txt"}, set()]
+        self.assertEqual({"a.txt", "b.txt"}, self.action.wait_for_changes(watcher, 0.1))
+        self.assertEqual(5, watcher.read.call_count)
+
+    def test_wait_for_changes_stopped(self):
+        watcher = MagicMock()
+        watcher.read.return_value = set()
+        self.action.stop()
+        self.assertEqual(set(), self.action.wait_for_changes(watcher, 0.1))
+        watcher.read.assert_not_called()
+
+
+@unittest.skipIf(os.name == "nt", "The fake sops executable requires a POSIX shell")
+class TestWatchFakeSops(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.config_path = os.path.join(self.folder, ".heysops.yaml")
+        with open(self.config_path, "w") as open_config:
+            open_config.write(
+                CONFIG_TEMPLATE.replace(
+                    "gitignore_path: ",
+                    "gitignore_path: {}/.gitignore".format(self.folder),
+                )
+                + "- decrypted_path: a.txt\n  encrypted_path: a.txt.sops\n  type: null\n"
+                + "- decrypted_path: b.txt\n  encrypted_path: b.txt.sops\n  type: null\n"
+            )
+        for name in ["a.txt", "b.txt"]:
+            self.write(name, name)
+        environ = patch.dict(
+            os.environ,
+            {
+                "SOPS_PATH": FAKE_SOPS,
+                "HEYSOPS_CACHE_DIR": tempfile.mkdtemp(),
+            },
+        )
+        environ.start()
+        self.addCleanup(shutil.rmtree, os.environ["HEYSOPS_CACHE_DIR"])
+        self.addCleanup(environ.stop)
+
+    def write(self, name: str, content: str) -> None:
+        with open(os.path.join(self.folder, name), "w") as open_file:
+            open_file.write(content)
+
+    def read(self, name: str) -> bytes:
+        try:
+            with open(os.path.join(self.folder, name), "rb") as open_file:
+                return open_file.read()
+        except FileNotFoundError:
+            return b""
+
+    def wait_for(self, name: str, content: bytes) -> None:
+        deadline = time.monotonic() + 10
+        while self.read(name) != content and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(content, self.read(name))
+
+    def test_watch(self):
+        for poll in [False, True]:
+            with self.subTest(poll=poll):
+                action = Watch(config=self.config_path)
+                action.encrypt_file_async = MagicMock(
+                    side_effect=action.encrypt_file_async
+                )
+                thread = threading.Thread(
+                    target=action.start,
+                    kwargs={"debounce": 0.05, "poll": poll, "interval": 0.01},
+                )
+                thread.start()
+                try:
+                    self.wait_for("a.txt.sops", b"FAKE-SOPS-ENCRYPTED\na.txt")
+                    self.wait_for("b.txt.sops", b"FAKE-SOPS-ENCRYPTED\nb.txt")
+                    encrypted = action.encrypt_file_async.call_count
+
+                    self.write("a.txt", "changed {}".format(poll))
+                    self.wait_for(
+                        "a.txt.sops",
+                        "FAKE-SOPS-ENCRYPTED\nchanged {}".format(poll).encode(),
+                    )
+                    # Only the changed file is encrypted again
+                    self.assertEqual(
+                        ["a.txt"],
+                        [
+                            x.kwargs["file_entry"]
+                            for x in action.encrypt_file_async.call_args_list[
+                                encrypted:
+                            ]
+                        ],
+                    )
+
+                    # A removed plaintext stays in the configuration
+                    os.remove(os.path.join(self.folder, "b.txt"))
+                    time.sleep(0.2)
+                finally:
+                    action.stop()
+                    thread.join(10)
+                self.assertFalse(thread.is_alive())
+                self.assertIn("b.txt.sops", self.read(".heysops.yaml").decode())
+                self.write("a.txt", "a.txt")
+                self.write("b.txt", "b.txt")
+
+
+if __name__ == "__main__":
+    unittest.main()